@@ -0,0 +1,321 @@
+"""Batch exports: many export specs served by one scan of users.
+
+POST /exports/batch queues one export per spec, all with the same
+`batch_id`. A worker that claims one of them also claims the batch's other
+runnable members (job_queue.claim_batch) and runs them together:
+
+- one cursor, in id order, selects the union of the members' columns plus
+  one flag per member telling whether the row passes that member's filters;
+  its WHERE is the OR of the members' filters;
+- every partition is fanned out: each member gets the rows it matched,
+  projected to its own columns, encoded with its own encoder and dialect,
+  and written to its own file;
+- each member keeps its own Export row: status, progress, metrics,
+  compression and cancellation. A member that is cancelled or fails is
+  dropped from the scan and the others carry on.
+
+Shared scans write CSV and NDJSON with the orm engine: no shards, split parts
+or samples. Members do not checkpoint. A failed member is resumed on its own
+with a normal export job, because its options are those of a normal export.
+Totals start as planner estimates, so members are never counted one by one.
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from operator import itemgetter
+
+from sqlalchemy import select, and_, or_, true
+
+from app import metrics, query_plan, result_cache, row_count, storage
+from app.config import settings
+from app.database import ExportSessionLocal
+from app.export_service import (
+    ALL_COLUMNS, CancelFlag, ExportProgress, active_tasks, build_query, cancel_flag, resolve_columns, update_status,
+)
+from app.file_writer import BufferedFileWriter
+from app.filters import filters_from_options
+from app.formats import EXTENSIONS as FORMAT_EXTENSIONS, encode_ndjson
+from app.governor import governor, batch_footprint
+from app.models import User
+from app.row_encoder import compile_encoder, encode_header
+
+logger = logging.getLogger(__name__)
+
+# Formats a shared scan can write
+BATCH_FORMATS = ("csv", "ndjson")
+
+# Plan statistics of shared scans are kept under this shape
+BATCH_SHAPE = "batch"
+
+BATCH_SCANS = metrics.Counter("export_batch_scans_total", "Shared scans run for export batches")
+BATCH_ROWS_SCANNED = metrics.Counter("export_batch_rows_scanned_total", "Rows read by shared batch scans")
+BATCH_ROWS_FANNED = metrics.Counter("export_batch_rows_fanned_total", "Rows handed to batch members by shared scans")
+
+
+def shareable(options: dict) -> bool:
+    """Whether an export with these job options can run on a shared scan.
+
+    POST /exports/batch refuses specs that are not, and the worker runs any
+    member that is not on its own.
+    """
+    return (
+        (options.get("export_format") or "csv") in BATCH_FORMATS
+        and (options.get("export_engine") or "orm") == "orm"
+        and (options.get("shards") or 1) == 1
+        and not options.get("split")
+        and not options.get("sample")
+        and not options.get("delta")
+    )
+
+
+def shared_columns(member_columns) -> list:
+    """Union of the members' columns, in table order."""
+    wanted = {column for columns in member_columns for column in columns}
+    return [column for column in ALL_COLUMNS if column in wanted]
+
+
+def shared_query(member_conditions, columns):
+    """The batch's one SELECT: `columns`, a match flag per member, and only rows some member wants."""
+    flags = [
+        (and_(*conditions) if conditions else true()).label(f"member_{i}")
+        for i, conditions in enumerate(member_conditions)
+    ]
+    query = select(*[getattr(User, column) for column in columns], *flags)
+    if all(member_conditions):
+        query = query.where(or_(*[and_(*conditions) for conditions in member_conditions]))
+    return query.order_by(User.id)
+
+
+class BatchMember:
+    """One export of a batch: its filters, projection, encoder, file and progress."""
+
+    def __init__(self, export_id: str, options: dict):
+        self.export_id = export_id
+        self.options = options
+        self.filters = filters_from_options(options)
+        self.query, self.conditions = build_query(self.filters)
+        self.export_columns = resolve_columns(options.get("columns"))
+        self.export_format = options.get("export_format") or "csv"
+        self.compression = options.get("compression") or settings.EXPORT_COMPRESSION or None
+        delimiter = options.get("delimiter") or ","
+        quotechar = options.get("quotechar") or '"'
+        if self.export_format == "csv":
+            self.encode = compile_encoder(self.export_columns, delimiter, quotechar)
+            self.header = encode_header(self.export_columns, delimiter, quotechar)
+        else:
+            self.encode = functools.partial(encode_ndjson, export_columns=self.export_columns)
+            self.header = b""
+        self.flag = None
+        self.pick = None
+        self.file_path = None
+        self.compressed_path = None
+        self.out = None
+        self.progress = None
+        self.job = None
+        self.rows = 0
+        self.finished = False
+
+    @property
+    def cancelled(self) -> bool:
+        return cancel_flag(self.export_id).cancelled
+
+    def bind(self, columns, flag: int):
+        """Where this member's columns and match flag sit in the shared rows."""
+        positions = [columns.index(column) for column in self.export_columns]
+        if len(positions) == 1:
+            position = positions[0]
+            self.pick = lambda row: (row[position],)
+        else:
+            self.pick = itemgetter(*positions)
+        self.flag = flag
+
+    async def start(self, export_dir: str, batch_rows: int):
+        await update_status(self.export_id, status="processing", started_at=datetime.now(timezone.utc))
+        with self.job.stage("count"):
+            total_rows, estimated = await row_count.initial_total(
+                self.query, "estimate", filtered=bool(self.conditions)
+            )
+        await update_status(self.export_id, total_rows=total_rows, total_rows_estimated=estimated)
+        self.progress = ExportProgress(self.export_id, total_rows, estimated=estimated, batch_rows=batch_rows)
+        self.file_path = os.path.join(export_dir, f"export_{self.export_id}{FORMAT_EXTENSIONS[self.export_format]}")
+        # Each member compresses as it writes: no second pass over its file
+        self.out = BufferedFileWriter(
+            self.file_path, compression=self.compression, compression_level=self.options.get("compression_level")
+        )
+        self.compressed_path = self.out.compressed_path
+        await self.out.__aenter__()
+        self.progress.writers.append(self.out)
+        if self.header:
+            await self.out.write(self.header)
+
+    async def write(self, rows):
+        job = self.job
+        started = time.perf_counter()
+        chunk = self.encode(rows)
+        encoded = time.perf_counter()
+        await self.out.write(chunk)
+        job.add("encode", encoded - started, batch=True)
+        job.add("write", time.perf_counter() - encoded, batch=True)
+        job.batch(len(rows), len(chunk))
+        self.rows += len(rows)
+        await self.progress.update(0, self.rows)
+
+    async def finish(self):
+        out, self.out = self.out, None
+        await out.close()
+        artifact = {
+            "file_size": os.path.getsize(self.file_path),
+            "format": self.export_format,
+            # The scan itself was the exact count
+            "total_rows": self.rows,
+            "total_rows_estimated": False,
+        }
+        if self.compression:
+            compressed_size = out.compressed_size
+            artifact.update(
+                compression=self.compression,
+                compressed_path=self.compressed_path,
+                compressed_size=compressed_size,
+                compression_ratio=round(compressed_size / artifact["file_size"], 4) if artifact["file_size"] else None,
+            )
+        artifact["expires_at"] = storage.expires_at(self.options.get("ttl"))
+        await update_status(self.export_id, status="completed", file_path=self.file_path, **artifact)
+        self.finished = True
+
+    async def abort(self):
+        """Stop the writer and delete whatever this member wrote."""
+        if self.finished:
+            return
+        if self.out is not None:
+            out, self.out = self.out, None
+            try:
+                await out.__aexit__(RuntimeError, None, None)
+            except Exception:
+                pass
+        await asyncio.to_thread(storage.remove_files, [path for path in (self.file_path, self.compressed_path) if path])
+
+    async def cancel(self):
+        await self.abort()
+        await update_status(self.export_id, status="cancelled")
+
+    async def fail(self, error: Exception):
+        logger.error(f"Batch export {self.export_id} failed: {error}")
+        await self.abort()
+        await update_status(self.export_id, status="failed", error=str(error), expires_at=storage.expires_at())
+
+
+async def _scan(live: list, batch_rows: int) -> int:
+    """Run the shared cursor and fan its rows out to `live`, which loses members that stop.
+
+    Returns the rows read.
+    """
+    columns = shared_columns(member.export_columns for member in live)
+    for i, member in enumerate(live):
+        member.bind(columns, len(columns) + i)
+    query = shared_query([member.conditions for member in live], columns)
+    BATCH_SCANS.inc()
+
+    scanned = 0
+    async with ExportSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_rows))
+        fetch_started = time.perf_counter()
+        async for partition in result.partitions(batch_rows):
+            fetch_seconds = time.perf_counter() - fetch_started
+            scanned += len(partition)
+            BATCH_ROWS_SCANNED.inc(len(partition))
+            for member in list(live):
+                if member.cancelled:
+                    live.remove(member)
+                    await member.cancel()
+                    continue
+                member.job.add("fetch", fetch_seconds, batch=True)
+                rows = [member.pick(row) for row in partition if row[member.flag]]
+                if not rows:
+                    continue
+                try:
+                    await member.write(rows)
+                except Exception as e:
+                    live.remove(member)
+                    await member.fail(e)
+                    continue
+                BATCH_ROWS_FANNED.inc(len(rows))
+            if not live:
+                # Everyone stopped: no reason to read on
+                break
+            fetch_started = time.perf_counter()
+    return scanned
+
+
+async def _finish(member: BatchMember):
+    try:
+        if member.cancelled:
+            await member.cancel()
+        else:
+            await member.finish()
+    except Exception as e:
+        await member.fail(e)
+
+
+async def process_batch(batch_id, jobs):
+    """Run the batch members `jobs`, as (export_id, options), over a single scan of users."""
+    members = [BatchMember(str(export_id), options) for export_id, options in jobs]
+    for member in members:
+        active_tasks[member.export_id] = CancelFlag()
+        member.job = metrics.start_job(member.export_id, member.export_format, "batch")
+    key = f"batch-{batch_id}"
+    started = time.perf_counter()
+    live = []
+
+    try:
+        compressions = {member.compression for member in members if member.compression}
+        footprint = batch_footprint(
+            len(shared_columns(member.export_columns for member in members)) + len(members), len(members),
+            "zstd" if "zstd" in compressions else next(iter(compressions), None),
+        )
+        granted = await governor.acquire(key, footprint.want, footprint.minimum)
+        batch_rows = footprint.batch_rows_for(granted)
+
+        export_dir = storage.storage_dir()
+        os.makedirs(export_dir, exist_ok=True)
+        for member in members:
+            if member.cancelled:
+                await update_status(member.export_id, status="cancelled")
+                continue
+            try:
+                await member.start(export_dir, batch_rows)
+            except Exception as e:
+                await member.fail(e)
+                continue
+            live.append(member)
+
+        if live:
+            logger.info(f"Batch {batch_id}: one scan for {len(live)} exports")
+            scanned = await _scan(live, batch_rows)
+            # Close and finalize the members side by side
+            await asyncio.gather(*(_finish(member) for member in live))
+
+            try:
+                await query_plan.record_run(BATCH_SHAPE, scanned, time.perf_counter() - started)
+            except Exception as e:
+                logger.warning(f"Plan stats error: {e}")
+            try:
+                await result_cache.evict()
+            except Exception as e:
+                logger.warning(f"Cache eviction error: {e}")
+    except Exception as e:
+        # The shared cursor failed: every member still on it fails with it
+        logger.error(f"Batch {batch_id} error: {e}")
+        for member in live:
+            if not member.finished:
+                await member.fail(e)
+    finally:
+        # Interrupted (e.g. a worker draining): drop partial files, the jobs go back to the queue
+        for member in live:
+            await member.abort()
+        for member in members:
+            metrics.finish_job(member.export_id, "interrupted")
+            active_tasks.pop(member.export_id, None)
+        governor.release(key)
@@ -0,0 +1,100 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip always works
+    zstandard = None
+
+CODECS = ("gzip", "zstd")
+
+# File suffix and HTTP Content-Encoding token per codec
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+CONTENT_ENCODINGS = {"gzip": "gzip", "zstd": "zstd"}
+
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+LEVEL_RANGES = {"gzip": (1, 9), "zstd": (1, 22)}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def codec_available(codec: str) -> bool:
+    if codec == "zstd":
+        return zstandard is not None
+    return codec in CODECS
+
+
+def validate_level(codec: str, level: int = None) -> int:
+    if level is None:
+        return DEFAULT_LEVELS[codec]
+    low, high = LEVEL_RANGES[codec]
+    if not low <= level <= high:
+        raise ValueError(f"{codec} level must be between {low} and {high}")
+    return level
+
+
+class _ZstdCompressor:
+    """Gives zstandard the same compress()/flush() shape as zlib."""
+
+    def __init__(self, level: int):
+        self._cobj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._cobj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._cobj.flush()
+
+
+def new_compressor(codec: str, level: int = None):
+    level = validate_level(codec, level)
+    if codec == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        return _ZstdCompressor(level)
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+
+def compress_file(src_path: str, dst_path: str, codec: str, level: int = None) -> int:
+    """Compress src into dst in CHUNK_SIZE steps. Blocking, run it in a thread.
+
+    Returns the compressed size in bytes.
+    """
+    compressor = new_compressor(codec, level)
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(compressor.compress(chunk))
+        dst.write(compressor.flush())
+        return dst.tell()
+
+
+def iter_compressed(path: str, codec: str, level: int = None):
+    """On-the-fly fallback used when no stored artifact matches the client."""
+    compressor = new_compressor(codec, level)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def parse_accept_encoding(header: str) -> set:
+    """Return the encodings a client accepts, ignoring those with q=0."""
+    accepted = set()
+    for token in (header or "").split(","):
+        parts = [p.strip() for p in token.split(";")]
+        name = parts[0].lower()
+        if not name:
+            continue
+        if any(p.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for p in parts[1:]):
+            continue
+        accepted.add(name)
+    return accepted
@@ -18,6 +18,104 @@ class Settings:
     DB_HOST = os.getenv("DB_HOST", _default_host)
     DB_PORT = os.getenv("DB_PORT", "5432")
     DB_NAME = os.getenv("DB_NAME", "exports_db")
+    # Log every SQL statement (development only)
+    DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+    # Control-plane pool (requests, queue, progress): short queries, fail fast when exhausted
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    # Export pool: one connection per running cursor, shard, COPY stream or full count
+    EXPORT_POOL_SIZE = int(os.getenv("EXPORT_POOL_SIZE", "8"))
+    EXPORT_POOL_TIMEOUT = float(os.getenv("EXPORT_POOL_TIMEOUT", "300"))
+
+    # Memory budget shared by running exports and streamed responses (see app/governor.py)
+    EXPORT_MEMORY_BUDGET = int(os.getenv("EXPORT_MEMORY_BUDGET", str(64 * 1024 ** 2)))
+    # How long a stream or gzip download waits for budget before answering 503
+    EXPORT_MEMORY_WAIT = float(os.getenv("EXPORT_MEMORY_WAIT", "30"))
+
+    # Cost guard (see app/query_plan.py), in planner cost units; 0 turns a limit off.
+    # Costlier jobs are queued with EXPORT_LOW_PRIORITY, or refused over EXPORT_COST_REJECT
+    EXPORT_COST_LOW_PRIORITY = float(os.getenv("EXPORT_COST_LOW_PRIORITY", "500000"))
+    EXPORT_COST_REJECT = float(os.getenv("EXPORT_COST_REJECT", "0"))
+    EXPORT_LOW_PRIORITY = int(os.getenv("EXPORT_LOW_PRIORITY", "-10"))
+
+    # GET /exports/csv/preview (see app/preview.py): statement timeout in seconds and
+    # how many rows the size estimate samples
+    PREVIEW_TIMEOUT = float(os.getenv("PREVIEW_TIMEOUT", "5"))
+    PREVIEW_SAMPLE_ROWS = int(os.getenv("PREVIEW_SAMPLE_ROWS", "10000"))
+
+    # Most export specs one POST /exports/batch may submit (see app/batch.py)
+    EXPORT_BATCH_MAX = int(os.getenv("EXPORT_BATCH_MAX", "50"))
+
+    # Upper bound on per-request `shards`; each shard holds its own pooled connection.
+    # Jobs are further capped so WORKER_CONCURRENCY of them fit in EXPORT_POOL_SIZE
+    MAX_EXPORT_SHARDS = int(os.getenv("MAX_EXPORT_SHARDS", "4"))
+
+    # Write-behind of in-memory progress to the exports table
+    PROGRESS_FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", "1.0"))
+    PROGRESS_FLUSH_ROWS = int(os.getenv("PROGRESS_FLUSH_ROWS", "50000"))
+
+    # Codec used when a request does not ask for one ("" = plain CSV only)
+    EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "")
+    # Level for on-the-fly gzip when no stored artifact matches the client
+    DOWNLOAD_GZIP_LEVEL = int(os.getenv("DOWNLOAD_GZIP_LEVEL", "6"))
+
+    # How process_export learns the row total: exact, concurrent or estimate (see app/row_count.py)
+    EXPORT_COUNT_STRATEGY = os.getenv("EXPORT_COUNT_STRATEGY", "exact")
+
+    # Rows fetched and encoded per chunk by the ORM export engine
+    EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "5000"))
+
+    # Rows fetched and encoded per chunk by GET /exports/csv/stream
+    STREAM_BATCH_ROWS = int(os.getenv("STREAM_BATCH_ROWS", "5000"))
+
+    # Rows per Parquet row group / Arrow record batch / NDJSON write
+    FORMAT_BATCH_ROWS = int(os.getenv("FORMAT_BATCH_ROWS", "50000"))
+
+    # Storage lifecycle (see app/storage.py): default time an export's files are kept
+    # after it finishes (0 = until evicted for quota), disk quota for EXPORT_STORAGE_PATH
+    # (0 = none), and how often the sweeper runs and how many rows it expires per batch
+    EXPORT_TTL = int(os.getenv("EXPORT_TTL", str(7 * 24 * 3600)))
+    EXPORT_STORAGE_QUOTA = int(os.getenv("EXPORT_STORAGE_QUOTA", str(50 * 1024 ** 3)))
+    STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL", "300"))
+    STORAGE_SWEEP_BATCH = int(os.getenv("STORAGE_SWEEP_BATCH", "500"))
+
+    # Result cache for identical export requests: how long and how many bytes of
+    # artifacts are reused (the files themselves follow EXPORT_TTL / ttl)
+    EXPORT_CACHE_TTL = int(os.getenv("EXPORT_CACHE_TTL", "3600"))
+    EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+    # Off-loop export file writer (see app/file_writer.py)
+    EXPORT_WRITE_BUFFER = int(os.getenv("EXPORT_WRITE_BUFFER", str(1024 * 1024)))
+    EXPORT_WRITE_QUEUE_DEPTH = int(os.getenv("EXPORT_WRITE_QUEUE_DEPTH", "4"))
+    EXPORT_FSYNC = os.getenv("EXPORT_FSYNC", "complete")  # never, complete, checkpoint
+    EXPORT_DROP_PAGE_CACHE = os.getenv("EXPORT_DROP_PAGE_CACHE", "true").lower() == "true"
+    EXPORT_O_DIRECT = os.getenv("EXPORT_O_DIRECT", "false").lower() == "true"
+
+    # Checkpoint every N rows (ORM) or N ids (COPY) so a crashed export can resume; 0 disables
+    EXPORT_CHECKPOINT_ROWS = int(os.getenv("EXPORT_CHECKPOINT_ROWS", "100000"))
+
+    # Metrics (see app/metrics.py): time one batch in N per stage (0 = off), loop lag sample interval
+    METRICS_BATCH_SAMPLE = int(os.getenv("METRICS_BATCH_SAMPLE", "10"))
+    METRICS_LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+    # Port for GET /metrics in `python -m app.worker` (0 = don't serve)
+    WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+    # LISTEN/NOTIFY channel for progress and cancel events (see app/notifications.py)
+    NOTIFY_CHANNEL = os.getenv("NOTIFY_CHANNEL", "export_events")
+    NOTIFY_RECONNECT_INTERVAL = float(os.getenv("NOTIFY_RECONNECT_INTERVAL", "5"))
+    # Comment line sent on idle GET /exports/{id}/events streams
+    SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+
+    # Job queue on the exports table, drained by `python -m app.worker`
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+    WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2.0"))
+    WORKER_LEASE_SECONDS = int(os.getenv("WORKER_LEASE_SECONDS", "60"))
+    WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "15"))
+    WORKER_MAX_ATTEMPTS = int(os.getenv("WORKER_MAX_ATTEMPTS", "3"))
+    WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+    # Also run a worker inside the API process (handy for local dev)
+    EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "false").lower() == "true"
 
     @property
     def DATABASE_URL(self):
@@ -1,13 +1,57 @@
+import time
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
+from app import metrics
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Default async pool that records how long each checkout waited."""
+
+    pool_name = "control"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started, pool=self.pool_name)
 
-# Create async engine
+
+class ExportQueuePool(TimedQueuePool):
+    pool_name = "export"
+
+
+# Control plane: status, downloads, queue polling, progress flushes. Short
+# queries only, so API requests never wait behind a long export cursor.
 engine = create_async_engine(
     settings.DATABASE_URL,
-    echo=True,  # Shows SQL queries in logs (good for development)
+    echo=settings.DB_ECHO,  # Shows SQL queries in logs (good for development)
+    poolclass=TimedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
 )
 
+# Export cursors, COPY streams and full counts: held for minutes, capped separately
+export_engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=settings.DB_ECHO,
+    poolclass=ExportQueuePool,
+    pool_size=settings.EXPORT_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=settings.EXPORT_POOL_TIMEOUT,
+)
+
+ENGINES = (engine, export_engine)
+
+metrics.Gauge("db_pool_checked_out", "Control-plane pooled connections currently in use",
+              collect=lambda: engine.sync_engine.pool.checkedout())
+metrics.Gauge("db_export_pool_checked_out", "Export pooled connections currently in use",
+              collect=lambda: export_engine.sync_engine.pool.checkedout())
+
 # Create session factory
 AsyncSessionLocal = sessionmaker(
     bind=engine,
@@ -15,6 +59,13 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False,
 )
 
+# Sessions for export cursors; never use these for request handling
+ExportSessionLocal = sessionmaker(
+    bind=export_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
+
 # Base class for models
 Base = declarative_base()
 
@@ -22,4 +73,4 @@ Base = declarative_base()
 # Dependency to get DB session
 async def get_db():
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
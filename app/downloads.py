@@ -0,0 +1,200 @@
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from uuid import uuid4
+
+from starlette.responses import Response
+
+CHUNK_SIZE = 256 * 1024
+
+# More ranges than this in one request is treated as abuse and answered in full
+MAX_RANGES = 16
+
+
+def make_etag(export_id: str, encoding: str, stat: os.stat_result) -> str:
+    """Strong validator for one representation (plain or stored-compressed) of an export."""
+    return f'"{export_id}-{encoding}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    # Strong comparison: weak validators never match
+    return "*" in tags or etag in tags
+
+
+def parse_range(header: str, size: int):
+    """Parse a `bytes=` Range header into a list of inclusive (start, end) tuples.
+
+    Returns None when the header should be ignored (unknown unit, malformed,
+    too many ranges) and [] when no range is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if start == "":
+                # Suffix range: last N bytes
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end else size - 1
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        if start > end:
+            return None
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+class FileRangeResponse(Response):
+    """Serves a file or byte ranges of it, using zero-copy send when the server offers it.
+
+    Servers advertising the `http.response.zerocopysend` ASGI extension get the
+    file descriptor directly; otherwise chunks are read in a worker thread.
+    """
+
+    def __init__(self, path: str, size: int, ranges=None, status_code: int = 200, headers: dict = None, media_type: str = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=None)
+        self.path = path
+        self.size = size
+        self.ranges = ranges
+        self.file_media_type = media_type
+        self.boundary = None
+        self.parts = []
+
+        if ranges and len(ranges) > 1:
+            self.boundary = uuid4().hex
+            self.headers["content-type"] = f"multipart/byteranges; boundary={self.boundary}"
+            for start, end in ranges:
+                head = (
+                    f"--{self.boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+                self.parts.append((head, start, end))
+            tail = f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+            body_length = sum(len(h) + (e - s + 1) for h, s, e in self.parts)
+            body_length += 2 * (len(self.parts) - 1) + len(tail)
+            self.tail = tail
+            self.headers["content-length"] = str(body_length)
+        else:
+            if media_type:
+                self.headers["content-type"] = media_type
+            if ranges:
+                start, end = ranges[0]
+                self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+                self.headers["content-length"] = str(end - start + 1)
+            else:
+                self.headers["content-length"] = str(size)
+
+    async def _send_file_range(self, send, f, start, end, zerocopy, more_body):
+        count = end - start + 1
+        if zerocopy:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f,
+                "offset": start,
+                "count": count,
+                "more_body": more_body,
+            })
+            return
+
+        f.seek(start)
+        remaining = count
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({
+                "type": "http.response.body",
+                "body": chunk,
+                "more_body": more_body or remaining > 0,
+            })
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if scope.get("method") == "HEAD" or self.size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+
+        with open(self.path, "rb") as f:
+            if self.boundary is None:
+                start, end = self.ranges[0] if self.ranges else (0, self.size - 1)
+                await self._send_file_range(send, f, start, end, zerocopy, more_body=False)
+                return
+
+            for i, (head, start, end) in enumerate(self.parts):
+                prefix = head if i == 0 else b"\r\n" + head
+                await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                await self._send_file_range(send, f, start, end, zerocopy, more_body=True)
+            await send({"type": "http.response.body", "body": self.tail, "more_body": False})
+
+
+def conditional_file_response(request, path: str, etag: str, media_type: str, headers: dict):
+    """Build a 200/206/304/416 response for `path` honouring Range and validators."""
+    stat = os.stat(path)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = dict(headers)
+    headers.update({
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+    })
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("Range")
+    if range_header:
+        if_range = request.headers.get("If-Range")
+        if if_range and not _if_range_matches(if_range, etag, stat):
+            range_header = None
+
+    if range_header:
+        ranges = parse_range(range_header, stat.st_size)
+        if ranges == []:
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+        if ranges:
+            return FileRangeResponse(
+                path, stat.st_size, ranges=ranges, status_code=206, headers=headers, media_type=media_type
+            )
+
+    return FileRangeResponse(path, stat.st_size, headers=headers, media_type=media_type)
+
+
+def _if_range_matches(if_range: str, etag: str, stat: os.stat_result) -> bool:
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    try:
+        since = parsedate_to_datetime(if_range).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(stat.st_mtime) <= since
@@ -1,49 +1,722 @@
-import csv
 import os
 import asyncio
+import contextlib
+import functools
+import json
+import logging
+import shutil
+import time
 from datetime import datetime, timezone
 from uuid import UUID
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, and_, func, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import User, Export
-from app.database import AsyncSessionLocal
-import gzip
+from app.database import AsyncSessionLocal, ExportSessionLocal, export_engine
+from app.config import settings
+from app.progress import progress_registry, TERMINAL_STATUSES
+from app import result_cache, row_count, metrics, subscriptions, storage, query_plan, manifest as manifests
+from app.compression import EXTENSIONS, compress_file, new_compressor
+from app.file_writer import BufferedFileWriter
+from app.formats import COLUMNAR_FORMATS, EXTENSIONS as FORMAT_EXTENSIONS, ColumnarWriter, encode_ndjson
+from app.row_encoder import compile_encoder, encode_header
+from app.governor import governor, job_footprint
+from app.filters import filter_conditions, copy_filter_clauses, normalize_filters
 
-# Global dictionary to track active tasks for cancellation
+logger = logging.getLogger(__name__)
+
+
+class CancelFlag:
+    """Set once a job should stop; the write loops only read `cancelled`."""
+
+    __slots__ = ("cancelled",)
+
+    def __init__(self, cancelled: bool = False):
+        self.cancelled = cancelled
+
+
+# Global dictionary to track active tasks for cancellation: export id -> CancelFlag
 active_tasks = {}
 
-async def update_status(export_id, processed_rows=None, percentage=None, status=None, error=None, file_path=None):
-    """Helper to update export status in a separate session to avoid transaction issues."""
+# Stands in for jobs that are no longer registered
+_GONE = CancelFlag(cancelled=True)
+
+
+def cancel_flag(export_id) -> CancelFlag:
+    return active_tasks.get(export_id, _GONE)
+
+async def update_status(export_id, processed_rows=None, percentage=None, status=None, error=None, file_path=None, total_rows=None, **artifact):
+    """Record progress in the in-memory registry; the flusher persists it.
+
+    Terminal states are flushed immediately so /download sees them.
+    """
+    if isinstance(export_id, UUID):
+        export_id = str(export_id)
+    else:
+        try:
+            UUID(export_id)
+        except ValueError:
+            return
+
+    started = time.perf_counter()
+    completed_at = None
+    if status == "completed":
+        completed_at = datetime.now(timezone.utc)
+        percentage = 100
+    if status in TERMINAL_STATUSES and export_id in metrics.jobs:
+        # Per-job stage summary goes out with the final state
+        artifact["metrics"] = metrics.finish_job(export_id, status)
+
+    progress_registry.update(
+        export_id,
+        processed_rows=processed_rows,
+        percentage=percentage,
+        status=status,
+        error=error,
+        file_path=file_path,
+        total_rows=total_rows,
+        completed_at=completed_at,
+        **artifact,
+    )
+
+    if status in TERMINAL_STATUSES:
+        await progress_registry.flush()
+
+    elapsed = time.perf_counter() - started
+    metrics.STATUS_UPDATE_SECONDS.observe(elapsed)
+    job = metrics.jobs.get(export_id)
+    if job is not None:
+        job.add("status", elapsed)
+
+ALL_COLUMNS = ["id", "name", "email", "signup_date", "country_code", "subscription_tier", "lifetime_value"]
+
+# Export engines selectable per request. "orm" is the original SQLAlchemy path,
+# "copy" streams COPY ... TO STDOUT through the raw asyncpg connection.
+EXPORT_ENGINES = ("orm", "copy")
+
+
+class ExportCancelled(Exception):
+    """Raised inside the streaming loop when the job has been cancelled."""
+
+
+def resolve_columns(columns: str = None):
+    """Turn the comma separated `columns` option into a validated column list."""
+    if columns:
+        export_columns = [c.strip() for c in columns.split(",")]
+        # Validate columns
+        export_columns = [c for c in export_columns if c in ALL_COLUMNS]
+    else:
+        export_columns = list(ALL_COLUMNS)
+    return export_columns
+
+
+def build_filters(spec: dict = None):
+    """Conditions on users for a filter spec (see app/filters.py)."""
+    return filter_conditions(spec or {})
+
+
+def sample_sql(sample: dict) -> str:
+    """Condition keeping the rows of a TABLESAMPLE SYSTEM sample of users.
+
+    SYSTEM picks whole pages, and the rows are then fetched by ctid (a TID
+    scan), so only the sampled pages are read. REPEATABLE with the job's seed
+    gives retries, resumes and shards the same pages. Both numbers are
+    validated as float / int, so they are safe to inline.
+    """
+    percent = float(sample["percent"])
+    seed = int(sample["seed"])
+    return (
+        "users.ctid = ANY(ARRAY("
+        f"SELECT ctid FROM users TABLESAMPLE SYSTEM ({percent!r}) REPEATABLE ({seed})))"
+    )
+
+
+def build_query(spec: dict = None, delta: dict = None, sample: dict = None):
+    """The export's SELECT on users, before the writers add ORDER BY id, and its filters."""
+    filters = build_filters(spec)
+    if delta:
+        # Only rows past the subscription's watermark, up to the bound fixed at request time
+        filters += subscriptions.watermark_filters(delta)
+    if sample:
+        filters.append(text(sample_sql(sample)))
+    query = select(User)
+    if filters:
+        query = query.where(and_(*filters))
+    return query, filters
+
+
+def build_copy_sql(
+    export_columns,
+    spec=None,
+    delimiter=",",
+    quotechar='"',
+    id_range=None,
+    header=True,
+    watermark=None,
+    sample=None
+):
+    """Build the SELECT to COPY, its positional args and the COPY options for asyncpg.
+
+    asyncpg's copy_from_query wraps the query in `COPY (...) TO STDOUT` itself
+    and takes the format options as keyword arguments, so only the SELECT is
+    built here.
+
+    Column names come from ALL_COLUMNS (and the watermark column from
+    WATERMARK_COLUMNS) only, so they are safe to inline. Filter values of
+    `spec` are passed as $n arguments. `watermark` is (column, after, upto) for delta
+    exports, `sample` the {"percent", "seed"} of a sampled export.
+    """
+    if delimiter == quotechar:
+        raise ValueError("Delimiter and quote character must be different for COPY")
+    if delimiter in ("\r", "\n", "\\") or quotechar in ("\r", "\n"):
+        raise ValueError("Unsupported delimiter or quote character for COPY")
+
+    args = []
+    clauses = copy_filter_clauses(spec or {}, args)
+    if id_range is not None:
+        args.extend(id_range)
+        clauses.append(f"id BETWEEN ${len(args) - 1} AND ${len(args)}")
+    if watermark is not None:
+        column, after, upto = watermark
+        if after is not None:
+            args.append(after)
+            clauses.append(f"{column} > ${len(args)}")
+        args.append(upto)
+        clauses.append(f"{column} <= ${len(args)}")
+    if sample:
+        clauses.append(sample_sql(sample))
+
+    select_sql = f"SELECT {', '.join(export_columns)} FROM users"
+    if clauses:
+        select_sql += " WHERE " + " AND ".join(clauses)
+
+    options = {"format": "csv", "header": header, "delimiter": delimiter, "quote": quotechar}
+    return select_sql, args, options
+
+
+class ExportProgress:
+    """Sums processed rows across shards and pushes the total to the exports row.
+
+    Also owns the job's checkpoint: per shard, the last id written under
+    ORDER BY id, the byte offset of the part file at that point and the row
+    count. It is persisted through update_status as JSON on Export.checkpoint.
+    """
+
+    def __init__(self, export_id, total_rows, id_ranges=(None,), checkpoint=None, interval=5000, estimated=False,
+                 batch_rows=None):
+        self.export_id = export_id
+        self.total_rows = total_rows
+        self.estimated = estimated
+        self.id_ranges = list(id_ranges)
+        if checkpoint:
+            self.shards = checkpoint["shards"]
+        else:
+            self.shards = [
+                {"last_id": None, "offset": 0, "rows": 0, "done": False}
+                for _ in self.id_ranges
+            ]
+        self.counts = [state["rows"] for state in self.shards]
+        self.interval = interval
+        self.reported = 0
+        self.checkpoint_rows = settings.EXPORT_CHECKPOINT_ROWS
+        self.writers = []
+        self.metrics = metrics.jobs.get(export_id) or metrics.JobMetrics(export_id)
+        # Rows per fetch, lowered when the memory governor could not grant the full estimate
+        self.batch_rows = batch_rows
+
+    def writer_stats(self):
+        """Queue depth, stall time and bytes across this job's file writers."""
+        stats = [writer.stats() for writer in self.writers]
+        return {
+            "queueDepth": sum(s["queueDepth"] for s in stats),
+            "stallSeconds": round(sum(s["stallSeconds"] for s in stats), 3),
+            "bytesWritten": sum(s["bytesWritten"] for s in stats),
+        }
+
+    @property
+    def processed_rows(self):
+        return sum(self.counts)
+
+    @property
+    def has_checkpoint(self):
+        return any(state["offset"] > 0 for state in self.shards)
+
+    async def update(self, shard, processed_rows):
+        self.counts[shard] = processed_rows
+        processed = self.processed_rows
+        if processed - self.reported >= self.interval or processed == self.total_rows:
+            self.reported = processed
+            progress_registry.annotate(self.export_id, writer=self.writer_stats())
+            await update_status(
+                self.export_id,
+                processed_rows=processed,
+                percentage=self.percentage(processed)
+            )
+
+    def percentage(self, processed):
+        if not self.total_rows:
+            return 0
+        # An estimated total can be off either way; only completion reports 100
+        ceiling = 99 if self.estimated else 100
+        return min(int((processed / self.total_rows) * 100), ceiling)
+
+    async def settle_total(self, count):
+        """Swap the estimated total for the exact count once it lands."""
+        try:
+            total_rows = await count
+        except Exception as e:
+            # Keep the estimate; completion corrects the total anyway
+            logger.warning(f"Concurrent count failed for export {self.export_id}: {e}")
+            return
+        self.total_rows = total_rows
+        self.estimated = False
+        processed = self.processed_rows
+        await update_status(
+            self.export_id,
+            total_rows=total_rows,
+            total_rows_estimated=False,
+            percentage=self.percentage(processed),
+        )
+
+    async def checkpoint(self, shard, last_id, offset, processed_rows, done=False):
+        self.shards[shard] = {"last_id": last_id, "offset": offset, "rows": processed_rows, "done": done}
+        self.counts[shard] = processed_rows
+        processed = self.processed_rows
+        self.reported = processed
+        progress_registry.annotate(self.export_id, writer=self.writer_stats())
+        await update_status(
+            self.export_id,
+            processed_rows=processed,
+            percentage=self.percentage(processed),
+            checkpoint=json.dumps({"id_ranges": self.id_ranges, "shards": self.shards}),
+        )
+
+
+async def load_checkpoint(export_id):
+    """Return the stored checkpoint of an export, or None."""
+    async with AsyncSessionLocal() as db:
+        export = await db.get(Export, UUID(export_id) if isinstance(export_id, str) else export_id)
+        if not export or not export.checkpoint:
+            return None
+    try:
+        checkpoint = json.loads(export.checkpoint)
+        if len(checkpoint["id_ranges"]) != len(checkpoint["shards"]):
+            return None
+        return checkpoint
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+async def load_manifest(export_id):
+    """Return the stored manifest of a split export, or None."""
     async with AsyncSessionLocal() as db:
-        # Ensure export_id is a UUID object for db.get()
-        if isinstance(export_id, str):
+        export = await db.get(Export, UUID(export_id) if isinstance(export_id, str) else export_id)
+        return manifests.load(export.manifest) if export else None
+
+
+def _prepare_part(path, offset):
+    """Cut a part file back to its last checkpoint. Returns False if it cannot resume."""
+    if offset == 0:
+        return True
+    if not os.path.exists(path) or os.path.getsize(path) < offset:
+        return False
+    with open(path, "r+b") as f:
+        f.truncate(offset)
+    return True
+
+
+async def get_id_bounds(filters):
+    """Return (min_id, max_id) of the filtered set, or (None, None) if empty."""
+    async with AsyncSessionLocal() as db:
+        bounds_query = select(func.min(User.id), func.max(User.id))
+        if filters:
+            bounds_query = bounds_query.where(and_(*filters))
+        result = await db.execute(bounds_query)
+        return result.one()
+
+
+def max_export_shards(concurrency: int = None) -> int:
+    """Most shards one job may open so that `concurrency` jobs fit in the export pool.
+
+    Every job also keeps a connection for a concurrent COUNT(*), so a job
+    takes up to shards + 1 of the EXPORT_POOL_SIZE connections.
+    """
+    concurrency = max(1, concurrency or settings.WORKER_CONCURRENCY)
+    return max(1, min(settings.MAX_EXPORT_SHARDS, settings.EXPORT_POOL_SIZE // concurrency - 1))
+
+
+def split_id_range(min_id, max_id, shard_count):
+    """Split [min_id, max_id] into at most `shard_count` contiguous inclusive ranges."""
+    span = max_id - min_id + 1
+    shard_count = max(1, min(shard_count, span))
+    step, rest = divmod(span, shard_count)
+    ranges = []
+    lo = min_id
+    for i in range(shard_count):
+        hi = lo + step - 1 + (1 if i < rest else 0)
+        ranges.append((lo, hi))
+        lo = hi + 1
+    return ranges
+
+
+def _stitch_parts(part_paths, file_path):
+    """Concatenate part files in order into the final export (runs in a thread).
+
+    Parts are only removed once the whole file is written, so a crash while
+    stitching can be resumed by stitching again.
+    """
+    with open(file_path, "wb") as out:
+        for part_path in part_paths:
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, out, 1024 * 1024)
+    _remove_files(part_paths)
+
+
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
             try:
-                export_id_obj = UUID(export_id)
-            except ValueError:
-                return
+                os.remove(path)
+            except OSError:
+                pass
+
+
+async def _run_shards(coros):
+    """Run shard coroutines concurrently; if one fails, stop all the others."""
+    tasks = [asyncio.create_task(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _write_orm(export_id, query, export_columns, progress, file_path, delimiter, quotechar, shard=0, header=True,
+                     compression=None, compression_level=None):
+    """Original engine: fetch projected rows through SQLAlchemy and encode them in Python.
+
+    `query` selects the export columns followed by User.id. Rows arrive in
+    partitions of EXPORT_BATCH_ROWS and each partition is encoded into one
+    chunk by the compiled row encoder (byte-identical to csv.DictWriter).
+    """
+    state = progress.shards[shard]
+    resuming = state["offset"] > 0
+    processed_rows = state["rows"]
+    last_id = state["last_id"]
+    batch_rows = progress.batch_rows or settings.EXPORT_BATCH_ROWS
+
+    if last_id is not None:
+        query = query.where(User.id > last_id)
+    if progress.checkpoint_rows:
+        # Checkpoints need a deterministic order to resume from
+        query = query.order_by(User.id)
+
+    encode = compile_encoder(export_columns, delimiter, quotechar)
+    cancel = cancel_flag(export_id)
+    checkpointed = processed_rows // progress.checkpoint_rows if progress.checkpoint_rows else 0
+
+    async with ExportSessionLocal() as db:
+        async with BufferedFileWriter(
+            file_path, append=resuming, compression=compression, compression_level=compression_level
+        ) as out:
+            progress.writers.append(out)
+            if header and not resuming:
+                await out.write(encode_header(export_columns, delimiter, quotechar))
+
+            # SQLAlchemy stream() for memory efficiency
+            result = await db.stream(query.execution_options(yield_per=batch_rows))
+
+            job = progress.metrics
+            fetch_started = time.perf_counter()
+            async for partition in result.partitions(batch_rows):
+                # Check for cancellation
+                if cancel.cancelled:
+                    raise ExportCancelled()
+
+                fetched = time.perf_counter()
+                chunk = encode(partition)
+                encoded = time.perf_counter()
+                await out.write(chunk)
+                written = time.perf_counter()
+                job.add("fetch", fetched - fetch_started, batch=True)
+                job.add("encode", encoded - fetched, batch=True)
+                job.add("write", written - encoded, batch=True)
+                job.batch(len(partition), len(chunk))
+
+                last_id = partition[-1][-1]
+                processed_rows += len(partition)
+
+                if progress.checkpoint_rows and processed_rows // progress.checkpoint_rows > checkpointed:
+                    checkpointed = processed_rows // progress.checkpoint_rows
+                    offset = await out.flush()
+                    await progress.checkpoint(shard, last_id, offset, processed_rows)
+                else:
+                    await progress.update(shard, processed_rows)
+                fetch_started = time.perf_counter()
+
+            offset = await out.close()
+
+    await progress.checkpoint(shard, last_id, offset, processed_rows, done=True)
+    return processed_rows
+
+
+async def _write_copy(export_id, make_copy_sql, progress, file_path, shard=0, header=True,
+                      compression=None, compression_level=None):
+    """COPY engine: Postgres renders the CSV, we only move bytes to disk.
+
+    Rows are counted by newlines in the raw stream, so progress is approximate
+    for values with embedded line breaks. Timestamps and numerics use the
+    Postgres text format (and LF line endings) rather than Python's str().
+
+    With checkpointing on, the shard's id range is copied in slices of
+    EXPORT_CHECKPOINT_ROWS ids and a checkpoint is taken after each slice, so
+    the last id is known without parsing the stream.
+    """
+    state = progress.shards[shard]
+    resuming = state["offset"] > 0
+    id_range = progress.id_ranges[shard]
+
+    if id_range is not None and progress.checkpoint_rows:
+        lo = id_range[0] if state["last_id"] is None else state["last_id"] + 1
+        slices = [
+            (start, min(start + progress.checkpoint_rows - 1, id_range[1]))
+            for start in range(lo, id_range[1] + 1, progress.checkpoint_rows)
+        ]
+    else:
+        slices = [id_range]
+
+    counter = {"rows": state["rows"], "reported": state["rows"]}
+    last_id = state["last_id"]
+    job = progress.metrics
+    cancel = cancel_flag(export_id)
+
+    async with export_engine.connect() as conn:
+        raw_conn = await conn.get_raw_connection()
+        asyncpg_conn = raw_conn.driver_connection
+
+        async with BufferedFileWriter(
+            file_path, append=resuming, compression=compression, compression_level=compression_level
+        ) as out:
+            progress.writers.append(out)
+            for i, id_slice in enumerate(slices):
+                slice_header = header and i == 0 and not resuming
+                copy_sql, copy_args, copy_options = make_copy_sql(id_range=id_slice, header=slice_header)
+                skip = {"lines": 1 if slice_header else 0}
+                timer = {"fetch_started": time.perf_counter()}
+
+                async def sink(chunk: bytes):
+                    if cancel.cancelled:
+                        # Raising from the output callback aborts the COPY
+                        raise ExportCancelled()
+                    # Postgres scans and encodes; all we see is the wait for the next chunk
+                    fetched = time.perf_counter()
+                    await out.write(chunk)
+                    lines = chunk.count(b"\n")
+                    # Don't count the header line as a row
+                    skipped = min(skip["lines"], lines)
+                    skip["lines"] -= skipped
+                    counter["rows"] += lines - skipped
+                    job.add("fetch", fetched - timer["fetch_started"], batch=True)
+                    job.add("write", time.perf_counter() - fetched, batch=True)
+                    job.batch(lines - skipped, len(chunk))
+
+                    if counter["rows"] - counter["reported"] >= 5000:
+                        counter["reported"] = counter["rows"]
+                        await progress.update(shard, counter["rows"])
+                    timer["fetch_started"] = time.perf_counter()
+
+                await asyncpg_conn.copy_from_query(copy_sql, *copy_args, output=sink, **copy_options)
+
+                if id_slice is not None:
+                    last_id = id_slice[1]
+                    if i < len(slices) - 1:
+                        offset = await out.flush()
+                        await progress.checkpoint(shard, last_id, offset, counter["rows"])
+
+            offset = await out.close()
+
+    await progress.checkpoint(shard, last_id, offset, counter["rows"], done=True)
+    return counter["rows"]
+
+
+async def _write_format(export_id, query, export_columns, progress, file_path, export_format, compression=None,
+                        compression_level=None):
+    """NDJSON / Parquet / Arrow engine.
+
+    `query` selects only the requested columns, so unselected ones are never
+    fetched. Rows arrive in partitions of FORMAT_BATCH_ROWS; for columnar
+    formats each partition becomes one row group / record batch, converted
+    and written in a worker thread, so memory stays bounded by one partition.
+    Columnar formats compress internally with `compression`; NDJSON gets a
+    compressed copy written alongside.
+    """
+    batch_rows = progress.batch_rows or settings.FORMAT_BATCH_ROWS
+    processed_rows = 0
+    job = progress.metrics
+    cancel = cancel_flag(export_id)
+
+    async with contextlib.AsyncExitStack() as stack:
+        if export_format in COLUMNAR_FORMATS:
+            columnar = await asyncio.to_thread(ColumnarWriter, file_path, export_format, export_columns, compression)
+            stack.push_async_callback(asyncio.to_thread, columnar.close)
+
+            async def write_batch(rows):
+                # Arrow conversion and the file write both happen in the thread
+                started = time.perf_counter()
+                await asyncio.to_thread(columnar.write_rows, rows)
+                job.add("write", time.perf_counter() - started, batch=True)
+                return 0
         else:
-            export_id_obj = export_id
+            out = await stack.enter_async_context(
+                BufferedFileWriter(file_path, compression=compression, compression_level=compression_level)
+            )
+            progress.writers.append(out)
+
+            async def write_batch(rows):
+                started = time.perf_counter()
+                chunk = encode_ndjson(rows, export_columns)
+                encoded = time.perf_counter()
+                await out.write(chunk)
+                job.add("encode", encoded - started, batch=True)
+                job.add("write", time.perf_counter() - encoded, batch=True)
+                return len(chunk)
+
+        async with ExportSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=batch_rows))
+            fetch_started = time.perf_counter()
+            async for partition in result.partitions(batch_rows):
+                if cancel.cancelled:
+                    raise ExportCancelled()
+                job.add("fetch", time.perf_counter() - fetch_started, batch=True)
+                size = await write_batch(partition)
+                job.batch(len(partition), size)
+                processed_rows += len(partition)
+                await progress.update(0, processed_rows)
+                fetch_started = time.perf_counter()
+
+    return processed_rows
+
+
+async def _write_split(export_id, query, export_columns, progress, manifest, export_dir, export_format,
+                       delimiter, quotechar, compression=None, compression_level=None):
+    """Split engine: rows in id order, cut into numbered part files.
+
+    `query` selects the export columns followed by User.id. A part is closed
+    once it holds `split["rows"]` rows or about `split["bytes"]` bytes; it is
+    then compressed and checksummed in a worker thread while the next part is
+    written, and the manifest is republished with it. Parts are listed in
+    order, so a listed part is always complete.
+    """
+    split = manifest["split"]
+    max_rows, max_bytes = split.get("rows"), split.get("bytes")
+    parts = manifest["parts"]
+    number = len(parts)
+    processed_rows = sum(part["rows"] for part in parts)
+    batch_rows = progress.batch_rows or settings.EXPORT_BATCH_ROWS
+    job = progress.metrics
+    cancel = cancel_flag(export_id)
+    file_path = manifests.manifest_path(export_dir, export_id)
+
+    query = query.order_by(User.id)
+    if parts:
+        query = query.where(User.id > parts[-1]["maxId"])
+
+    if export_format == "csv":
+        encode = compile_encoder(export_columns, delimiter, quotechar)
+        header = encode_header(export_columns, delimiter, quotechar)
+    else:
+        encode = functools.partial(encode_ndjson, export_columns=export_columns)
+        header = b""
+
+    async def publish():
+        manifest["totalRows"] = sum(part["rows"] for part in parts)
+        await asyncio.to_thread(manifests.write, file_path, manifest)
+        # file_path locates the parts for GET /exports/{id}/parts/{n} while the job runs
+        await update_status(export_id, file_path=file_path, manifest=manifests.dumps(manifest))
+
+    async def finish_part(entry, path, previous):
+        started = time.perf_counter()
+        entry.update(await asyncio.to_thread(manifests.finalize_part, path, compression, compression_level))
+        job.add("finalize", time.perf_counter() - started)
+        if previous is not None:
+            # Keep the manifest in part order
+            await previous
+        parts.append(entry)
+        await publish()
+
+    finishing = None
+    try:
+        async with ExportSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=batch_rows))
+            batches = result.partitions(batch_rows).__aiter__()
+
+            async def next_batch():
+                started = time.perf_counter()
+                try:
+                    partition = await batches.__anext__()
+                except StopAsyncIteration:
+                    return None
+                if cancel.cancelled:
+                    raise ExportCancelled()
+                job.add("fetch", time.perf_counter() - started, batch=True)
+                return partition
+
+            pending = await next_batch()
+            while pending:
+                number += 1
+                path = manifests.part_path(export_dir, export_id, number, export_format)
+                entry = {"part": number, "rows": 0, "bytes": len(header), "minId": pending[0][-1], "maxId": None}
+                async with BufferedFileWriter(path) as out:
+                    progress.writers = [out]
+                    await out.write(header)
+                    while True:
+                        if not pending:
+                            pending = await next_batch()
+                            if not pending:
+                                break
+                        rows = pending[:max_rows - entry["rows"]] if max_rows else pending
+                        encode_started = time.perf_counter()
+                        chunk = encode(rows)
+                        full = False
+                        if max_bytes and entry["bytes"] + len(chunk) > max_bytes:
+                            # Cut at the row count that fits, judged by this batch's average row size
+                            fit = int((max_bytes - entry["bytes"]) * len(rows) / len(chunk))
+                            if fit == 0 and entry["rows"]:
+                                break
+                            rows = rows[:max(fit, 1)]
+                            chunk = encode(rows)
+                            full = True
+                        encoded = time.perf_counter()
+                        await out.write(chunk)
+                        job.add("encode", encoded - encode_started, batch=True)
+                        job.add("write", time.perf_counter() - encoded, batch=True)
+                        job.batch(len(rows), len(chunk))
+
+                        pending = pending[len(rows):]
+                        entry["rows"] += len(rows)
+                        entry["bytes"] += len(chunk)
+                        entry["maxId"] = rows[-1][-1]
+                        processed_rows += len(rows)
+                        await progress.update(0, processed_rows)
+                        if full or (max_rows and entry["rows"] >= max_rows):
+                            break
+                finishing = asyncio.create_task(finish_part(entry, path, finishing))
+                if not pending:
+                    pending = await next_batch()
+
+        if finishing is not None:
+            await finishing
+    except BaseException:
+        if finishing is not None:
+            finishing.cancel()
+            await asyncio.gather(finishing, return_exceptions=True)
+        raise
+
+    manifest["complete"] = True
+    await publish()
+    return processed_rows
 
-        export = await db.get(Export, export_id_obj)
-        if not export:
-            return
-        
-        if processed_rows is not None:
-            export.processed_rows = processed_rows
-        if percentage is not None:
-            export.percentage = percentage
-        if status is not None:
-            export.status = status
-        if error is not None:
-            export.error = error
-        if file_path is not None:
-            export.file_path = file_path
-        
-        if status == "completed":
-            export.completed_at = datetime.now(timezone.utc)
-            export.percentage = 100
-            
-        await db.commit()
 
 async def process_export(
     export_id: str,
@@ -52,115 +725,356 @@ async def process_export(
     min_ltv: float = None,
     columns: str = None,
     delimiter: str = ",",
-    quotechar: str = '"'
+    quotechar: str = '"',
+    export_engine: str = "orm",
+    shards: int = 1,
+    compression: str = None,
+    compression_level: int = None,
+    export_format: str = "csv",
+    count_strategy: str = None,
+    delta: dict = None,
+    split: dict = None,
+    ttl: int = None,
+    sample: dict = None,
+    filters: dict = None
 ):
-    active_tasks[export_id] = True
+    active_tasks[export_id] = CancelFlag()
+    part_paths = []
+    progress = None
+    count_task = None
+    job = metrics.start_job(export_id, export_format, export_engine)
     
     try:
-        async with AsyncSessionLocal() as db:
-            # 1. Update status to processing
-            await update_status(export_id, status="processing")
-
-            # 2. Build query
-            query = select(User)
-            filters = []
-            if country_code:
-                filters.append(User.country_code == country_code)
-            if subscription_tier:
-                filters.append(User.subscription_tier == subscription_tier)
-            if min_ltv is not None:
-                filters.append(User.lifetime_value >= min_ltv)
-            
-            if filters:
-                query = query.where(and_(*filters))
-            
-            # Resolve columns
-            all_columns = ["id", "name", "email", "signup_date", "country_code", "subscription_tier", "lifetime_value"]
-            if columns:
-                export_columns = [c.strip() for c in columns.split(",")]
-                # Validate columns
-                export_columns = [c for c in export_columns if c in all_columns]
+        # 1. Update status to processing
+        await update_status(export_id, status="processing", started_at=datetime.now(timezone.utc))
+        compression = compression or settings.EXPORT_COMPRESSION or None
+
+        # Reserve memory for the cursor batches, buffers and compressor. When the
+        # budget is tight the job gets less and fetches smaller batches instead.
+        footprint = job_footprint(
+            len(resolve_columns(columns)), export_format, export_engine,
+            1 if split else min(shards or 1, max_export_shards()),
+            compression,
+        )
+        with job.stage("admission"):
+            granted = await governor.acquire(export_id, footprint.want, footprint.minimum)
+        batch_rows = footprint.batch_rows_for(granted)
+        progress_registry.annotate(export_id, memory={"reservedBytes": granted, "batchRows": batch_rows})
+
+        # 2. Build query
+        # Jobs queued before the filter spec carry the three original filters
+        if filters is None:
+            filters = normalize_filters(
+                country_code=country_code, subscription_tier=subscription_tier, min_ltv=min_ltv
+            )
+        query, conditions = build_query(filters, delta, sample)
+
+        # Resolve columns
+        export_columns = resolve_columns(columns)
+
+        # 3. Count total rows (or estimate them and count alongside the export)
+        count_strategy = count_strategy or settings.EXPORT_COUNT_STRATEGY
+        with job.stage("count"):
+            total_rows, estimated = await row_count.initial_total(query, count_strategy, filtered=bool(conditions))
+
+        await update_status(export_id, total_rows=total_rows, total_rows_estimated=estimated)
+
+        if total_rows == 0 and not estimated:
+            empty = {"expires_at": storage.expires_at(ttl)}
+            if split:
+                empty["manifest"] = manifests.dumps(dict(
+                    manifests.new_manifest(export_id, export_format, split, compression), complete=True
+                ))
+            if delta:
+                await subscriptions.complete_delta(export_id, delta, dict(empty, total_rows=0))
+            await update_status(export_id, status="completed", percentage=100, **empty)
+            return
+
+        # 4. Stream data and write the export file
+        export_dir = os.getenv("EXPORT_STORAGE_PATH", "exports")
+        os.makedirs(export_dir, exist_ok=True)
+        file_path = os.path.join(export_dir, f"export_{export_id}{FORMAT_EXTENSIONS[export_format]}")
+
+        if split:
+            # Numbered parts plus a manifest; the manifest doubles as the checkpoint
+            file_path = manifests.manifest_path(export_dir, export_id)
+            manifest = await load_manifest(export_id)
+            if manifest and manifest["split"] == split:
+                logger.info(f"Resuming split export {export_id} after part {len(manifest['parts'])}")
             else:
-                export_columns = all_columns
-
-            # 3. Count total rows
-            count_query = select(func.count()).select_from(query.subquery())
-            total_rows_result = await db.execute(count_query)
-            total_rows = total_rows_result.scalar()
-            
-            # Update total rows in DB
-            async with AsyncSessionLocal() as status_db:
-                # Ensure export_id is a UUID object for db.get()
-                export_id_obj = UUID(export_id) if isinstance(export_id, str) else export_id
-                export = await status_db.get(Export, export_id_obj)
-                if export:
-                    export.total_rows = total_rows
-                    await status_db.commit()
-
-            if total_rows == 0:
-                await update_status(export_id, status="completed", percentage=100)
-                return
-
-            # 4. Stream data and write to CSV
-            export_dir = os.getenv("EXPORT_STORAGE_PATH", "exports")
-            os.makedirs(export_dir, exist_ok=True)
-            file_path = os.path.join(export_dir, f"export_{export_id}.csv")
-            
-            processed_rows = 0
-            
-            with open(file_path, mode="w", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(
-                    f, 
-                    fieldnames=export_columns, 
-                    delimiter=delimiter, 
-                    quotechar=quotechar,
-                    quoting=csv.QUOTE_MINIMAL
-                )
-                writer.writeheader()
-                
-                # SQLAlchemy stream() for memory efficiency
-                result = await db.stream(query)
-                
-                async for row in result:
-                    # Check for cancellation
-                    if not active_tasks.get(export_id):
-                        f.close()
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                        await update_status(export_id, status="cancelled")
-                        return
-
-                    user = row[0]
-                    row_dict = {col: getattr(user, col) for col in export_columns}
-                    writer.writerow(row_dict)
-                    
-                    processed_rows += 1
-                    
-                    # Update progress every 5000 rows to reduce DB load
-                    if processed_rows % 5000 == 0 or processed_rows == total_rows:
-                        await update_status(
-                            export_id, 
-                            processed_rows=processed_rows, 
-                            percentage=int((processed_rows / total_rows) * 100)
-                        )
-
-            # 5. Finalize
-            await update_status(export_id, status="completed", file_path=file_path)
+                manifest = manifests.new_manifest(export_id, export_format, split, compression)
+            await asyncio.to_thread(manifests.remove_unlisted, export_dir, export_id, manifest)
+            part_paths = manifests.part_files(export_dir, export_id)
+            progress = ExportProgress(export_id, total_rows, estimated=estimated, batch_rows=batch_rows)
+            progress.counts[0] = sum(part["rows"] for part in manifest["parts"])
+            if estimated and count_strategy == "concurrent":
+                count_task = asyncio.create_task(progress.settle_total(row_count.count_exact(query)))
+            projected = select(*[getattr(User, col) for col in export_columns], User.id)
+            if conditions:
+                projected = projected.where(and_(*conditions))
+            await _write_split(
+                export_id, projected, export_columns, progress, manifest, export_dir, export_format,
+                delimiter, quotechar, compression, compression_level
+            )
+        elif export_format != "csv":
+            # Single writer, no checkpoints: Parquet/Arrow files cannot be appended to
+            progress = ExportProgress(export_id, total_rows, estimated=estimated, batch_rows=batch_rows)
+            if estimated and count_strategy == "concurrent":
+                count_task = asyncio.create_task(progress.settle_total(row_count.count_exact(query)))
+            projected = select(*[getattr(User, col) for col in export_columns])
+            if conditions:
+                projected = projected.where(and_(*conditions))
+            if compression and export_format not in COLUMNAR_FORMATS:
+                compressed_path = file_path + EXTENSIONS[compression]
+            await _write_format(
+                export_id, projected, export_columns, progress, file_path, export_format, compression, compression_level
+            )
+        else:
+            # Pick up where a previous attempt left off, if its files are intact
+            checkpoint = await load_checkpoint(export_id)
+            if checkpoint:
+                id_ranges = [tuple(r) if r else None for r in checkpoint["id_ranges"]]
+            else:
+                # Split the filtered id space into contiguous ranges, one connection each
+                shard_count = max(1, min(shards or 1, max_export_shards()))
+                id_ranges = [None]
+                if shard_count > 1 or settings.EXPORT_CHECKPOINT_ROWS:
+                    min_id, max_id = await get_id_bounds(conditions)
+                    if min_id is not None:
+                        id_ranges = split_id_range(min_id, max_id, shard_count)
 
-    except Exception as e:
-        print(f"Export Error: {e}")
-        await update_status(export_id, status="failed", error=str(e))
-        # Cleanup broken file
-        if 'file_path' in locals() and os.path.exists(file_path):
+            if len(id_ranges) > 1:
+                part_paths = [f"{file_path}.part{i}" for i in range(len(id_ranges))]
+            else:
+                part_paths = [file_path]
+
+            if checkpoint:
+                if all(
+                    _prepare_part(path, state["offset"])
+                    for path, state in zip(part_paths, checkpoint["shards"])
+                ):
+                    logger.info(f"Resuming export {export_id} from checkpoint")
+                else:
+                    checkpoint = None
+
+            progress = ExportProgress(
+                export_id, total_rows, id_ranges=id_ranges, checkpoint=checkpoint, estimated=estimated,
+                batch_rows=batch_rows
+            )
+            if estimated and count_strategy == "concurrent":
+                count_task = asyncio.create_task(progress.settle_total(row_count.count_exact(query)))
+            # The ORM engine also needs the id of the last row written for checkpoints
+            projected = select(*[getattr(User, col) for col in export_columns], User.id)
+            if conditions:
+                projected = projected.where(and_(*conditions))
+            make_copy_sql = functools.partial(
+                build_copy_sql, export_columns, filters, delimiter, quotechar,
+                watermark=subscriptions.watermark_bounds(delta) if delta else None, sample=sample
+            )
+            # One writer producing the whole file from its start compresses as it writes;
+            # stitched shards and resumed files are compressed afterwards
+            streamed = compression if compression and len(part_paths) == 1 and not checkpoint else None
+            if streamed:
+                compressed_path = file_path + EXTENSIONS[compression]
+
+            shard_jobs = []
+            for shard, id_range in enumerate(id_ranges):
+                if progress.shards[shard]["done"]:
+                    continue
+                header = shard == 0
+                if export_engine == "copy":
+                    shard_jobs.append(_write_copy(
+                        export_id, make_copy_sql, progress, part_paths[shard], shard=shard, header=header,
+                        compression=streamed, compression_level=compression_level
+                    ))
+                else:
+                    shard_query = projected
+                    if id_range is not None:
+                        shard_query = projected.where(User.id.between(*id_range))
+                    shard_jobs.append(_write_orm(
+                        export_id, shard_query, export_columns, progress, part_paths[shard],
+                        delimiter, quotechar, shard=shard, header=header,
+                        compression=streamed, compression_level=compression_level
+                    ))
+
+            await _run_shards(shard_jobs)
+
+            if len(part_paths) > 1:
+                with job.stage("stitch"):
+                    await asyncio.to_thread(_stitch_parts, part_paths, file_path)
+
+        if progress.estimated:
+            # The stream itself is the exact count now; no need to wait for COUNT(*)
+            artifact_total = {"total_rows": progress.processed_rows, "total_rows_estimated": False}
+        else:
+            artifact_total = {}
+
+        # 5. Compress once so downloads can serve the stored bytes: while writing
+        # (compressed_path is set), otherwise in a pass over the finished file.
+        # Parquet/Arrow already compress internally (see ColumnarWriter).
+        if split:
+            # Parts were compressed one by one; sizes and checksums are in the manifest
+            artifact = {
+                "file_size": sum(part["bytes"] for part in manifest["parts"]),
+                "format": export_format,
+                "manifest": manifests.dumps(manifest),
+                **artifact_total,
+            }
+        else:
+            artifact = {"file_size": os.path.getsize(file_path), "format": export_format, **artifact_total}
+        if compression and not split and export_format not in COLUMNAR_FORMATS:
+            if 'compressed_path' in locals():
+                compressed_size = os.path.getsize(compressed_path)
+            else:
+                compressed_path = file_path + EXTENSIONS[compression]
+                with job.stage("compress"):
+                    compressed_size = await asyncio.to_thread(
+                        compress_file, file_path, compressed_path, compression, compression_level
+                    )
+            artifact.update(
+                compression=compression,
+                compressed_path=compressed_path,
+                compressed_size=compressed_size,
+                compression_ratio=round(compressed_size / artifact["file_size"], 4) if artifact["file_size"] else None,
+            )
+
+        # 6. Finalize. A delta completes together with its watermark move.
+        artifact["expires_at"] = storage.expires_at(ttl)
+        if delta:
+            snapshot = None
+            if delta.get("compact") and export_format in subscriptions.COMPACT_FORMATS:
+                with job.stage("compact"):
+                    snapshot = await subscriptions.build_snapshot(delta, file_path, export_format, progress.processed_rows)
             try:
-                os.remove(file_path)
-            except:
-                pass
+                await subscriptions.complete_delta(export_id, delta, dict(artifact, file_path=file_path), snapshot)
+            except subscriptions.DeltaConflict:
+                if snapshot is not None:
+                    _remove_files([snapshot.file_path])
+                raise
+        await update_status(export_id, status="completed", file_path=file_path, **artifact)
+
+        # Throughput per filter shape feeds the ETA of later jobs
+        try:
+            shape, _ = query_plan.filter_shape(filters, delta, sample)
+            await query_plan.record_run(shape, progress.processed_rows, time.perf_counter() - job.started)
+        except Exception as e:
+            logger.warning(f"Plan stats error: {e}")
+
+        # Keep the result cache within its TTL and size budget
+        try:
+            await result_cache.evict()
+        except Exception as e:
+            logger.warning(f"Cache eviction error: {e}")
+
+    except ExportCancelled:
+        if split and 'export_dir' in locals():
+            part_paths = manifests.part_files(export_dir, export_id)
+        _remove_files(part_paths)
+        if 'file_path' in locals() and os.path.exists(file_path):
+            os.remove(file_path)
+        if 'compressed_path' in locals():
+            _remove_files([compressed_path])
+        await update_status(export_id, status="cancelled")
+
+    except Exception as e:
+        logger.exception("Export %s failed", export_id)
+        # Whatever is kept for a resume goes once the failed job expires
+        await update_status(export_id, status="failed", error=str(e), expires_at=storage.expires_at())
+        if 'compressed_path' in locals():
+            _remove_files([compressed_path])
+        # Checkpointed part files are kept so POST /exports/{id}/resume can continue
+        if split and 'export_dir' in locals():
+            part_paths = manifests.part_files(export_dir, export_id)
+        resumable = progress is not None and (
+            progress.has_checkpoint or bool(split and 'manifest' in locals() and manifest["parts"])
+        )
+        if not resumable:
+            # Cleanup broken file
+            _remove_files(part_paths)
+            if 'file_path' in locals() and os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
     finally:
+        if count_task is not None and not count_task.done():
+            count_task.cancel()
+        # Interrupted without a final status (e.g. a worker draining)
+        metrics.finish_job(export_id, "interrupted")
+        governor.release(export_id)
         active_tasks.pop(export_id, None)
 
+async def stream_export(
+    is_disconnected,
+    filters: dict = None,
+    columns: str = None,
+    delimiter: str = ",",
+    quotechar: str = '"',
+    compression: str = None,
+    compression_level: int = None,
+    batch_rows: int = None
+):
+    """Yield CSV bytes straight from a server-side cursor, no export file involved.
+
+    Only the projected columns are selected, one partition of `batch_rows`
+    rows is encoded per chunk, and the next partition is not fetched until
+    the response has handed the previous chunk to the socket. That keeps
+    memory flat and lets a slow client throttle the cursor. The session (and
+    its pooled connection) is released as soon as the generator is closed,
+    which Starlette does when the client disconnects.
+    """
+    export_columns = resolve_columns(columns)
+    batch_rows = batch_rows or settings.STREAM_BATCH_ROWS
+    compressor = new_compressor(compression, compression_level) if compression else None
+
+    query = select(*[getattr(User, col) for col in export_columns])
+    conditions = build_filters(filters)
+    if conditions:
+        query = query.where(and_(*conditions))
+
+    encode = compile_encoder(export_columns, delimiter, quotechar)
+
+    async def emit(data: bytes, final: bool = False):
+        if compressor is None:
+            return data
+        # Compression is the expensive part, keep it off the event loop
+        return await asyncio.to_thread(
+            lambda: compressor.compress(data) + (compressor.flush() if final else b"")
+        )
+
+    yield await emit(encode_header(export_columns, delimiter, quotechar))
+
+    async with ExportSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_rows))
+        async for partition in result.partitions(batch_rows):
+            if await is_disconnected():
+                break
+            chunk = await emit(encode(partition))
+            if chunk:
+                yield chunk
+        else:
+            yield await emit(b"", final=True)
+
+
 async def cancel_job(export_id: str):
-    if export_id in active_tasks:
-        active_tasks[export_id] = False
+    """Stop a job if it runs in this process (DELETE, heartbeat or a cancel notification)."""
+    flag = active_tasks.get(str(export_id))
+    if flag is not None:
+        flag.cancelled = True
         return True
     return False
+
+
+async def sync_cancellations():
+    """Catch up on cancels that may have been missed while the listener was down."""
+    if not active_tasks:
+        return
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Export.id).where(
+                Export.id.in_([UUID(export_id) for export_id in active_tasks]),
+                Export.status == "cancelled",
+            )
+        )
+        for (export_id,) in result.all():
+            await cancel_job(str(export_id))
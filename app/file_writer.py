@@ -0,0 +1,295 @@
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import queue
+import threading
+import time
+
+from app.compression import EXTENSIONS, new_compressor
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# O_DIRECT needs block-aligned offsets, lengths and memory
+DIRECT_ALIGN = 4096
+
+FSYNC_POLICIES = ("never", "complete", "checkpoint")
+
+_STOP = object()
+
+
+class BufferedFileWriter:
+    """Export file writer that keeps blocking file I/O off the event loop.
+
+    The event loop side packs encoded bytes into buffers of `buffer_size` and
+    hands them to a dedicated thread through a queue bounded to `queue_depth`
+    buffers. When the disk cannot keep up, `write()` waits for a free slot;
+    that wait is reported as stall time. The thread can bypass the page cache
+    with O_DIRECT, or drop written pages with posix_fadvise(DONTNEED), so
+    multi-GB exports do not evict everything else. `fsync` is one of
+    FSYNC_POLICIES.
+
+    With `compression`, the thread also feeds every buffer to a compressor and
+    writes a compressed copy next to the file (`compressed_path`), so the
+    export is never read back just to compress it. The copy is only complete
+    after `close()`, and cannot be appended to: a resumed file is compressed
+    with compress_file afterwards instead.
+
+    Use as `async with BufferedFileWriter(path) as out: await out.write(data)`.
+    """
+
+    def __init__(self, path: str, append: bool = False, buffer_size: int = None, queue_depth: int = None,
+                 fsync: str = None, drop_cache: bool = None, direct: bool = None,
+                 compression: str = None, compression_level: int = None):
+        if compression and append:
+            raise ValueError("A compressed copy cannot be appended to")
+        self.path = path
+        self.append = append
+        self.buffer_size = buffer_size or settings.EXPORT_WRITE_BUFFER
+        self.queue_depth = queue_depth or settings.EXPORT_WRITE_QUEUE_DEPTH
+        self.fsync = fsync or settings.EXPORT_FSYNC
+        self.drop_cache = settings.EXPORT_DROP_PAGE_CACHE if drop_cache is None else drop_cache
+        self.direct = settings.EXPORT_O_DIRECT if direct is None else direct
+        self.compressed_path = path + EXTENSIONS[compression] if compression else None
+        self._compressor = new_compressor(compression, compression_level) if compression else None
+
+        self._buffer = bytearray()
+        self._queue = queue.Queue()
+        self._slots = None
+        self._loop = None
+        self._thread = None
+        self._fd = None
+        self._compressed_fd = None
+        self._error = None
+
+        # Stats, readable from the event loop
+        self.queued = 0
+        self.stall_seconds = 0.0
+        self.bytes_submitted = 0
+        self.bytes_written = 0
+        self.position = 0
+        self.compressed_size = 0
+
+        # Writer thread state
+        self._pending = bytearray()
+        self._aligned = None
+        self._direct_on = False
+        self._dropped_upto = 0
+
+    # -- event loop side --------------------------------------------------
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.queue_depth)
+        await asyncio.to_thread(self._open)
+        self.bytes_submitted = self.position
+        self._thread = threading.Thread(target=self._run, name=f"export-writer-{os.path.basename(self.path)}", daemon=True)
+        self._thread.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self._stop()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    async def write(self, data: bytes):
+        self._check()
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            await self._submit()
+
+    async def _submit(self):
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        started = time.perf_counter()
+        await self._slots.acquire()
+        self.stall_seconds += time.perf_counter() - started
+        self.queued += 1
+        self.bytes_submitted += len(data)
+        self._queue.put(("data", data, None))
+
+    async def flush(self, durable: bool = False) -> int:
+        """Wait until everything written so far is in the file; returns the file size.
+
+        `durable` also fsyncs, which the "checkpoint" policy does on every flush.
+        """
+        return await self._sync("flush", durable or self.fsync == "checkpoint")
+
+    async def _sync(self, kind: str, durable: bool) -> int:
+        await self._submit()
+        future = self._loop.create_future()
+        self._queue.put((kind, durable, future))
+        position = await future
+        self._check()
+        return position
+
+    async def close(self) -> int:
+        if self._thread is None:
+            return self.position
+        # "finish" also ends the compressed copy
+        position = await self._sync("finish", self.fsync in ("complete", "checkpoint"))
+        await self._stop()
+        return position
+
+    async def _stop(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "queueDepth": self.queued,
+            "stallSeconds": round(self.stall_seconds, 3),
+            "bytesWritten": self.bytes_written,
+        }
+
+    def _slot_done(self):
+        self.queued -= 1
+        self._slots.release()
+
+    # -- writer thread side -----------------------------------------------
+
+    def _open(self):
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if self.append else os.O_TRUNC)
+        if self.direct and hasattr(os, "O_DIRECT"):
+            try:
+                self._fd = os.open(self.path, flags | os.O_DIRECT, 0o644)
+                self._direct_on = True
+                self._aligned = mmap.mmap(-1, max(DIRECT_ALIGN, self.buffer_size // DIRECT_ALIGN * DIRECT_ALIGN))
+            except OSError as e:
+                # tmpfs and some overlay filesystems refuse O_DIRECT
+                logger.info(f"O_DIRECT unavailable for {self.path}, using buffered writes: {e}")
+                self._fd = None
+        if self._fd is None:
+            self._fd = os.open(self.path, flags, 0o644)
+        self.position = os.lseek(self._fd, 0, os.SEEK_END)
+        self._dropped_upto = self.position
+        if self._compressor is not None:
+            self._compressed_fd = os.open(self.compressed_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                kind, payload, future = item
+                try:
+                    if kind == "data":
+                        self._write(payload)
+                    else:
+                        self._flush(payload, finish=kind == "finish")
+                except Exception as e:
+                    self._error = e
+                finally:
+                    if kind == "data":
+                        self._loop.call_soon_threadsafe(self._slot_done)
+                    else:
+                        self._loop.call_soon_threadsafe(_resolve, future, self.position)
+        finally:
+            self._close_fd()
+
+    def _write_all(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+            self.position += written
+            self.bytes_written += written
+
+    def _write_compressed(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self._compressed_fd, view)
+            view = view[written:]
+            self.compressed_size += written
+
+    def _set_direct(self, enabled: bool):
+        flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+        flags = flags | os.O_DIRECT if enabled else flags & ~os.O_DIRECT
+        fcntl.fcntl(self._fd, fcntl.F_SETFL, flags)
+        self._direct_on = enabled
+
+    def _write(self, data: bytes):
+        if self._compressor is not None:
+            self._write_compressed(self._compressor.compress(data))
+        if self._aligned is None:
+            self._write_all(data)
+        else:
+            self._pending += data
+            # After an unaligned flush, write up to the next block boundary buffered
+            misaligned = self.position % DIRECT_ALIGN
+            if misaligned and self._pending:
+                head = min(DIRECT_ALIGN - misaligned, len(self._pending))
+                self._set_direct(False)
+                self._write_all(bytes(self._pending[:head]))
+                del self._pending[:head]
+            if self.position % DIRECT_ALIGN == 0:
+                self._write_aligned()
+
+        if self.drop_cache and self._aligned is None:
+            self._drop_written(keep=self.buffer_size)
+
+    def _write_aligned(self):
+        block = len(self._aligned)
+        full = len(self._pending) // DIRECT_ALIGN * DIRECT_ALIGN
+        if not full:
+            return
+        if not self._direct_on:
+            self._set_direct(True)
+        for start in range(0, full, block):
+            size = min(block, full - start)
+            self._aligned[:size] = self._pending[start:start + size]
+            self._write_all(memoryview(self._aligned)[:size])
+        del self._pending[:full]
+
+    def _flush(self, durable: bool, finish: bool = False):
+        if self._pending:
+            # The tail is not block sized; write it without O_DIRECT
+            self._set_direct(False)
+            self._write_all(bytes(self._pending))
+            self._pending.clear()
+        if finish and self._compressor is not None:
+            self._write_compressed(self._compressor.flush())
+            if durable:
+                os.fsync(self._compressed_fd)
+        if durable:
+            os.fsync(self._fd)
+
+    def _drop_written(self, keep: int = 0):
+        """Tell the kernel it may drop cached pages we have already written."""
+        upto = self.position - keep
+        if upto - self._dropped_upto < self.buffer_size or not hasattr(os, "posix_fadvise"):
+            return
+        os.posix_fadvise(self._fd, self._dropped_upto, upto - self._dropped_upto, os.POSIX_FADV_DONTNEED)
+        self._dropped_upto = upto
+
+    def _close_fd(self):
+        if self._compressed_fd is not None:
+            os.close(self._compressed_fd)
+            self._compressed_fd = None
+        if self._fd is None:
+            return
+        try:
+            if self.drop_cache and hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(self._fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            if self._aligned is not None:
+                self._aligned.close()
+
+
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
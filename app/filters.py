@@ -0,0 +1,188 @@
+"""Export filters: validated, normalized, and compiled to index-friendly SQL.
+
+A filter spec is a dict holding only the filters that are set:
+
+- `country_code`, `subscription_tier`: lists of values (`=` for one, `IN` for more);
+- `min_ltv`, `max_ltv`: inclusive lifetime_value bounds, as "12.50" strings;
+- `signup_from`, `signup_to`: a half-open signup_date window (from <= date < to), ISO 8601 in UTC;
+- `min_id`, `max_id`: an inclusive id range (a primary key range scan);
+- `email_domain`: lowercase domain prefixes, matched as `LIKE 'prefix%'` on the
+  domain part of the email, which idx_users_email_domain serves.
+
+The spec is stored as JSON on Export.filters and travels with the job as its
+`filters` option. Its canonical form (sorted, deduplicated values) is also what
+the result cache hashes, so the same filters in any order share an artifact.
+"""
+import json
+import re
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import or_, func, literal_column
+
+from app.models import User
+
+# Query parameters, in the order the spec is written
+FILTER_PARAMS = (
+    "country_code", "subscription_tier", "min_ltv", "max_ltv",
+    "signup_from", "signup_to", "min_id", "max_id", "email_domain",
+)
+
+# Filters that take several values (repeat the parameter or separate with commas)
+LIST_FILTERS = ("country_code", "subscription_tier", "email_domain")
+
+# Values per list filter
+MAX_VALUES = 100
+
+EMAIL_DOMAIN_PREFIX = re.compile(r"[a-z0-9.-]{1,253}")
+
+# Same expression as idx_users_email_domain, with inline constants so the planner matches it
+EMAIL_DOMAIN = func.lower(func.split_part(User.email, literal_column("'@'"), literal_column("2")))
+EMAIL_DOMAIN_SQL = "lower(split_part(email, '@', 2))"
+
+
+class InvalidFilter(ValueError):
+    """A filter value that cannot be applied; the message is safe to show."""
+
+
+def _values(name: str, raw) -> list:
+    if isinstance(raw, str):
+        raw = [raw]
+    values = sorted({part.strip() for item in raw for part in str(item).split(",") if part.strip()})
+    if len(values) > MAX_VALUES:
+        raise InvalidFilter(f"{name} takes at most {MAX_VALUES} values")
+    if name == "email_domain":
+        values = sorted({value.lower().lstrip("@") for value in values})
+        for value in values:
+            if not EMAIL_DOMAIN_PREFIX.fullmatch(value):
+                raise InvalidFilter(f"Invalid email_domain: {value!r}")
+    return values
+
+
+def _timestamp(name: str, raw) -> datetime:
+    if isinstance(raw, datetime):
+        value = raw
+    else:
+        try:
+            value = datetime.fromisoformat(str(raw))
+        except ValueError:
+            raise InvalidFilter(f"{name} must be an ISO 8601 date or timestamp")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def normalize_filters(**params) -> dict:
+    """Canonical filter spec from request parameters; raises InvalidFilter."""
+    unknown = set(params) - set(FILTER_PARAMS)
+    if unknown:
+        raise InvalidFilter(f"Unknown filters: {', '.join(sorted(unknown))}")
+    spec = {}
+    for name in LIST_FILTERS:
+        if params.get(name):
+            values = _values(name, params[name])
+            if values:
+                spec[name] = values
+    for name in ("min_ltv", "max_ltv"):
+        if params.get(name) is not None:
+            spec[name] = format(float(params[name]), ".2f")
+    for name in ("signup_from", "signup_to"):
+        if params.get(name):
+            spec[name] = _timestamp(name, params[name]).isoformat()
+    for name in ("min_id", "max_id"):
+        if params.get(name) is not None:
+            spec[name] = int(params[name])
+
+    if "min_ltv" in spec and "max_ltv" in spec and Decimal(spec["min_ltv"]) > Decimal(spec["max_ltv"]):
+        raise InvalidFilter("min_ltv is greater than max_ltv")
+    if "signup_from" in spec and "signup_to" in spec and (
+        datetime.fromisoformat(spec["signup_from"]) >= datetime.fromisoformat(spec["signup_to"])
+    ):
+        raise InvalidFilter("signup_from must be before signup_to")
+    if "min_id" in spec and "max_id" in spec and spec["min_id"] > spec["max_id"]:
+        raise InvalidFilter("min_id is greater than max_id")
+    return {name: spec[name] for name in FILTER_PARAMS if name in spec}
+
+
+def filters_from_options(options: dict) -> dict:
+    """Filter spec of stored job or subscription options, including ones queued before `filters` existed."""
+    if options.get("filters") is not None:
+        return options["filters"]
+    return normalize_filters(
+        country_code=options.get("country_code"),
+        subscription_tier=options.get("subscription_tier"),
+        min_ltv=options.get("min_ltv"),
+    )
+
+
+def encode_filters(spec: dict) -> str:
+    """JSON for Export.filters."""
+    return json.dumps(spec, sort_keys=True)
+
+
+def filter_conditions(spec: dict) -> list:
+    """SQLAlchemy conditions on User for a filter spec."""
+    conditions = []
+    for name in ("country_code", "subscription_tier"):
+        values = spec.get(name)
+        if values:
+            column = getattr(User, name)
+            conditions.append(column == values[0] if len(values) == 1 else column.in_(values))
+    if "min_ltv" in spec:
+        conditions.append(User.lifetime_value >= Decimal(spec["min_ltv"]))
+    if "max_ltv" in spec:
+        conditions.append(User.lifetime_value <= Decimal(spec["max_ltv"]))
+    if "signup_from" in spec:
+        conditions.append(User.signup_date >= datetime.fromisoformat(spec["signup_from"]))
+    if "signup_to" in spec:
+        conditions.append(User.signup_date < datetime.fromisoformat(spec["signup_to"]))
+    if "min_id" in spec:
+        conditions.append(User.id >= spec["min_id"])
+    if "max_id" in spec:
+        conditions.append(User.id <= spec["max_id"])
+    if spec.get("email_domain"):
+        # One index range per prefix, combined with a BitmapOr
+        conditions.append(or_(*[EMAIL_DOMAIN.like(prefix + "%") for prefix in spec["email_domain"]]))
+    return conditions
+
+
+def copy_filter_clauses(spec: dict, args: list) -> list:
+    """WHERE clauses for build_copy_sql; values are appended to `args` as $n arguments."""
+    def arg(value):
+        args.append(value)
+        return f"${len(args)}"
+
+    clauses = []
+    for name in ("country_code", "subscription_tier"):
+        values = spec.get(name)
+        if values:
+            clauses.append(f"{name} = {arg(values[0])}" if len(values) == 1 else f"{name} = ANY({arg(values)})")
+    if "min_ltv" in spec:
+        clauses.append(f"lifetime_value >= {arg(Decimal(spec['min_ltv']))}::numeric")
+    if "max_ltv" in spec:
+        clauses.append(f"lifetime_value <= {arg(Decimal(spec['max_ltv']))}::numeric")
+    if "signup_from" in spec:
+        clauses.append(f"signup_date >= {arg(datetime.fromisoformat(spec['signup_from']))}")
+    if "signup_to" in spec:
+        clauses.append(f"signup_date < {arg(datetime.fromisoformat(spec['signup_to']))}")
+    if "min_id" in spec:
+        clauses.append(f"id >= {arg(spec['min_id'])}")
+    if "max_id" in spec:
+        clauses.append(f"id <= {arg(spec['max_id'])}")
+    if spec.get("email_domain"):
+        prefixes = [f"{EMAIL_DOMAIN_SQL} LIKE {arg(prefix + '%')}" for prefix in spec["email_domain"]]
+        clauses.append("(" + " OR ".join(prefixes) + ")")
+    return clauses
+
+
+def shape_names(spec: dict) -> list:
+    """Filter names for plan statistics: windows and ranges by the column they constrain."""
+    names = set()
+    for name in spec:
+        if name in ("signup_from", "signup_to"):
+            names.add("signup_date")
+        elif name in ("min_id", "max_id"):
+            names.add("id")
+        else:
+            names.add(name)
+    return sorted(names)
@@ -0,0 +1,108 @@
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for parquet / arrow exports
+    pa = None
+    pq = None
+
+FORMATS = ("csv", "ndjson", "parquet", "arrow")
+
+# Formats built from typed record batches instead of encoded text rows
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+# Codecs the Arrow IPC format can compress its buffers with (it has no gzip)
+ARROW_CODECS = ("zstd",)
+
+EXTENSIONS = {
+    "csv": ".csv",
+    "ndjson": ".ndjson",
+    "parquet": ".parquet",
+    "arrow": ".arrows",
+}
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def format_available(fmt: str) -> bool:
+    if fmt in COLUMNAR_FORMATS:
+        return pa is not None
+    return fmt in FORMATS
+
+
+def arrow_field(column: str):
+    """Typed Arrow field for a users column; low-cardinality strings are dictionary encoded."""
+    types = {
+        "id": pa.int32(),
+        "name": pa.string(),
+        "email": pa.string(),
+        "signup_date": pa.timestamp("us", tz="UTC"),
+        "country_code": pa.dictionary(pa.int32(), pa.string()),
+        "subscription_tier": pa.dictionary(pa.int32(), pa.string()),
+        "lifetime_value": pa.decimal128(10, 2),
+    }
+    return pa.field(column, types[column])
+
+
+def arrow_schema(export_columns):
+    return pa.schema([arrow_field(col) for col in export_columns])
+
+
+def rows_to_batch(rows, schema):
+    """Transpose a fetched partition of row tuples into one RecordBatch."""
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ColumnarWriter:
+    """Writes Parquet row groups or an Arrow IPC stream, one batch at a time.
+
+    The Arrow stream format is used rather than the file format because each
+    batch carries its own dictionaries, which the file format cannot replace.
+    """
+
+    def __init__(self, file_path: str, fmt: str, export_columns, compression: str = None):
+        self.schema = arrow_schema(export_columns)
+        self.fmt = fmt
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(file_path, self.schema, compression=compression or "snappy")
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=compression if compression in ARROW_CODECS else None)
+            self._writer = pa.ipc.new_stream(file_path, self.schema, options=options)
+
+    def write_rows(self, rows):
+        batch = rows_to_batch(rows, self.schema)
+        if self.fmt == "parquet":
+            # One fetched partition becomes one row group
+            self._writer.write_batch(batch, row_group_size=len(rows) or None)
+        else:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+
+
+def _ndjson_default(value):
+    # Decimal as text keeps exact cents; datetimes as ISO 8601
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_ndjson(rows, export_columns) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(export_columns, row)), default=_ndjson_default, separators=(",", ":")) + "\n"
+        for row in rows
+    ).encode("utf-8")
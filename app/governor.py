@@ -0,0 +1,223 @@
+"""Process-wide memory budget for export jobs and streamed responses.
+
+The container has a hard memory limit, and every running export holds a
+cursor prefetch, an encoded batch, file writer buffers and possibly a
+compressor. Each job or stream reserves an estimate of those bytes from one
+MemoryGovernor before it starts:
+
+- if the full estimate fits, it is granted;
+- if only part of it fits but at least the job's minimum does, the job gets
+  what is free and shrinks its batch size to match;
+- otherwise it waits in FIFO order (its place in line shows in /status).
+
+Workers only claim as many jobs as the free budget can admit, so the rest
+stay `pending` in the exports table, where any node can report their queue
+position. The estimates are deliberately rough: per-row costs for Python
+row objects, plus fixed buffer sizes taken from the settings.
+"""
+import asyncio
+import logging
+import time
+
+from app.config import settings
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Resident bytes per fetched row: Row tuple and value objects, per column, plus its share of the encoded chunk
+ROW_BYTES = 120
+COLUMN_BYTES = 110
+
+# Fewest rows per batch a shrunk job still fetches
+MIN_BATCH_ROWS = 500
+
+# Compressor state plus one input and one output chunk (app/compression.py CHUNK_SIZE)
+COMPRESSOR_BYTES = {"gzip": 3 * 1024 ** 2, "zstd": 10 * 1024 ** 2}
+
+# Typed conversion of a record batch roughly doubles it for Parquet/Arrow
+COLUMNAR_FACTOR = 2
+
+
+def writer_bytes() -> int:
+    """One BufferedFileWriter: the buffer being filled plus the queued ones."""
+    return settings.EXPORT_WRITE_BUFFER * (settings.EXPORT_WRITE_QUEUE_DEPTH + 1)
+
+
+def row_bytes(column_count: int) -> int:
+    # The driver's prefetch and the partition being encoded are alive at the same time
+    return 2 * (ROW_BYTES + COLUMN_BYTES * column_count)
+
+
+class Footprint:
+    """Estimated bytes of one job: `fixed` buffers plus `per_row` for each batch row."""
+
+    def __init__(self, fixed: int, per_row: int, batch_rows: int):
+        self.fixed = fixed
+        self.per_row = per_row
+        self.batch_rows = batch_rows
+
+    @property
+    def want(self) -> int:
+        return self.fixed + self.per_row * self.batch_rows
+
+    @property
+    def minimum(self) -> int:
+        return self.fixed + self.per_row * min(MIN_BATCH_ROWS, self.batch_rows)
+
+    def batch_rows_for(self, granted: int) -> int:
+        """Largest batch size that fits in `granted` bytes."""
+        if not self.per_row:
+            return self.batch_rows
+        rows = (granted - self.fixed) // self.per_row
+        return max(min(rows, self.batch_rows), min(MIN_BATCH_ROWS, self.batch_rows))
+
+
+def job_footprint(column_count: int, export_format: str = "csv", export_engine: str = "orm", shards: int = 1,
+                  compression: str = None, batch_rows: int = None) -> Footprint:
+    shards = max(1, shards or 1)
+    fixed = writer_bytes() * shards
+    if compression:
+        # Compression runs after the writers are closed, so it only needs to beat them
+        fixed = max(fixed, COMPRESSOR_BYTES.get(compression, 0))
+    if export_engine == "copy" and export_format == "csv":
+        # Postgres renders the rows; we only hold the raw chunks in flight
+        return Footprint(fixed, 0, 0)
+    if export_format in ("parquet", "arrow", "ndjson"):
+        batch_rows = batch_rows or settings.FORMAT_BATCH_ROWS
+    else:
+        batch_rows = batch_rows or settings.EXPORT_BATCH_ROWS
+    per_row = row_bytes(column_count) * shards
+    if export_format in ("parquet", "arrow"):
+        per_row *= COLUMNAR_FACTOR
+    return Footprint(fixed, per_row, batch_rows)
+
+
+def batch_footprint(column_count: int, members: int, compression: str = None, batch_rows: int = None) -> Footprint:
+    """A shared batch scan (app/batch.py): one cursor over `column_count` columns, a writer per member.
+
+    Each member also holds its projected copy of the rows it matched.
+    """
+    fixed = writer_bytes() * members
+    if compression:
+        fixed = max(fixed, COMPRESSOR_BYTES.get(compression, 0))
+    per_row = row_bytes(column_count) + ROW_BYTES * members
+    return Footprint(fixed, per_row, batch_rows or settings.EXPORT_BATCH_ROWS)
+
+
+def stream_footprint(column_count: int, compression: str = None, batch_rows: int = None) -> Footprint:
+    """GET /exports/csv/stream: one cursor batch, its encoded chunk and an optional compressor."""
+    return Footprint(COMPRESSOR_BYTES.get(compression, 0), row_bytes(column_count),
+                     batch_rows or settings.STREAM_BATCH_ROWS)
+
+
+class MemoryGovernor:
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.in_use = 0
+        self.holders = {}
+        self.waiters = []
+
+    @property
+    def free(self) -> int:
+        return self.budget - self.in_use
+
+    def position(self, key: str):
+        """1-based place of `key` in the wait queue, or None if it is not waiting."""
+        for i, waiter in enumerate(self.waiters):
+            if waiter[0] == key:
+                return i + 1
+        return None
+
+    def admittable(self, minimum: int) -> int:
+        """How many more jobs needing `minimum` bytes could start right now."""
+        if self.waiters:
+            return 0
+        if not self.in_use:
+            return max(1, self.free // max(minimum, 1))
+        return self.free // max(minimum, 1)
+
+    def _grant(self, want: int, minimum: int):
+        if self.free >= want:
+            return want
+        if self.free >= minimum:
+            return self.free
+        return None
+
+    def _hold(self, key: str, granted: int):
+        self.holders[key] = self.holders.get(key, 0) + granted
+        self.in_use += granted
+
+    async def acquire(self, key: str, want: int, minimum: int = None, timeout: float = None) -> int:
+        """Reserve between `minimum` and `want` bytes for `key`; returns the bytes granted.
+
+        A request larger than the whole budget is capped to it, so it runs
+        once everything else is done. Raises asyncio.TimeoutError after
+        `timeout` seconds in the queue.
+        """
+        want = min(want, self.budget)
+        minimum = min(minimum or want, want)
+        granted = None if self.waiters else self._grant(want, minimum)
+        if granted is not None:
+            self._hold(key, granted)
+            if granted < want:
+                SHRUNK.inc()
+            return granted
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = [key, want, minimum, future]
+        self.waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            if timeout is None:
+                granted = await future
+            else:
+                granted = await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif future.done() and not future.cancelled():
+                # Granted just as we gave up
+                self.release(key)
+            if isinstance(e, asyncio.TimeoutError):
+                REJECTED.inc()
+            self._wake()
+            raise
+        finally:
+            WAIT_SECONDS.observe(time.perf_counter() - started)
+        return granted
+
+    def release(self, key: str):
+        """Return everything `key` holds; safe to call more than once."""
+        held = self.holders.pop(key, 0)
+        if held:
+            self.in_use -= held
+            self._wake()
+
+    def _wake(self):
+        # Strict FIFO: a big job at the head is not overtaken by smaller ones
+        while self.waiters:
+            key, want, minimum, future = self.waiters[0]
+            if future.done():
+                self.waiters.pop(0)
+                continue
+            granted = self._grant(want, minimum)
+            if granted is None:
+                return
+            self.waiters.pop(0)
+            self._hold(key, granted)
+            if granted < want:
+                SHRUNK.inc()
+            future.set_result(granted)
+
+
+governor = MemoryGovernor(settings.EXPORT_MEMORY_BUDGET)
+
+metrics.Gauge("export_memory_budget_bytes", "Memory budget shared by exports and streams",
+              collect=lambda: governor.budget)
+metrics.Gauge("export_memory_reserved_bytes", "Bytes currently reserved from the memory budget",
+              collect=lambda: governor.in_use)
+metrics.Gauge("export_memory_waiting", "Jobs and streams waiting for memory budget",
+              collect=lambda: len(governor.waiters))
+WAIT_SECONDS = metrics.Histogram("export_memory_wait_seconds", "Time spent waiting for memory budget")
+SHRUNK = metrics.Counter("export_memory_shrunk_total", "Reservations granted below their full estimate")
+REJECTED = metrics.Counter("export_memory_rejected_total", "Reservations that timed out waiting for budget")
@@ -0,0 +1,247 @@
+import json
+from datetime import timedelta
+
+from sqlalchemy import select, update, func, or_, and_
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Export
+
+# Keyword arguments of process_export that are persisted with each job
+JOB_OPTIONS = (
+    "country_code",
+    "subscription_tier",
+    "min_ltv",
+    "columns",
+    "delimiter",
+    "quotechar",
+    "export_engine",
+    "shards",
+    "compression",
+    "compression_level",
+    "export_format",
+    "count_strategy",
+    "delta",
+    "split",
+    "ttl",
+    "sample",
+    "filters",
+)
+
+
+def encode_options(**options) -> str:
+    return json.dumps({name: options.get(name) for name in JOB_OPTIONS}, sort_keys=True)
+
+
+def decode_options(raw: str) -> dict:
+    options = json.loads(raw or "{}")
+    return {name: options[name] for name in JOB_OPTIONS if name in options}
+
+
+def _lease():
+    return func.now() + timedelta(seconds=settings.WORKER_LEASE_SECONDS)
+
+
+def _expiry():
+    # Partial files of a failed job are kept for EXPORT_TTL (see app/storage.py)
+    if settings.EXPORT_TTL <= 0:
+        return None
+    return func.now() + timedelta(seconds=settings.EXPORT_TTL)
+
+
+def _runnable():
+    return and_(
+        Export.options.is_not(None),
+        Export.source_export_id.is_(None),
+        func.coalesce(Export.attempts, 0) < settings.WORKER_MAX_ATTEMPTS,
+        or_(
+            Export.status == "pending",
+            and_(Export.status == "processing", Export.lease_expires_at < func.now()),
+        ),
+    )
+
+
+async def queue_position(db, export: Export):
+    """1-based place of a pending job in the claim order (priority, then age)."""
+    priority = export.priority or 0
+    ahead = await db.execute(
+        select(func.count()).select_from(Export).where(
+            _runnable(),
+            Export.id != export.id,
+            or_(
+                func.coalesce(Export.priority, 0) > priority,
+                and_(func.coalesce(Export.priority, 0) == priority, Export.created_at < export.created_at),
+            ),
+        )
+    )
+    return ahead.scalar() + 1
+
+
+async def _lease_jobs(worker_id: str, candidates):
+    """Lease the jobs selected by `candidates` (a SKIP LOCKED id subquery)."""
+    stmt = (
+        update(Export)
+        .where(Export.id.in_(candidates))
+        .values(
+            status="processing",
+            worker_id=worker_id,
+            heartbeat_at=func.now(),
+            lease_expires_at=_lease(),
+            attempts=func.coalesce(Export.attempts, 0) + 1,
+        )
+        .returning(Export.id, Export.options, Export.created_at, Export.batch_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(stmt)
+        claimed = result.all()
+        await db.commit()
+    return claimed
+
+
+async def claim_jobs(worker_id: str, limit: int):
+    """Atomically lease up to `limit` runnable jobs for this worker.
+
+    Pending jobs and jobs whose lease has run out are picked by priority, then
+    age. SKIP LOCKED lets any number of workers poll the same table without
+    blocking on each other's candidates.
+    """
+    if limit <= 0:
+        return []
+
+    candidates = (
+        select(Export.id)
+        .where(_runnable())
+        .order_by(Export.priority.desc(), Export.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return await _lease_jobs(worker_id, candidates)
+
+
+async def claim_batch(worker_id: str, batch_id):
+    """Lease the runnable members of a batch that no other worker holds (see app/batch.py)."""
+    candidates = (
+        select(Export.id)
+        .where(_runnable(), Export.batch_id == batch_id)
+        .order_by(Export.created_at)
+        .limit(settings.EXPORT_BATCH_MAX)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return await _lease_jobs(worker_id, candidates)
+
+
+async def fail_exhausted_jobs():
+    """Give up on jobs whose lease expired WORKER_MAX_ATTEMPTS times."""
+    stmt = (
+        update(Export)
+        .where(
+            Export.status == "processing",
+            Export.lease_expires_at < func.now(),
+            func.coalesce(Export.attempts, 0) >= settings.WORKER_MAX_ATTEMPTS,
+        )
+        .values(status="failed", error="Job lease expired too many times", expires_at=_expiry())
+        .execution_options(synchronize_session=False)
+    )
+    async with AsyncSessionLocal() as db:
+        await db.execute(stmt)
+        await db.commit()
+
+
+async def heartbeat(worker_id: str, export_ids):
+    """Extend leases on the jobs we still own; returns the ids we still own.
+
+    A job missing from the result was cancelled or reclaimed by another worker.
+    """
+    if not export_ids:
+        return set()
+    stmt = (
+        update(Export)
+        .where(
+            Export.id.in_(list(export_ids)),
+            Export.worker_id == worker_id,
+            Export.status == "processing",
+        )
+        .values(heartbeat_at=func.now(), lease_expires_at=_lease())
+        .returning(Export.id)
+        .execution_options(synchronize_session=False)
+    )
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(stmt)
+        owned = {row[0] for row in result.all()}
+        await db.commit()
+    return owned
+
+
+async def release_jobs(worker_id: str, export_ids):
+    """Hand unfinished jobs back to the queue on shutdown."""
+    if not export_ids:
+        return
+    stmt = (
+        update(Export)
+        .where(
+            Export.id.in_(list(export_ids)),
+            Export.worker_id == worker_id,
+            Export.status == "processing",
+        )
+        # A graceful hand-back does not count as a failed attempt
+        .values(
+            status="pending",
+            worker_id=None,
+            lease_expires_at=None,
+            attempts=func.greatest(func.coalesce(Export.attempts, 1) - 1, 0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    async with AsyncSessionLocal() as db:
+        await db.execute(stmt)
+        await db.commit()
+
+
+async def requeue_orphans():
+    """Put `processing` jobs nobody holds a lease on back in the queue.
+
+    Covers jobs left behind by a crashed API process running them inline
+    (no lease at all) and leases that already ran out. Their checkpoints let
+    the next worker continue instead of starting over. Orphans that already
+    used up WORKER_MAX_ATTEMPTS are failed instead, in the same transaction.
+    """
+    orphaned = and_(
+        Export.status == "processing",
+        Export.options.is_not(None),
+        or_(Export.lease_expires_at.is_(None), Export.lease_expires_at < func.now()),
+    )
+    attempts = func.coalesce(Export.attempts, 0)
+    exhausted = (
+        update(Export)
+        .where(orphaned, attempts >= settings.WORKER_MAX_ATTEMPTS)
+        .values(status="failed", error="Job lease expired too many times", expires_at=_expiry())
+        .execution_options(synchronize_session=False)
+    )
+    stmt = (
+        update(Export)
+        .where(orphaned, attempts < settings.WORKER_MAX_ATTEMPTS)
+        .values(status="pending", worker_id=None, lease_expires_at=None)
+        .returning(Export.id)
+        .execution_options(synchronize_session=False)
+    )
+    async with AsyncSessionLocal() as db:
+        await db.execute(exhausted)
+        result = await db.execute(stmt)
+        requeued = [row[0] for row in result.all()]
+        await db.commit()
+    return requeued
+
+
+async def resume_job(db, export: Export):
+    """Queue a failed, cancelled or orphaned job again; its checkpoint decides where it starts."""
+    export.status = "pending"
+    export.error = None
+    export.worker_id = None
+    export.lease_expires_at = None
+    export.attempts = 0
+    export.expires_at = None
+    await db.commit()
@@ -1,9 +1,17 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 from app.database import engine, Base
 from app.routes import router
+from app.progress import progress_registry
+from app.config import settings
+from app.worker import Worker
+from app import metrics
+from app.export_service import cancel_job, sync_cancellations
+from app.notifications import notification_listener
+from app.storage import storage_manager
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -16,9 +24,26 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         logger.info("Initializing database...")
         await conn.run_sync(Base.metadata.create_all)
+    progress_registry.start()
+    metrics.loop_lag_monitor.start()
+    notification_listener.start(on_cancel=cancel_job, on_reconnect=sync_cancellations)
+    # Reconciles the export directory, then expires files past their TTL or over the quota
+    storage_manager.start()
+
+    worker_task = None
+    if settings.EMBEDDED_WORKER:
+        worker = Worker()
+        worker_task = asyncio.create_task(worker.run())
     yield
-    # Shutdown: (Optional cleanup)
+    # Shutdown: drain the embedded worker, then persist progress held in memory
     logger.info("Shutting down...")
+    if worker_task:
+        worker.stop()
+        await worker_task
+    await progress_registry.stop()
+    await metrics.loop_lag_monitor.stop()
+    await notification_listener.stop()
+    await storage_manager.stop()
 
 # init the app
 app = FastAPI(
@@ -31,5 +56,10 @@ app = FastAPI(
 async def health():
     return {"status": "ok"}
 
+# Prometheus scrape endpoint (this process only)
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # Include Routes
 app.include_router(router)
@@ -0,0 +1,118 @@
+"""Split exports: numbered part files described by a JSON manifest.
+
+A split export cuts the rows (in id order) into parts of at most `rows` rows
+or about `bytes` uncompressed bytes. Every part has its own header and is
+compressed on its own, so each one is a complete file a loader can ingest in
+parallel. The manifest only lists finished parts (compressed and
+checksummed) and is republished after each one: on Export.manifest, which
+GET /exports/{id}/manifest serves, and as `export_<id>.manifest.json` next to
+the parts. `complete` turns true with the last part.
+
+The manifest is also the resume point: a retried job drops any part not
+listed yet and continues after the last listed part's maxId.
+"""
+import glob
+import hashlib
+import json
+import os
+
+from app.compression import CHUNK_SIZE, EXTENSIONS, compress_file
+from app.formats import EXTENSIONS as FORMAT_EXTENSIONS
+
+# Formats whose parts are written by the split writer
+SPLIT_FORMATS = ("csv", "ndjson")
+
+PART_MEDIA_TYPES = {"gzip": "application/gzip", "zstd": "application/zstd"}
+
+
+def manifest_path(export_dir: str, export_id: str) -> str:
+    return os.path.join(export_dir, f"export_{export_id}.manifest.json")
+
+
+def part_path(export_dir: str, export_id: str, number: int, export_format: str) -> str:
+    """Path of part `number` (1-based) before compression."""
+    return os.path.join(export_dir, f"export_{export_id}.part{number:04d}{FORMAT_EXTENSIONS[export_format]}")
+
+
+def new_manifest(export_id: str, export_format: str, split: dict, compression: str = None) -> dict:
+    return {
+        "exportId": str(export_id),
+        "format": export_format,
+        "compression": compression,
+        "split": split,
+        "complete": False,
+        "totalRows": 0,
+        "parts": [],
+    }
+
+
+def load(raw: str):
+    """Parse a stored manifest; None if missing or unreadable."""
+    if not raw:
+        return None
+    try:
+        manifest = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("parts"), list):
+        return None
+    return manifest
+
+
+def dumps(manifest: dict) -> str:
+    return json.dumps(manifest, separators=(",", ":"))
+
+
+def write(path: str, manifest: dict):
+    """Replace the manifest file atomically. Blocking, run it in a thread."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def finalize_part(path: str, compression: str = None, compression_level: int = None) -> dict:
+    """Compress (optionally) and checksum a closed part. Blocking, run it in a thread.
+
+    Only the file that is served is kept. Returns its name, size and sha256.
+    """
+    if compression:
+        compressed_path = path + EXTENSIONS[compression]
+        compress_file(path, compressed_path, compression, compression_level)
+        os.remove(path)
+        path = compressed_path
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return {"file": os.path.basename(path), "size": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+
+def find_part(manifest: dict, number: int):
+    for part in manifest["parts"]:
+        if part["part"] == number:
+            return part
+    return None
+
+
+def part_files(export_dir: str, export_id: str):
+    """Every part file of an export on disk, listed or not."""
+    return glob.glob(os.path.join(glob.escape(export_dir), f"export_{export_id}.part*"))
+
+
+def remove_unlisted(export_dir: str, export_id: str, manifest: dict):
+    """Drop part files a previous attempt left behind after its last listed part."""
+    listed = {part["file"] for part in manifest["parts"]}
+    for path in part_files(export_dir, export_id):
+        if os.path.basename(path) not in listed:
+            os.remove(path)
+
+
+def stored_files(export) -> list:
+    """All files an export owns: the main file, its compressed copy and any parts."""
+    paths = [export.file_path, export.compressed_path]
+    manifest = load(getattr(export, "manifest", None))
+    if manifest and export.file_path:
+        export_dir = os.path.dirname(export.file_path)
+        paths.extend(os.path.join(export_dir, part["file"]) for part in manifest["parts"])
+    return [path for path in paths if path]
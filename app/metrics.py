@@ -0,0 +1,300 @@
+"""In-process metrics for the export hot path, rendered for Prometheus on /metrics.
+
+Counters, gauges and fixed-bucket histograms are plain dicts updated from the
+event loop, so recording a value costs a dict lookup and an addition. Each
+process (API or worker) exposes its own numbers; workers can serve them on
+WORKER_METRICS_PORT.
+
+Per job, JobMetrics adds up the time spent in each stage (count, fetch,
+encode, write, status updates, stitch, compress) together with row and byte
+counts. The summary is stored as JSON on Export.metrics when the job ends.
+Per-batch timings go to the stage histogram for one batch in
+METRICS_BATCH_SAMPLE (0 turns that off); stage totals are always kept.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import defaultdict
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, key, extra=()) -> str:
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self):
+        return iter(())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[self._key(labels)] += amount
+
+    def _samples(self):
+        for key, value in list(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """A set/inc/dec gauge, or one read from `collect()` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.values = defaultdict(float)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        self.values[self._key(labels)] += amount
+
+    def dec(self, amount=1, **labels):
+        self.values[self._key(labels)] -= amount
+
+    def _samples(self):
+        if self.collect is not None:
+            try:
+                self.values[()] = self.collect()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} collect failed: {e}")
+        for key, value in list(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [per-bucket counts..., sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def _samples(self):
+        for key, state in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state[-2])}"
+            yield f"{self.name}_count{labels} {state[-1]}"
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+EXPORTS_STARTED = Counter("exports_started_total", "Export jobs started by this process", ["format", "engine"])
+EXPORTS_FINISHED = Counter("exports_finished_total", "Export jobs finished by this process", ["status"])
+EXPORTS_ACTIVE = Gauge("exports_active", "Export jobs currently running in this process")
+EXPORT_ROWS = Counter("export_rows_total", "Rows written to export files")
+EXPORT_BYTES = Counter("export_bytes_total", "Bytes written to export files, before compression")
+EXPORT_SECONDS = Histogram("export_duration_seconds", "Wall time of finished export jobs", ["status"])
+STAGE_SECONDS = Counter("export_stage_seconds_total", "Time spent per export stage", ["stage"])
+STAGE_BATCH_SECONDS = Histogram("export_stage_batch_seconds", "Sampled per-batch time per export stage", ["stage"])
+STATUS_UPDATE_SECONDS = Histogram("export_status_update_seconds", "Time spent in update_status")
+DOWNLOADS = Counter("export_downloads_total", "Download requests by how they were served", ["mode"])
+DOWNLOAD_BYTES = Counter("export_download_bytes_total", "Response body bytes sent by downloads", ["mode"])
+DOWNLOAD_PREPARE_SECONDS = Histogram("export_download_prepare_seconds", "Time to look up an export and build its download response", ["mode"])
+POOL_CHECKOUT_SECONDS = Histogram("db_pool_checkout_seconds", "Time waiting for a pooled database connection", ["pool"])
+LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "How late the event loop ran a periodic timer",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+# Jobs running in this process, by export id
+jobs = {}
+
+
+class JobMetrics:
+    """Stage timings and counters for one export job."""
+
+    def __init__(self, export_id: str):
+        self.export_id = export_id
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.sample_every = settings.METRICS_BATCH_SAMPLE
+
+    def add(self, stage: str, seconds: float, batch: bool = False):
+        """Record `seconds` of `stage`; `batch` timings also feed the sampled histogram."""
+        self.stages[stage] += seconds
+        STAGE_SECONDS.inc(seconds, stage=stage)
+        if batch and self.sample_every and self.batches % self.sample_every == 0:
+            STAGE_BATCH_SECONDS.observe(seconds, stage=stage)
+
+    def stage(self, name: str):
+        return _StageTimer(self, name)
+
+    def batch(self, rows: int, size: int):
+        self.batches += 1
+        self.rows += rows
+        self.bytes += size
+        EXPORT_ROWS.inc(rows)
+        EXPORT_BYTES.inc(size)
+
+    def summary(self) -> dict:
+        return {
+            "elapsedSeconds": round(time.perf_counter() - self.started, 3),
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "batches": self.batches,
+        }
+
+
+class _StageTimer:
+    def __init__(self, job: JobMetrics, name: str):
+        self.job = job
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.job.add(self.name, time.perf_counter() - self.started)
+
+
+def start_job(export_id: str, export_format: str, engine: str) -> JobMetrics:
+    job = jobs[export_id] = JobMetrics(export_id)
+    EXPORTS_STARTED.inc(format=export_format, engine=engine)
+    EXPORTS_ACTIVE.inc()
+    return job
+
+
+def finish_job(export_id: str, status: str):
+    """Close a job's metrics; returns its summary as JSON for Export.metrics."""
+    job = jobs.pop(export_id, None)
+    if job is None:
+        return None
+    EXPORTS_ACTIVE.dec()
+    EXPORTS_FINISHED.inc(status=status)
+    summary = job.summary()
+    EXPORT_SECONDS.observe(summary["elapsedSeconds"], status=status)
+    return json.dumps(summary)
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag every `interval` seconds into LOOP_LAG_SECONDS."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - scheduled))
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+loop_lag_monitor = LoopLagMonitor(settings.METRICS_LOOP_LAG_INTERVAL)
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if request_line.split(b" ")[1:2] == [b"/metrics"]:
+            body = render().encode("utf-8")
+            head = f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\n"
+        else:
+            body = b"not found\n"
+            head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+        writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(port: int, host: str = "0.0.0.0"):
+    """Tiny HTTP server for GET /metrics in processes without the API (workers)."""
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info(f"Serving metrics on {host}:{port}/metrics")
+    return server
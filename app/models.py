@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Integer, Numeric
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Numeric, Float, Boolean
 from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime, timezone
 import uuid
@@ -19,15 +19,92 @@ class Export(Base):
     __tablename__ = "exports"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    status = Column(String, nullable=False) # pending, processing, completed, failed, cancelled
+    status = Column(String, nullable=False) # pending, processing, completed, failed, cancelled, expired
     total_rows = Column(Integer, default=0)
     processed_rows = Column(Integer, default=0) # rows we already did
     percentage = Column(Integer, default=0)
+    total_rows_estimated = Column(Boolean, default=False) # total_rows is a planner estimate until the count lands
     error = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime(timezone=True), nullable=True) # last time a worker picked it up
     completed_at = Column(DateTime(timezone=True), nullable=True)
     file_path = Column(String, nullable=True)
+    format = Column(String, default="csv") # csv, ndjson, parquet, arrow
+    file_size = Column(BigInteger, nullable=True)
+
+    # Compressed artifact written once at export time (gzip or zstd)
+    compression = Column(String, nullable=True)
+    compressed_path = Column(String, nullable=True)
+    compressed_size = Column(BigInteger, nullable=True)
+    compression_ratio = Column(Float, nullable=True) # compressed_size / file_size
+
+    # Result cache: hash of the normalized request + data version. Cache hits and
+    # requests attached to a running job point at the export that owns the files.
+    cache_key = Column(String(64), nullable=True, index=True)
+    source_export_id = Column(UUID(as_uuid=True), nullable=True, index=True)
+    last_accessed_at = Column(DateTime(timezone=True), nullable=True)
+
+    # When the storage sweeper deletes the files and marks the row expired (see app/storage.py)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Job queue: process_export kwargs as JSON, plus the lease of the worker running it
+    options = Column(String, nullable=True)
+    priority = Column(Integer, default=0)
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, default=0)
+
+    # Resume point as JSON: per shard last id (under ORDER BY id), byte offset and rows
+    checkpoint = Column(String, nullable=True)
+
+    # Per-job stage timings and counters as JSON, written when the job ends (see app/metrics.py)
+    metrics = Column(String, nullable=True)
+
+    # Split exports: JSON manifest of the finished part files (see app/manifest.py)
+    manifest = Column(String, nullable=True)
+
+    # Planner estimate taken when the job was queued (see app/query_plan.py); `plan` is the JSON summary
+    plan_rows = Column(BigInteger, nullable=True)
+    plan_cost = Column(Float, nullable=True)
+    plan = Column(String, nullable=True)
+
+    # Delta exports: the subscription they belong to (see app/subscriptions.py)
+    subscription = Column(String(100), nullable=True, index=True)
+
+    # Batch exports: members of one POST /exports/batch share a scan (see app/batch.py)
+    batch_id = Column(UUID(as_uuid=True), nullable=True, index=True)
     
-    # Storage for filters and options
+    # Storage for filters (the normalized spec as JSON, see app/filters.py) and options
     filters = Column(String, nullable=True) 
     columns = Column(String, nullable=True)
+
+
+class ExportSubscription(Base):
+    """A named filter + column set whose exports only pick up rows past a watermark."""
+    __tablename__ = "export_subscriptions"
+
+    name = Column(String(100), primary_key=True)
+    watermark_column = Column(String, nullable=False, default="id") # id or signup_date
+    watermark = Column(String, nullable=True) # last value exported, NULL before the first delta
+    options = Column(String, nullable=False) # export options as JSON, like Export.options
+    last_export_id = Column(UUID(as_uuid=True), nullable=True) # delta that moved the watermark
+    snapshot_export_id = Column(UUID(as_uuid=True), nullable=True) # compacted artifact, if any
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class ExportPlanStats(Base):
+    """Planner estimates and actual run times of export jobs, added up per filter shape."""
+    __tablename__ = "export_plan_stats"
+
+    shape = Column(String(100), primary_key=True) # filters that were set, e.g. "country_code+min_ltv"
+    jobs = Column(Integer, default=0)
+    full_scans = Column(Integer, default=0) # plans that read the whole table
+    planned_rows = Column(BigInteger, default=0)
+    total_cost = Column(Float, default=0)
+    filter_values = Column(String, nullable=True) # most requested values per filter, as JSON
+    finished = Column(Integer, default=0)
+    rows = Column(BigInteger, default=0) # rows written by finished jobs
+    seconds = Column(Float, default=0) # and the time they took
+    updated_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,171 @@
+"""Export events over Postgres LISTEN/NOTIFY.
+
+Every process keeps one dedicated asyncpg connection LISTENing on
+NOTIFY_CHANNEL and fans the messages out in memory:
+
+- `progress` messages are published by the progress flusher, from the rows
+  its UPDATE actually wrote, in the same transaction. They feed
+  GET /exports/{id}/events.
+- `cancel` messages are published by DELETE /exports/{id} and reach the
+  process running the job, whichever node that is.
+
+If the listener connection drops, it reconnects every
+NOTIFY_RECONNECT_INTERVAL seconds and then calls `on_reconnect`, so missed
+cancels can be reconciled from the exports table. Subscribers get a
+`resync` message so they can re-read the current state.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+import asyncpg
+from sqlalchemy import text
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Payloads over this size are rejected by Postgres (limit is 8000 bytes)
+MAX_PAYLOAD = 7900
+
+NOTIFY_SQL = text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload")
+
+
+def progress_message(export_id, status, total_rows=None, processed_rows=None, percentage=None,
+                     total_rows_estimated=None, error=None) -> dict:
+    return {
+        "type": "progress",
+        "exportId": str(export_id),
+        "status": status,
+        "progress": {
+            "totalRows": total_rows,
+            "totalRowsEstimated": bool(total_rows_estimated),
+            "processedRows": processed_rows,
+            "percentage": percentage,
+        },
+        "error": error[:1000] if error else error,
+    }
+
+
+def cancel_message(export_id) -> dict:
+    return {"type": "cancel", "exportId": str(export_id)}
+
+
+async def publish(db, messages):
+    """Queue NOTIFYs on `db`'s transaction; they go out when it commits."""
+    payloads = []
+    for message in messages:
+        payload = json.dumps(message, separators=(",", ":"), default=str)
+        if len(payload.encode("utf-8")) > MAX_PAYLOAD:
+            logger.warning(f"Dropping oversized notification for export {message.get('exportId')}")
+            continue
+        payloads.append(payload)
+    if payloads:
+        await db.execute(NOTIFY_SQL, {"channel": settings.NOTIFY_CHANNEL, "payloads": payloads})
+
+
+def _asyncpg_dsn() -> str:
+    return settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+class NotificationListener:
+    def __init__(self, channel: str = None, reconnect_interval: float = None):
+        self.channel = channel or settings.NOTIFY_CHANNEL
+        self.reconnect_interval = reconnect_interval or settings.NOTIFY_RECONNECT_INTERVAL
+        self.subscribers = defaultdict(set)
+        self.on_cancel = None
+        self.on_reconnect = None
+        self.connected = False
+        self._task = None
+        self._users = 0
+
+    # -- fan-out ----------------------------------------------------------
+
+    def subscribe(self, export_id) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        self.subscribers[str(export_id)].add(queue)
+        return queue
+
+    def unsubscribe(self, export_id, queue: asyncio.Queue):
+        queues = self.subscribers.get(str(export_id))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                self.subscribers.pop(str(export_id), None)
+
+    def _deliver(self, export_id: str, message: dict):
+        for queue in list(self.subscribers.get(export_id, ())):
+            if queue.full():
+                # A slow client only needs the latest progress
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+            export_id = message["exportId"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed notification: {payload[:200]}")
+            return
+        if message.get("type") == "cancel" and self.on_cancel is not None:
+            asyncio.ensure_future(self.on_cancel(export_id))
+        self._deliver(export_id, message)
+
+    # -- connection -------------------------------------------------------
+
+    async def _run(self):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(_asyncpg_dsn())
+                await connection.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                logger.info(f"Listening for export events on {self.channel}")
+                if self.on_reconnect is not None:
+                    try:
+                        await self.on_reconnect()
+                    except Exception as e:
+                        logger.warning(f"Reconnect hook failed: {e}")
+                for export_id in list(self.subscribers):
+                    self._deliver(export_id, {"type": "resync", "exportId": export_id})
+                # Notifications arrive through the callback; just watch the connection
+                while not connection.is_closed():
+                    await asyncio.sleep(self.reconnect_interval)
+                    await connection.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Export event listener lost its connection: {e}")
+            finally:
+                self.connected = False
+                if connection is not None and not connection.is_closed():
+                    try:
+                        await connection.close(timeout=2)
+                    except Exception:
+                        connection.terminate()
+            await asyncio.sleep(self.reconnect_interval)
+
+    def start(self, on_cancel=None, on_reconnect=None):
+        """Start listening; the API and an embedded worker share one connection."""
+        self._users += 1
+        if on_cancel is not None:
+            self.on_cancel = on_cancel
+        if on_reconnect is not None:
+            self.on_reconnect = on_reconnect
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._users = max(0, self._users - 1)
+        if self._users or self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+notification_listener = NotificationListener()
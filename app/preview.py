@@ -0,0 +1,128 @@
+"""GET /exports/csv/preview: the start of an export and how big it would be.
+
+The rows are the first `rows` rows of the export in id order, encoded with
+the export's compiled encoder, so they are byte for byte the start of the
+file POST /exports/csv would write.
+
+The size estimate reads a `TABLESAMPLE SYSTEM` sample of about
+PREVIEW_SAMPLE_ROWS rows of users (whole pages, fetched by ctid) and checks
+the filters on each sampled row:
+
+- estimated rows: matched / sampled rows, times the table's reltuples;
+- average bytes per row: the matched rows, encoded;
+- projected gzip size: the raw size times the ratio gzip gets on the sample.
+
+The sample seed is fixed, so the same request gets the same estimate until
+the table changes. Both queries run under a PREVIEW_TIMEOUT statement timeout.
+"""
+import asyncio
+
+from sqlalchemy import select, and_, text, true
+from sqlalchemy.exc import DBAPIError
+
+from app.compression import new_compressor
+from app.config import settings
+from app.export_service import sample_sql
+from app.models import User
+from app.row_count import RELTUPLES_SQL
+from app.row_encoder import compile_encoder, encode_header
+
+# Upper bound on `rows`
+MAX_ROWS = 1000
+
+# Smallest sample, in percent of the table's pages
+MIN_SAMPLE_PERCENT = 0.01
+
+# Seed of the size-estimate sample
+SAMPLE_SEED = 0
+
+# SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = "57014"
+
+
+class PreviewTimeout(Exception):
+    """A preview query ran past PREVIEW_TIMEOUT."""
+
+
+def sample_percent(reltuples) -> float:
+    """Share of users' pages that holds about PREVIEW_SAMPLE_ROWS rows (all of it before ANALYZE)."""
+    if not reltuples or reltuples <= 0:
+        return 100.0
+    return min(100.0, max(MIN_SAMPLE_PERCENT, settings.PREVIEW_SAMPLE_ROWS * 100.0 / reltuples))
+
+
+async def first_rows(db, export_columns, filters, delimiter: str, quotechar: str, limit: int):
+    """(csv bytes, row count): header plus the first `limit` rows of the export."""
+    query = select(*[getattr(User, col) for col in export_columns])
+    if filters:
+        query = query.where(and_(*filters))
+    rows = (await db.execute(query.order_by(User.id).limit(limit))).all()
+    encode = compile_encoder(export_columns, delimiter, quotechar)
+    return encode_header(export_columns, delimiter, quotechar) + encode(rows), len(rows)
+
+
+def _measure(encode, header: bytes, rows):
+    """(encoded bytes of `rows`, gzip size of header + rows). Blocking, run it in a thread."""
+    body = encode(rows)
+    compressor = new_compressor("gzip")
+    compressed = compressor.compress(header + body) + compressor.flush()
+    return len(body), len(compressed)
+
+
+async def estimate(db, export_columns, filters, delimiter: str, quotechar: str) -> dict:
+    """Projected row count and sizes of the export, from a sample of users."""
+    reltuples = (await db.execute(RELTUPLES_SQL)).scalar()
+    percent = sample_percent(reltuples)
+    matches = and_(*filters) if filters else true()
+    query = (
+        select(*[getattr(User, col) for col in export_columns], matches.label("matched"))
+        .where(text(sample_sql({"percent": percent, "seed": SAMPLE_SEED})))
+    )
+    sampled = (await db.execute(query)).all()
+    # NULL (a filter on a NULL column) does not match, as in the export
+    matched = [row for row in sampled if row.matched]
+
+    if percent >= 100:
+        rows = len(matched)
+    elif sampled:
+        rows = round(len(matched) * reltuples / len(sampled))
+    else:
+        rows = 0
+
+    header = encode_header(export_columns, delimiter, quotechar)
+    encode = compile_encoder(export_columns, delimiter, quotechar)
+    body_bytes, gzip_bytes = await asyncio.to_thread(_measure, encode, header, matched)
+    row_bytes = body_bytes / len(matched) if matched else None
+    raw_bytes = len(header) + round(rows * (row_bytes or 0))
+    ratio = gzip_bytes / (len(header) + body_bytes)
+    return {
+        "samplePercent": round(percent, 4),
+        "sampledRows": len(sampled),
+        "matchedRows": len(matched),
+        "exact": percent >= 100,
+        "estimatedRows": rows,
+        "avgRowBytes": round(row_bytes, 1) if row_bytes is not None else None,
+        "projectedBytes": raw_bytes,
+        "projectedGzipBytes": round(raw_bytes * ratio),
+    }
+
+
+async def preview(db, export_columns, filters, delimiter: str = ",", quotechar: str = '"', limit: int = 20) -> dict:
+    """First rows and size estimate of an export; raises PreviewTimeout past PREVIEW_TIMEOUT."""
+    try:
+        # Only for this transaction: the session goes back to the pool afterwards
+        await db.execute(text(f"SET LOCAL statement_timeout = {int(settings.PREVIEW_TIMEOUT * 1000)}"))
+        body, count = await first_rows(db, export_columns, filters, delimiter, quotechar, limit)
+        size = await estimate(db, export_columns, filters, delimiter, quotechar)
+        await db.rollback()
+    except DBAPIError as e:
+        await db.rollback()
+        if getattr(e.orig, "pgcode", None) == QUERY_CANCELED or "statement timeout" in str(e):
+            raise PreviewTimeout(f"Preview took longer than {settings.PREVIEW_TIMEOUT:g}s") from e
+        raise
+    return {
+        "columns": list(export_columns),
+        "rows": count,
+        "csv": body.decode("utf-8"),
+        "estimate": size,
+    }
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import update, values, column, func, case, cast, String, Integer, BigInteger, Float, DateTime, Boolean
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app import metrics
+from app.notifications import progress_message, publish
+from app.models import Export
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.Histogram("progress_flush_seconds", "Time of one batched progress UPDATE")
+FLUSH_ROWS = metrics.Counter("progress_flush_exports_total", "Exports rows written by progress flushes")
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# Fields mirrored from the exports row, in the order used for the VALUES list
+PROGRESS_FIELDS = (
+    ("status", String),
+    ("total_rows", Integer),
+    ("total_rows_estimated", Boolean),
+    ("processed_rows", Integer),
+    ("percentage", Integer),
+    ("error", String),
+    ("file_path", String),
+    ("started_at", DateTime(timezone=True)),
+    ("completed_at", DateTime(timezone=True)),
+    ("file_size", BigInteger),
+    ("compression", String),
+    ("compressed_path", String),
+    ("compressed_size", BigInteger),
+    ("compression_ratio", Float),
+    ("checkpoint", String),
+    ("format", String),
+    ("metrics", String),
+    ("manifest", String),
+    ("expires_at", DateTime(timezone=True)),
+)
+
+
+class ProgressEntry:
+    """In-memory copy of one export's progress, plus the fields not yet persisted."""
+
+    def __init__(self, export_id: str):
+        self.export_id = export_id
+        self.status = None
+        self.total_rows = 0
+        self.total_rows_estimated = False
+        self.processed_rows = 0
+        self.percentage = 0
+        self.error = None
+        self.file_path = None
+        self.created_at = None
+        self.started_at = None
+        self.completed_at = None
+        self.file_size = None
+        self.compression = None
+        self.compressed_path = None
+        self.compressed_size = None
+        self.compression_ratio = None
+        self.checkpoint = None
+        self.format = None
+        self.metrics = None
+        self.manifest = None
+        self.expires_at = None
+        # Runtime-only details (writer queue stats...), never persisted
+        self.runtime = {}
+        self.dirty = set()
+        self.flushed_rows = 0
+
+    @property
+    def is_complete(self):
+        """True once we know enough to answer /status without the DB."""
+        return self.status is not None and self.created_at is not None
+
+
+class ProgressRegistry:
+    """Process-wide progress state with coalesced write-behind to `exports`.
+
+    Workers call `update()` as often as they like; a single background flusher
+    persists all dirty entries with one multi-row UPDATE every
+    PROGRESS_FLUSH_INTERVAL seconds, or sooner once any job has advanced by
+    PROGRESS_FLUSH_ROWS rows. Terminal states are flushed right away.
+    """
+
+    def __init__(self, interval: float = 1.0, row_interval: int = 50000):
+        self.interval = interval
+        self.row_interval = row_interval
+        self.entries = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def get(self, export_id: str):
+        return self.entries.get(str(export_id))
+
+    def track(self, export_id: str, status: str, created_at: datetime):
+        """Register a job created by this process so /status can be served locally."""
+        entry = self.entries.setdefault(str(export_id), ProgressEntry(str(export_id)))
+        entry.status = status
+        entry.created_at = created_at
+        return entry
+
+    def discard(self, export_id: str):
+        self.entries.pop(str(export_id), None)
+
+    def annotate(self, export_id: str, **runtime):
+        """Attach runtime details to a local job without marking it dirty."""
+        entry = self.entries.get(str(export_id))
+        if entry is not None:
+            entry.runtime.update(runtime)
+
+    def update(self, export_id: str, **fields):
+        entry = self.entries.setdefault(str(export_id), ProgressEntry(str(export_id)))
+        for name, value in fields.items():
+            if value is None:
+                continue
+            setattr(entry, name, value)
+            entry.dirty.add(name)
+
+        if entry.processed_rows - entry.flushed_rows >= self.row_interval:
+            self._wakeup.set()
+        return entry
+
+    async def flush(self):
+        """Persist every dirty entry in a single UPDATE ... FROM (VALUES ...)."""
+        async with self._lock:
+            pending = [entry for entry in self.entries.values() if entry.dirty]
+            if not pending:
+                return
+
+            rows = []
+            snapshots = []
+            for entry in pending:
+                dirty = entry.dirty
+                entry.dirty = set()
+                snapshots.append((entry, dirty))
+                row = [UUID(entry.export_id)]
+                # Unchanged fields go out as NULL and are kept by COALESCE below
+                row.extend(getattr(entry, name) if name in dirty else None for name, _ in PROGRESS_FIELDS)
+                rows.append(tuple(row))
+
+            data = values(
+                column("id", PG_UUID(as_uuid=True)),
+                *[column(name, type_) for name, type_ in PROGRESS_FIELDS],
+                name="progress"
+            ).data(rows)
+
+            stmt = (
+                update(Export)
+                .where(Export.id == cast(data.c.id, PG_UUID(as_uuid=True)))
+                # Cast: Postgres types an all-NULL VALUES column as text, which COALESCE
+                # cannot match with an integer or timestamptz column
+                .values({
+                    name: func.coalesce(cast(data.c[name], type_), getattr(Export, name))
+                    for name, type_ in PROGRESS_FIELDS
+                })
+                # A cancel written by the API (possibly on another node) wins
+                .values(status=case(
+                    (Export.status == "cancelled", Export.status),
+                    else_=func.coalesce(cast(data.c.status, String), Export.status)
+                ))
+                .returning(
+                    Export.id, Export.status, Export.total_rows, Export.processed_rows,
+                    Export.percentage, Export.total_rows_estimated, Export.error
+                )
+                .execution_options(synchronize_session=False)
+            )
+
+            started = time.perf_counter()
+            try:
+                async with AsyncSessionLocal() as db:
+                    written = (await db.execute(stmt)).all()
+                    # Subscribers hear what was stored, e.g. "cancelled" rather than our status
+                    await publish(db, [progress_message(*row) for row in written])
+                    await db.commit()
+                FLUSH_SECONDS.observe(time.perf_counter() - started)
+                FLUSH_ROWS.inc(len(rows))
+            except Exception as e:
+                logger.warning(f"Progress flush failed, will retry: {e}")
+                for entry, dirty in snapshots:
+                    entry.dirty |= dirty
+                return
+
+            for entry, _ in snapshots:
+                entry.flushed_rows = entry.processed_rows
+                if entry.status in TERMINAL_STATUSES and not entry.dirty:
+                    self.entries.pop(entry.export_id, None)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+progress_registry = ProgressRegistry(
+    interval=settings.PROGRESS_FLUSH_INTERVAL,
+    row_interval=settings.PROGRESS_FLUSH_ROWS,
+)
@@ -0,0 +1,303 @@
+"""Planner estimates for export queries, taken before a job is queued.
+
+POST /exports runs `EXPLAIN (FORMAT JSON)` on the query the job will
+stream. The estimated rows, total cost and how `users` is scanned are
+stored on the export:
+
+- a job costlier than EXPORT_COST_LOW_PRIORITY goes to the low-priority
+  lane (priority EXPORT_LOW_PRIORITY), so cheap exports are claimed first;
+- a job costlier than EXPORT_COST_REJECT is refused.
+
+The plans are also added up per filter shape (which filters were set) in
+`export_plan_stats`, together with the rows and seconds of the jobs that
+finished. The throughput of finished jobs gives /status its ETA. Those
+totals, plus the most requested filter values, back the index suggestions
+of GET /exports/plans.
+
+Costs are in planner units (seq_page_cost = 1), not seconds.
+"""
+import json
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.filters import shape_names
+from app.models import ExportPlanStats
+from app.row_count import RELTUPLES_SQL, explain_plan
+
+logger = logging.getLogger(__name__)
+
+# Filters in a shape and the users column each one constrains
+FILTER_COLUMNS = {
+    "country_code": "country_code",
+    "subscription_tier": "subscription_tier",
+    "min_ltv": "lifetime_value",
+    "max_ltv": "lifetime_value",
+    "signup_date": "signup_date",
+    "id": "id",
+    "email_domain": "email",
+}
+
+# Equality filters lead a composite index, one range column follows them
+EQUALITY_FILTERS = ("country_code", "subscription_tier")
+RANGE_COLUMNS = ("lifetime_value", "signup_date")
+
+# Indexes in seeds/01_init.sql that already serve a range filter on its own
+RANGE_INDEXES = {
+    "lifetime_value": "idx_users_lifetime_value",
+    "signup_date": "idx_users_signup_date",
+    "id": "the primary key",
+    "email": "idx_users_email_domain",
+}
+
+# Past this share of the table a sequential scan beats any index
+INDEX_SELECTIVITY = 0.2
+
+# A filter value this common across a shape's jobs is worth a partial index
+PARTIAL_INDEX_SHARE = 0.8
+
+# Filter values remembered per column and shape
+TOP_VALUES = 20
+
+# Running jobs report a progress-based ETA once they have run this long
+MIN_PROGRESS_SECONDS = 5
+
+
+async def explain(db, query) -> dict:
+    """Top plan node of `query` (EXPLAIN without ANALYZE: nothing is executed)."""
+    plan = await explain_plan(db, query)
+    return plan[0]["Plan"]
+
+
+def _scans(node):
+    """Plan nodes that read `users`, depth first."""
+    if node.get("Relation Name") == "users":
+        yield node
+    for child in node.get("Plans", ()):
+        yield from _scans(child)
+
+
+def summarize(plan: dict) -> dict:
+    scan = next(_scans(plan), {})
+    node_type = scan.get("Node Type") or ""
+    return {
+        "rows": int(plan.get("Plan Rows") or 0),
+        "cost": float(plan.get("Total Cost") or 0),
+        "startupCost": float(plan.get("Startup Cost") or 0),
+        "scan": node_type or None,
+        "index": scan.get("Index Name"),
+        # Walking the primary key for ORDER BY id and filtering every row reads the whole table too
+        "fullScan": "Seq Scan" in node_type or (node_type.startswith("Index") and "Index Cond" not in scan),
+    }
+
+
+def filter_shape(spec: dict = None, delta=None, sample=None):
+    """(shape, values): which filters are set, as a stats key, and their values.
+
+    Only single values of the equality filters and min_ltv are remembered:
+    those are what a partial index could be built on.
+    """
+    spec = spec or {}
+    values = {}
+    for name in EQUALITY_FILTERS:
+        if len(spec.get(name) or ()) == 1:
+            values[name] = spec[name][0]
+    if "min_ltv" in spec:
+        values["min_ltv"] = spec["min_ltv"]
+    names = shape_names(spec)
+    if delta and delta.get("column") == "signup_date" and "signup_date" not in names:
+        # Watermark range; an id range rides on the primary key
+        names.append("signup_date")
+    if sample:
+        # Sampled exports read a few pages by ctid: their own plans and throughput
+        names.append("sample")
+    return "+".join(names) or "none", values
+
+
+class CostLimitExceeded(Exception):
+    """The planner's estimate is over EXPORT_COST_REJECT; `plan` is the summary."""
+
+    def __init__(self, plan: dict):
+        super().__init__(f"Estimated cost {plan['cost']:.0f} is over the limit of {settings.EXPORT_COST_REJECT:.0f}")
+        self.plan = plan
+
+
+def lane_for(cost: float) -> str:
+    if settings.EXPORT_COST_LOW_PRIORITY and cost > settings.EXPORT_COST_LOW_PRIORITY:
+        return "low"
+    return "normal"
+
+
+def suggest_index(shape: str, selectivity, value_counts: dict, jobs: int):
+    """An index that would serve `shape`'s filters, or None, with the reason."""
+    columns = [name for name in shape.split("+") if name in FILTER_COLUMNS]
+    if not columns:
+        return None, "No filters: a full export reads the whole table anyway"
+    if selectivity is not None and selectivity > INDEX_SELECTIVITY:
+        return None, (
+            f"The filters keep about {selectivity:.0%} of the table; "
+            "a sequential scan is cheaper than any index"
+        )
+
+    # One value asked for nearly every time: index only those rows, in export (id) order
+    for name in columns:
+        counts = value_counts.get(name) or {}
+        if len(columns) == 1 and counts and jobs:
+            value, seen = max(counts.items(), key=lambda item: item[1])
+            if seen / jobs >= PARTIAL_INDEX_SHARE:
+                column = FILTER_COLUMNS[name]
+                op = ">=" if name == "min_ltv" else "="
+                literal = value if name == "min_ltv" else "'" + value.replace("'", "''") + "'"
+                slug = "".join(c if c.isalnum() else "_" for c in value.lower())
+                return (
+                    f"CREATE INDEX idx_users_{column}_{slug}_id ON users (id) WHERE {column} {op} {literal}",
+                    f"{seen} of {jobs} jobs filter on {name}={value}",
+                )
+
+    # Equality columns first, one range column after them; otherwise id,
+    # so the rows come out in export order and resumes can seek
+    equality = [FILTER_COLUMNS[name] for name in columns if name in EQUALITY_FILTERS]
+    ranges = [column for column in RANGE_COLUMNS if column in {FILTER_COLUMNS[name] for name in columns}]
+    if not equality:
+        served = sorted({RANGE_INDEXES[FILTER_COLUMNS[name]] for name in columns})
+        return None, (
+            f"{', '.join(served)} already serve{'s' if len(served) == 1 else ''} these filters; if the planner "
+            "still reads the whole table, its row estimate is off (run ANALYZE users)"
+        )
+    trailing = ranges[0] if ranges else "id"
+    key = equality + [trailing]
+    return (
+        f"CREATE INDEX idx_users_{'_'.join(key)} ON users ({', '.join(key)})",
+        "Composite index on the combined filters",
+    )
+
+
+def _selectivity(rows, reltuples):
+    # reltuples is -1 (or 0) until the table has been analyzed
+    return rows / reltuples if reltuples and reltuples > 0 else None
+
+
+def _count_values(value_counts: dict, values: dict) -> dict:
+    counts = {name: dict(seen) for name, seen in (value_counts or {}).items()}
+    for name, value in values.items():
+        seen = counts.setdefault(name, {})
+        seen[value] = seen.get(value, 0) + 1
+        if len(seen) > TOP_VALUES:
+            # Forget the rarest value so the row stays small
+            del seen[min(seen, key=seen.get)]
+    return counts
+
+
+async def record_plan(db, shape: str, values: dict, summary: dict):
+    """Add a planned job to its shape's totals; the caller commits."""
+    await db.execute(insert(ExportPlanStats).values(shape=shape).on_conflict_do_nothing())
+    stats = (await db.execute(
+        select(ExportPlanStats).where(ExportPlanStats.shape == shape).with_for_update()
+    )).scalars().one()
+    stats.jobs = (stats.jobs or 0) + 1
+    stats.full_scans = (stats.full_scans or 0) + (1 if summary["fullScan"] else 0)
+    stats.planned_rows = (stats.planned_rows or 0) + summary["rows"]
+    stats.total_cost = (stats.total_cost or 0) + summary["cost"]
+    stats.filter_values = json.dumps(_count_values(json.loads(stats.filter_values or "{}"), values))
+    stats.updated_at = datetime.now(timezone.utc)
+
+
+async def record_run(shape: str, rows: int, seconds: float):
+    """Add a finished job's rows and run time to its shape's totals."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(ExportPlanStats)
+            .where(ExportPlanStats.shape == shape)
+            .values(
+                finished=func.coalesce(ExportPlanStats.finished, 0) + 1,
+                rows=func.coalesce(ExportPlanStats.rows, 0) + rows,
+                seconds=func.coalesce(ExportPlanStats.seconds, 0) + seconds,
+                updated_at=datetime.now(timezone.utc),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+
+async def history_rate(db, shape: str = None):
+    """Rows per second of finished jobs with this shape, or of all jobs if none finished yet."""
+    stats = await db.get(ExportPlanStats, shape) if shape else None
+    if stats and stats.seconds:
+        return float(stats.rows or 0) / stats.seconds
+    rows, seconds = (await db.execute(
+        select(func.sum(ExportPlanStats.rows), func.sum(ExportPlanStats.seconds))
+    )).one()
+    # SUM of a bigint is a numeric, which does not divide by a float
+    return float(rows or 0) / seconds if seconds else None
+
+
+def eta(status, total_rows, processed_rows, started_at, rate=None):
+    """Seconds left and what the guess rests on ("progress" or "history")."""
+    if status not in ("pending", "processing") or not total_rows:
+        return None
+    remaining = max(total_rows - (processed_rows or 0), 0)
+    if status == "processing" and started_at and processed_rows:
+        elapsed = (datetime.now(timezone.utc) - started_at).total_seconds()
+        if elapsed >= MIN_PROGRESS_SECONDS:
+            return {"seconds": round(remaining * elapsed / processed_rows), "basis": "progress"}
+    if rate:
+        return {"seconds": round(remaining / rate), "basis": "history"}
+    return None
+
+
+async def plan_export(db, query, shape: str, values: dict) -> dict:
+    """EXPLAIN `query`, pick its lane and count it in the shape's totals.
+
+    Raises CostLimitExceeded if the plan is over EXPORT_COST_REJECT. Returns
+    None if EXPLAIN itself failed: the job is then queued without a plan.
+    """
+    started = time.perf_counter()
+    try:
+        # Savepoint: a failed EXPLAIN must not abort the caller's transaction
+        async with db.begin_nested():
+            summary = summarize(await explain(db, query))
+    except Exception as e:
+        logger.warning(f"EXPLAIN of export query failed, queuing without a plan: {e}")
+        return None
+    summary["shape"] = shape
+    summary["lane"] = lane_for(summary["cost"])
+    if summary["fullScan"]:
+        selectivity = _selectivity(summary["rows"], (await db.execute(RELTUPLES_SQL)).scalar())
+        summary["suggestedIndex"], summary["suggestionReason"] = suggest_index(shape, selectivity, {}, 0)
+    if settings.EXPORT_COST_REJECT and summary["cost"] > settings.EXPORT_COST_REJECT:
+        raise CostLimitExceeded(summary)
+    await record_plan(db, shape, values, summary)
+    summary["planSeconds"] = round(time.perf_counter() - started, 4)
+    return summary
+
+
+async def plan_report(db) -> list:
+    """Per filter shape: plan totals, throughput and the index that would serve it."""
+    reltuples = (await db.execute(RELTUPLES_SQL)).scalar()
+    rows = (await db.execute(select(ExportPlanStats).order_by(ExportPlanStats.total_cost.desc()))).scalars().all()
+    report = []
+    for stats in rows:
+        jobs = stats.jobs or 0
+        average_rows = stats.planned_rows / jobs if jobs else None
+        entry = {
+            "shape": stats.shape,
+            "jobs": jobs,
+            "fullScanShare": round(stats.full_scans / jobs, 3) if jobs else None,
+            "averageCost": round(stats.total_cost / jobs) if jobs else None,
+            "averageRows": round(average_rows) if average_rows is not None else None,
+            "finishedJobs": stats.finished or 0,
+            "rowsPerSecond": round(stats.rows / stats.seconds) if stats.seconds else None,
+            "topValues": json.loads(stats.filter_values or "{}"),
+        }
+        if stats.full_scans:
+            selectivity = _selectivity(average_rows or 0, reltuples)
+            entry["suggestedIndex"], entry["suggestionReason"] = suggest_index(
+                stats.shape, selectivity, entry["topValues"], jobs
+            )
+        report.append(entry)
+    return report
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, text, func, update
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Export
+
+logger = logging.getLogger(__name__)
+
+# Cheap data-version token: a new signup bumps max(id), updates and deletes
+# bump the table's modification counters.
+DATA_VERSION_SQL = text("""
+    SELECT
+        (SELECT max(id) FROM users),
+        (SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables WHERE relname = 'users')
+""")
+
+
+def normalize_request(export_columns, filters=None, delimiter=",", quotechar='"', export_engine="orm",
+                      compression=None, compression_level=None, export_format="csv", split=None, sample=None):
+    """Everything that changes the bytes of the artifact, in canonical form.
+
+    `filters` is a spec from app.filters.normalize_filters, already canonical.
+    Shard count is left out on purpose: it changes how the file is built, not
+    what ends up in it.
+    """
+    normalized = {
+        "filters": filters or {},
+        "columns": list(export_columns),
+        "dialect": {"delimiter": delimiter, "quotechar": quotechar},
+        "engine": export_engine,
+        "compression": [compression, compression_level] if compression else None,
+        "format": export_format,
+    }
+    if split:
+        # Only present for split exports, so existing keys stay valid
+        normalized["split"] = split
+    if sample:
+        # Percent and seed pick the pages, so both are part of the artifact
+        normalized["sample"] = {"percent": float(sample["percent"]), "seed": int(sample["seed"])}
+    return normalized
+
+
+async def get_data_version(db):
+    max_id, modifications = (await db.execute(DATA_VERSION_SQL)).one()
+    return [max_id, modifications]
+
+
+async def compute_key(db, normalized: dict) -> str:
+    payload = dict(normalized, data_version=await get_data_version(db))
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+async def lock_key(db, key: str):
+    """Serialize lookups for one key until the caller's transaction ends."""
+    await db.execute(select(func.pg_advisory_xact_lock(int(key[:15], 16))))
+
+
+async def find_completed(db, key: str):
+    """Most recent completed, unexpired artifact for this key, if its file still exists."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.EXPORT_CACHE_TTL)
+    result = await db.execute(
+        select(Export)
+        .where(
+            Export.cache_key == key,
+            Export.status == "completed",
+            Export.source_export_id.is_(None),
+            Export.completed_at >= cutoff,
+        )
+        .order_by(Export.completed_at.desc())
+        .limit(1)
+    )
+    export = result.scalars().first()
+    if export and export.file_path and os.path.exists(export.file_path):
+        return export
+    return None
+
+
+async def find_running(db, key: str):
+    result = await db.execute(
+        select(Export)
+        .where(
+            Export.cache_key == key,
+            Export.status.in_(("pending", "processing")),
+            Export.source_export_id.is_(None),
+        )
+        .order_by(Export.created_at)
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+def clone_completed(source: Export, export_id, now: datetime) -> Export:
+    """New export id that points at an existing artifact instead of rescanning."""
+    return Export(
+        id=export_id,
+        status="completed",
+        created_at=now,
+        completed_at=now,
+        total_rows=source.total_rows,
+        processed_rows=source.processed_rows,
+        percentage=100,
+        file_path=source.file_path,
+        file_size=source.file_size,
+        compression=source.compression,
+        compressed_path=source.compressed_path,
+        compressed_size=source.compressed_size,
+        compression_ratio=source.compression_ratio,
+        format=source.format,
+        manifest=source.manifest,
+        expires_at=source.expires_at,
+        filters=source.filters,
+        source_export_id=source.id,
+    )
+
+
+async def touch(db, export: Export):
+    """Record an access for LRU ordering on the export that owns the files."""
+    owner_id = export.source_export_id or export.id
+    await db.execute(
+        update(Export)
+        .where(Export.id == owner_id)
+        .values(last_accessed_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _unkey(db, ids) -> int:
+    """Stop serving `ids` from the cache; their files stay until `expires_at` (app/storage.py)."""
+    if not ids:
+        return 0
+    await db.execute(
+        update(Export)
+        .where(Export.id.in_(ids))
+        .values(cache_key=None)
+        .execution_options(synchronize_session=False)
+    )
+    return len(ids)
+
+
+async def evict() -> int:
+    """Retire cache keys past EXPORT_CACHE_TTL, then least recently used ones over EXPORT_CACHE_MAX_BYTES.
+
+    Only the key goes: the export stays downloadable, and its files are
+    deleted by the storage sweeper at its own `expires_at`. The TTL pass runs
+    in SKIP LOCKED batches of STORAGE_SWEEP_BATCH rows, so the size pass only
+    reads exports that finished within EXPORT_CACHE_TTL.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.EXPORT_CACHE_TTL)
+    batch = settings.STORAGE_SWEEP_BATCH
+    keyed = (
+        Export.cache_key.is_not(None),
+        Export.status == "completed",
+        Export.source_export_id.is_(None),
+    )
+
+    retired = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            stale = await db.execute(
+                select(Export.id)
+                .where(*keyed, Export.completed_at < cutoff)
+                .limit(batch)
+                .with_for_update(skip_locked=True)
+            )
+            ids = [row[0] for row in stale.all()]
+            retired += await _unkey(db, ids)
+            await db.commit()
+        if len(ids) < batch:
+            break
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            select(Export.id, Export.file_size, Export.compressed_size)
+            .where(*keyed)
+            .order_by(func.coalesce(Export.last_accessed_at, Export.completed_at).desc())
+            .execution_options(yield_per=batch)
+        )
+        kept_bytes = 0
+        over = []
+        async for row in result:
+            size = (row.file_size or 0) + (row.compressed_size or 0)
+            if kept_bytes + size > settings.EXPORT_CACHE_MAX_BYTES:
+                over.append(row.id)
+            else:
+                kept_bytes += size
+        await result.close()
+        for start in range(0, len(over), batch):
+            retired += await _unkey(db, over[start:start + batch])
+        await db.commit()
+
+    if retired:
+        logger.info(f"Retired {retired} cache keys")
+    return retired
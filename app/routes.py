@@ -1,35 +1,46 @@
-from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, Query, Request, Response
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+import asyncio
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from uuid import UUID
+from uuid import UUID, uuid4
 from datetime import datetime, timezone
 import os
-import zlib
+import re
+import json
+import time
 import logging
+import weakref
 
-from app.database import get_db
-from app.models import Export
-from app.export_service import process_export, cancel_job
+from app.database import get_db, AsyncSessionLocal
+from app.models import User, Export, ExportSubscription
+from app.export_service import stream_export, cancel_job, resolve_columns, build_filters, build_query, EXPORT_ENGINES
+from app import result_cache, job_queue, metrics, subscriptions, storage, query_plan, preview
+from app.row_count import COUNT_STRATEGIES
+from app.progress import progress_registry, TERMINAL_STATUSES
+from app.notifications import notification_listener, publish, progress_message, cancel_message
+from app.compression import CODECS, CONTENT_ENCODINGS, EXTENSIONS, codec_available, validate_level, iter_compressed, parse_accept_encoding
+from app.config import settings
+from app.downloads import conditional_file_response, make_etag
+from app.formats import (
+    FORMATS, COLUMNAR_FORMATS, ARROW_CODECS, MEDIA_TYPES, EXTENSIONS as FORMAT_EXTENSIONS, format_available,
+)
+from app.governor import governor, stream_footprint, Footprint, COMPRESSOR_BYTES
+from app.filters import FILTER_PARAMS, InvalidFilter, normalize_filters, filters_from_options, encode_filters
+from app.batch import BATCH_FORMATS, BATCH_SHAPE, shareable, shared_columns, shared_query
+from app.manifest import SPLIT_FORMATS, PART_MEDIA_TYPES, load as load_manifest, find_part, stored_files
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Endpoint to start the export
-@router.post("/exports/csv", status_code=202)
-async def initiate_export(
-    background_tasks: BackgroundTasks,
-    country_code: str = Query(None),
-    subscription_tier: str = Query(None),
-    min_ltv: float = Query(None),
-    columns: str = Query(None),
-    delimiter: str = Query(","),
-    quoteChar: str = Query('"'),
-    db: AsyncSession = Depends(get_db)
-):
-    from uuid import uuid4
-    export_id = str(uuid4())
-    logger.info(f"New export requested: {export_id}")
+SUBSCRIPTION_NAME = re.compile(r"[A-Za-z0-9._-]{1,100}")
+
+# Keys of one export spec in a POST /exports/batch body, besides the filters
+BATCH_SPEC_KEYS = ("columns", "delimiter", "quoteChar", "format", "compression", "compression_level", "ttl")
 
+
+def validate_dialect(delimiter: str, quoteChar: str):
     # Validate delimiter
     if delimiter and len(delimiter) != 1:
         raise HTTPException(
@@ -44,32 +55,510 @@ async def initiate_export(
             detail="Quote character must be a single character"
         )
 
+    # A field could not be quoted, and a quoted field could not be read back
+    if (delimiter or ",") == (quoteChar or '"'):
+        raise HTTPException(
+            status_code=400,
+            detail="Delimiter and quote character must differ"
+        )
+
+
+def validate_compression(compression: str, compression_level: int):
+    if compression:
+        if compression not in CODECS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Compression must be one of: {', '.join(CODECS)}"
+            )
+        if not codec_available(compression):
+            raise HTTPException(status_code=400, detail=f"{compression} compression is not available")
+        try:
+            validate_level(compression, compression_level)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def validate_export_options(delimiter, quoteChar, engine, compression, compression_level, export_format, count=None):
+    validate_dialect(delimiter, quoteChar)
+
+    if engine not in EXPORT_ENGINES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Engine must be one of: {', '.join(EXPORT_ENGINES)}"
+        )
+
+    validate_compression(compression, compression_level)
+
+    if export_format not in FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format must be one of: {', '.join(FORMATS)}"
+        )
+    if not format_available(export_format):
+        raise HTTPException(status_code=400, detail=f"{export_format} export is not available")
+    if export_format == "arrow" and compression and compression not in ARROW_CODECS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Arrow exports support the compression: {', '.join(ARROW_CODECS)}"
+        )
+
+    if count and count not in COUNT_STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Count must be one of: {', '.join(COUNT_STRATEGIES)}"
+        )
+
+
+def filter_params(
+    country_code: list[str] = Query(None),
+    subscription_tier: list[str] = Query(None),
+    min_ltv: float = Query(None),
+    max_ltv: float = Query(None),
+    signup_from: str = Query(None),
+    signup_to: str = Query(None),
+    min_id: int = Query(None),
+    max_id: int = Query(None),
+    email_domain: list[str] = Query(None)
+) -> dict:
+    """Filter query parameters as a normalized spec (see app/filters.py).
+
+    List filters take repeated parameters or comma-separated values.
+    """
+    try:
+        return normalize_filters(
+            country_code=country_code,
+            subscription_tier=subscription_tier,
+            min_ltv=min_ltv,
+            max_ltv=max_ltv,
+            signup_from=signup_from,
+            signup_to=signup_to,
+            min_id=min_id,
+            max_id=max_id,
+            email_domain=email_domain
+        )
+    except InvalidFilter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def validate_split(part_rows, part_bytes, export_format, engine, shards):
+    """Turn part_rows / part_bytes into the job's split policy (None for one file)."""
+    if not part_rows and not part_bytes:
+        return None
+    if part_rows and part_bytes:
+        raise HTTPException(status_code=400, detail="Pass either part_rows or part_bytes, not both")
+    if export_format not in SPLIT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Split exports support the formats: {', '.join(SPLIT_FORMATS)}"
+        )
+    if engine != "orm" or shards > 1:
+        raise HTTPException(status_code=400, detail="Split exports use the orm engine with a single shard")
+    return {"rows": part_rows} if part_rows else {"bytes": part_bytes}
+
+
+def count_download(mode: str, started: float, response, request: Request = None):
+    """Record a download served as `mode` and count the bytes it sends."""
+    metrics.DOWNLOADS.inc(mode=mode)
+    metrics.DOWNLOAD_PREPARE_SECONDS.observe(time.perf_counter() - started, mode=mode)
+    if request is not None and request.method == "HEAD":
+        return response
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = _count_bytes(response.body_iterator, mode)
+    elif response.headers.get("content-length"):
+        metrics.DOWNLOAD_BYTES.inc(int(response.headers["content-length"]), mode=mode)
+    return response
+
+
+async def _count_bytes(iterator, mode: str):
+    async for chunk in iterator:
+        metrics.DOWNLOAD_BYTES.inc(len(chunk), mode=mode)
+        yield chunk
+
+
+async def reserve_memory(footprint: Footprint):
+    """Reserve budget for a streamed response; 503 if none frees up within EXPORT_MEMORY_WAIT."""
+    key = f"stream-{uuid4()}"
+    try:
+        granted = await governor.acquire(
+            key, footprint.want, footprint.minimum, timeout=settings.EXPORT_MEMORY_WAIT
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Export memory budget is exhausted, retry later",
+            headers={"Retry-After": str(max(1, int(settings.EXPORT_MEMORY_WAIT)))}
+        )
+    return key, granted
+
+
+def release_after(body, key: str):
+    """Hold a memory reservation while a response body is being sent."""
+    async def iterate():
+        try:
+            if hasattr(body, "__aiter__"):
+                async for chunk in body:
+                    yield chunk
+            else:
+                async for chunk in iterate_in_threadpool(body):
+                    yield chunk
+        finally:
+            governor.release(key)
+
+    stream = iterate()
+    # Also released if the body is never iterated (client gone before the response started)
+    weakref.finalize(stream, governor.release, key)
+    return stream
+
+
+async def guard_cost(db: AsyncSession, query, shape: str, values: dict, priority: int):
+    """EXPLAIN the job's query: 422 over EXPORT_COST_REJECT, low-priority lane over EXPORT_COST_LOW_PRIORITY."""
+    try:
+        plan = await query_plan.plan_export(db, query.order_by(User.id), shape, values)
+    except query_plan.CostLimitExceeded as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "plan": e.plan})
+    if plan and plan["lane"] == "low":
+        priority = min(priority, settings.EXPORT_LOW_PRIORITY)
+    return plan, priority
+
+
+def plan_columns(plan) -> dict:
+    """Export columns recording a plan from guard_cost."""
+    if not plan:
+        return {}
+    return {"plan_rows": plan["rows"], "plan_cost": plan["cost"], "plan": json.dumps(plan)}
+
+
+async def reuse_artifact(db: AsyncSession, export_id: str, cache_key: str, ttl, now):
+    """Point `export_id` at a finished or running export with the same cache key.
+
+    Returns the response body, or None if there is neither. The caller holds
+    the key's lock and commits.
+    """
+    # Same request, same data: point a new id at the existing artifact
+    source = await result_cache.find_completed(db, cache_key)
+    if source:
+        logger.info(f"Export {export_id} served from cache of {source.id}")
+        # The shared files live as long as the longest TTL asked for
+        requested = storage.expires_at(ttl)
+        if source.expires_at and (requested is None or requested > source.expires_at):
+            source.expires_at = requested
+        db.add(result_cache.clone_completed(source, UUID(export_id), now))
+        await result_cache.touch(db, source)
+        return {"exportId": export_id, "status": "completed"}
+
+    # Same request already running: attach instead of starting a second scan
+    source = await result_cache.find_running(db, cache_key)
+    if source:
+        logger.info(f"Export {export_id} attached to running export {source.id}")
+        db.add(Export(
+            id=UUID(export_id),
+            status="pending",
+            created_at=now,
+            source_export_id=source.id
+        ))
+        return {"exportId": export_id, "status": source.status}
+    return None
+
+
+async def resolve_source(db: AsyncSession, export):
+    """Attached exports report the status and files of the job they joined."""
+    source_id = getattr(export, "source_export_id", None)
+    if not source_id or export.status in ("cancelled", "expired"):
+        return export
+    if export.status == "completed" and export.file_path:
+        # Cache hit: the row already carries the artifact details
+        return export
+    source = progress_registry.get(source_id)
+    if not source or not source.is_complete:
+        source = await db.get(Export, source_id)
+    return source or export
+
+
+# Endpoint to start the export
+@router.post("/exports", status_code=202)
+@router.post("/exports/csv", status_code=202)
+async def initiate_export(
+    filters: dict = Depends(filter_params),
+    columns: str = Query(None),
+    delimiter: str = Query(","),
+    quoteChar: str = Query('"'),
+    engine: str = Query("orm"),
+    shards: int = Query(1, ge=1),
+    compression: str = Query(None),
+    compression_level: int = Query(None),
+    cache: bool = Query(True),
+    priority: int = Query(0),
+    export_format: str = Query("csv", alias="format"),
+    count: str = Query(None),
+    part_rows: int = Query(None, ge=1),
+    part_bytes: int = Query(None, ge=1),
+    ttl: int = Query(None, ge=1),
+    sample: float = Query(None, gt=0, le=100),
+    sample_seed: int = Query(None, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    export_id = str(uuid4())
+    logger.info(f"New export requested: {export_id}")
+
+    validate_export_options(delimiter, quoteChar, engine, compression, compression_level, export_format, count)
+    split = validate_split(part_rows, part_bytes, export_format, engine, shards)
+    if sample is not None:
+        # Pass sample_seed to get the same pages again (while the table is unchanged)
+        sample = {"percent": sample, "seed": UUID(export_id).int % 2**31 if sample_seed is None else sample_seed}
+
+    now = datetime.now(timezone.utc)
+    cache_key = None
+    if cache:
+        normalized = result_cache.normalize_request(
+            resolve_columns(columns), filters, delimiter, quoteChar, engine,
+            compression, compression_level, export_format, split, sample
+        )
+        cache_key = await result_cache.compute_key(db, normalized)
+        await result_cache.lock_key(db, cache_key)
+        body = await reuse_artifact(db, export_id, cache_key, ttl, now)
+        if body:
+            await db.commit()
+            return body
+
+    # Planner estimate: costly filter combinations wait in the low-priority lane
+    query, _ = build_query(filters, sample=sample)
+    shape, values = query_plan.filter_shape(filters, sample=sample)
+    plan, priority = await guard_cost(db, query, shape, values, priority)
+
     # Create export record
     new_export = Export(
         id=UUID(export_id),
         status="pending",
-        created_at=datetime.now(timezone.utc),
+        created_at=now,
         processed_rows=0,
         total_rows=0,
-        percentage=0
+        percentage=0,
+        format=export_format,
+        cache_key=cache_key,
+        priority=priority,
+        filters=encode_filters(filters),
+        **plan_columns(plan),
+        # Queued for `python -m app.worker`
+        options=job_queue.encode_options(
+            filters=filters,
+            columns=columns,
+            delimiter=delimiter,
+            quotechar=quoteChar,
+            export_engine=engine,
+            shards=shards,
+            compression=compression,
+            compression_level=compression_level,
+            export_format=export_format,
+            count_strategy=count,
+            split=split,
+            ttl=ttl,
+            sample=sample
+        )
     )
 
     db.add(new_export)
     await db.commit()
 
-    # Start background task
-    background_tasks.add_task(
-        process_export,
-        export_id=export_id,
-        country_code=country_code,
-        subscription_tier=subscription_tier,
-        min_ltv=min_ltv,
-        columns=columns,
-        delimiter=delimiter,
-        quotechar=quoteChar
-    )
+    body = {"exportId": export_id, "status": "pending"}
+    if plan:
+        body.update(estimatedRows=plan["rows"], estimatedCost=plan["cost"], lane=plan["lane"])
+    return body
 
-    return {"exportId": export_id, "status": "pending"}
+
+def batch_spec(i: int, spec) -> dict:
+    """One export of a batch body, validated, as export job options."""
+    if not isinstance(spec, dict):
+        raise HTTPException(status_code=400, detail=f"exports[{i}] must be an object")
+    unknown = set(spec) - set(BATCH_SPEC_KEYS) - set(FILTER_PARAMS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"exports[{i}]: unknown keys: {', '.join(sorted(unknown))}")
+
+    columns = spec.get("columns")
+    if isinstance(columns, list):
+        columns = ",".join(str(column) for column in columns)
+    delimiter = spec.get("delimiter", ",")
+    quotechar = spec.get("quoteChar", '"')
+    export_format = spec.get("format", "csv")
+    compression = spec.get("compression")
+    compression_level = spec.get("compression_level")
+    ttl = spec.get("ttl")
+    validate_export_options(delimiter, quotechar, "orm", compression, compression_level, export_format)
+    if ttl is not None and (not isinstance(ttl, int) or ttl < 1):
+        raise HTTPException(status_code=400, detail=f"exports[{i}]: ttl must be a positive integer")
+    try:
+        filters = normalize_filters(**{name: spec[name] for name in FILTER_PARAMS if name in spec})
+    except (InvalidFilter, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"exports[{i}]: {e}")
+    options = {
+        "filters": filters,
+        "columns": columns,
+        "delimiter": delimiter,
+        "quotechar": quotechar,
+        "export_engine": "orm",
+        "compression": compression,
+        "compression_level": compression_level,
+        "export_format": export_format,
+        "ttl": ttl,
+    }
+    if not shareable(options):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch exports support the formats: {', '.join(BATCH_FORMATS)}"
+        )
+    return options
+
+
+# many exports, one scan: queued together and run by one worker (see app/batch.py)
+@router.post("/exports/batch", status_code=202)
+async def initiate_batch(
+    payload: dict = Body(...),
+    cache: bool = Query(True),
+    priority: int = Query(0),
+    db: AsyncSession = Depends(get_db)
+):
+    specs = payload.get("exports")
+    if not isinstance(specs, list) or not 1 <= len(specs) <= settings.EXPORT_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"exports must be a list of 1 to {settings.EXPORT_BATCH_MAX} export specs"
+        )
+    jobs = [batch_spec(i, spec) for i, spec in enumerate(specs)]
+    batch_id = uuid4()
+    logger.info(f"New export batch requested: {batch_id} ({len(jobs)} exports)")
+
+    now = datetime.now(timezone.utc)
+    keys = [None] * len(jobs)
+    if cache:
+        for i, options in enumerate(jobs):
+            normalized = result_cache.normalize_request(
+                resolve_columns(options["columns"]), options["filters"], options["delimiter"], options["quotechar"],
+                "orm", options["compression"], options["compression_level"], options["export_format"]
+            )
+            keys[i] = await result_cache.compute_key(db, normalized)
+        # Always in the same order, so two batches sharing keys cannot deadlock
+        for key in sorted(set(keys)):
+            await result_cache.lock_key(db, key)
+
+    exports = []
+    queued = []
+    queued_keys = {}
+    for options, cache_key in zip(jobs, keys):
+        export_id = str(uuid4())
+        if cache_key:
+            body = await reuse_artifact(db, export_id, cache_key, options["ttl"], now)
+            if body is None and cache_key in queued_keys:
+                # The same export twice in one batch: the second one follows the first
+                db.add(Export(
+                    id=UUID(export_id),
+                    status="pending",
+                    created_at=now,
+                    source_export_id=UUID(queued_keys[cache_key])
+                ))
+                body = {"exportId": export_id, "status": "pending"}
+            if body:
+                exports.append(body)
+                continue
+            queued_keys[cache_key] = export_id
+        queued.append((export_id, options, cache_key))
+        exports.append({"exportId": export_id, "status": "pending"})
+
+    plan = None
+    if queued:
+        # The shared scan is what runs, so it is what the cost guard looks at
+        query = shared_query(
+            [build_filters(options["filters"]) for _, options, _ in queued],
+            shared_columns(resolve_columns(options["columns"]) for _, options, _ in queued)
+        )
+        plan, priority = await guard_cost(db, query, BATCH_SHAPE, {}, priority)
+
+    for export_id, options, cache_key in queued:
+        db.add(Export(
+            id=UUID(export_id),
+            status="pending",
+            created_at=now,
+            processed_rows=0,
+            total_rows=0,
+            percentage=0,
+            format=options["export_format"],
+            cache_key=cache_key,
+            priority=priority,
+            filters=encode_filters(options["filters"]),
+            # A single job has nothing to share a scan with
+            batch_id=batch_id if len(queued) > 1 else None,
+            **plan_columns(plan),
+            options=job_queue.encode_options(**options)
+        ))
+    await db.commit()
+
+    body = {"batchId": str(batch_id), "exports": exports}
+    if plan:
+        body.update(estimatedRows=plan["rows"], estimatedCost=plan["cost"], lane=plan["lane"])
+    return body
+
+
+# stream the CSV straight into the response, no job and no file on disk
+@router.get("/exports/csv/stream")
+async def stream_csv(
+    request: Request,
+    filters: dict = Depends(filter_params),
+    columns: str = Query(None),
+    delimiter: str = Query(","),
+    quoteChar: str = Query('"'),
+    compression: str = Query(None),
+    compression_level: int = Query(None)
+):
+    logger.info("Direct streaming export requested")
+    started = time.perf_counter()
+
+    validate_dialect(delimiter, quoteChar)
+    validate_compression(compression, compression_level)
+
+    headers = {"Content-Disposition": 'attachment; filename="export.csv"'}
+    if compression:
+        headers["Content-Encoding"] = CONTENT_ENCODINGS[compression]
+        headers["Content-Disposition"] = f'attachment; filename="export.csv{EXTENSIONS[compression]}"'
+
+    footprint = stream_footprint(len(resolve_columns(columns)), compression)
+    key, granted = await reserve_memory(footprint)
+
+    return count_download("stream", started, StreamingResponse(
+        release_after(stream_export(
+            request.is_disconnected,
+            filters=filters,
+            columns=columns,
+            delimiter=delimiter,
+            quotechar=quoteChar,
+            compression=compression,
+            compression_level=compression_level,
+            batch_rows=footprint.batch_rows_for(granted)
+        ), key),
+        media_type="text/csv",
+        headers=headers
+    ))
+
+
+# first rows of an export and its projected size, without running it
+@router.get("/exports/csv/preview")
+async def preview_csv(
+    filters: dict = Depends(filter_params),
+    columns: str = Query(None),
+    delimiter: str = Query(","),
+    quoteChar: str = Query('"'),
+    rows: int = Query(20, ge=0, le=preview.MAX_ROWS),
+    db: AsyncSession = Depends(get_db)
+):
+    validate_dialect(delimiter, quoteChar)
+    _, conditions = build_query(filters)
+    try:
+        return await preview.preview(db, resolve_columns(columns), conditions, delimiter, quoteChar, rows)
+    except preview.PreviewTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+# EXPLAIN estimates and run times per filter shape, with the index that would serve it
+@router.get("/exports/plans")
+async def get_plan_stats(db: AsyncSession = Depends(get_db)):
+    return {"shapes": await query_plan.plan_report(db)}
 
 
 # check progress
@@ -82,28 +571,144 @@ async def get_export_status(export_id: str, db: AsyncSession = Depends(get_db)):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid export ID format")
 
-    export = await db.get(Export, export_uuid)
+    # Jobs running in this process are answered from memory
+    export = progress_registry.get(export_uuid)
+    if not export or not export.is_complete:
+        export = await db.get(Export, export_uuid)
     if not export:
         raise HTTPException(status_code=404, detail="Export job not found")
 
-    return {
-        "exportId": str(export.id),
+    created_at = export.created_at
+    export = await resolve_source(db, export)
+
+    body = {
+        "exportId": str(export_uuid),
         "status": export.status,
         "progress": {
             "totalRows": export.total_rows,
+            "totalRowsEstimated": bool(getattr(export, "total_rows_estimated", False)),
             "processedRows": export.processed_rows,
             "percentage": export.percentage
         },
         "error": export.error,
-        "createdAt": export.created_at.isoformat() if export.created_at else None,
-        "completedAt": export.completed_at.isoformat() if export.completed_at else None
+        "createdAt": created_at.isoformat() if created_at else None,
+        "completedAt": export.completed_at.isoformat() if export.completed_at else None,
+        "expiresAt": export.expires_at.isoformat() if getattr(export, "expires_at", None) else None
     }
+    if getattr(export, "filters", None):
+        body["filters"] = json.loads(export.filters)
+    if getattr(export, "batch_id", None):
+        body["batchId"] = str(export.batch_id)
+    # Writer queue depth and stall time, only known for jobs running in this process
+    if getattr(export, "runtime", None):
+        body.update(export.runtime)
+    job_id = str(getattr(export, "export_id", None) or export.id)
+    # Where a job waits: for memory budget in this process, or in the worker queue
+    body["queuePosition"] = governor.position(job_id)
+    if body["queuePosition"] is None and export.status == "pending":
+        queued = export if isinstance(export, Export) else await db.get(Export, UUID(job_id))
+        if queued is not None and queued.options and not queued.source_export_id:
+            body["queuePosition"] = await job_queue.queue_position(db, queued)
+    # Planner estimate from submission, and an ETA: the job's own pace once it is
+    # running, otherwise the throughput of finished jobs with the same filters
+    plan = json.loads(export.plan) if getattr(export, "plan", None) else None
+    if plan:
+        body["plan"] = plan
+    total = export.total_rows or getattr(export, "plan_rows", None)
+    started_at = getattr(export, "started_at", None)
+    body["eta"] = query_plan.eta(export.status, total, export.processed_rows, started_at)
+    if body["eta"] is None and total and export.status in ("pending", "processing"):
+        rate = await query_plan.history_rate(db, plan["shape"] if plan else None)
+        body["eta"] = query_plan.eta(export.status, total, export.processed_rows, started_at, rate)
+    # Stage timings: live for a job running here, otherwise the summary stored at the end
+    job = metrics.jobs.get(job_id)
+    if job is not None:
+        body["metrics"] = job.summary()
+    elif getattr(export, "metrics", None):
+        body["metrics"] = json.loads(export.metrics)
+    return body
+
+
+async def _progress_snapshot(export_uuid: UUID):
+    """Current progress message for an export, or None if it does not exist."""
+    export = progress_registry.get(export_uuid)
+    async with AsyncSessionLocal() as db:
+        if not export or not export.is_complete:
+            export = await db.get(Export, export_uuid)
+        if not export:
+            return None
+        export = await resolve_source(db, export)
+    return progress_message(
+        export_uuid, export.status, export.total_rows, export.processed_rows, export.percentage,
+        getattr(export, "total_rows_estimated", False), export.error,
+    )
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
+
+
+@router.get("/exports/{export_id}/events")
+async def export_events(export_id: str, request: Request):
+    """Server-sent progress events, pushed by whichever process runs the job."""
+    try:
+        export_uuid = UUID(export_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid export ID format")
+
+    # Short-lived session: a long-running event stream must not hold a pooled connection
+    async with AsyncSessionLocal() as db:
+        export = await db.get(Export, export_uuid)
+        if not export:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        # Attached exports follow the events of the job they joined
+        source_id = export.source_export_id if export.status not in ("cancelled", "expired") else None
+    follow_id = str(source_id or export_uuid)
+
+    finished = TERMINAL_STATUSES + ("expired",)
+    queue = notification_listener.subscribe(follow_id)
+
+    async def events():
+        try:
+            # Subscribed first, so nothing published after the snapshot is missed
+            snapshot = await _progress_snapshot(export_uuid)
+            if snapshot is None:
+                return
+            yield _sse("progress", snapshot)
+            if snapshot["status"] in finished:
+                return
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), settings.SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if message["type"] == "resync":
+                    # The listener reconnected and may have missed messages
+                    message = await _progress_snapshot(export_uuid)
+                    if message is None:
+                        return
+                elif message["type"] != "progress":
+                    continue
+                message = dict(message, exportId=str(export_uuid))
+                yield _sse("progress", message)
+                if message["status"] in finished:
+                    return
+        finally:
+            notification_listener.unsubscribe(follow_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # download the actual file
-@router.get("/exports/{export_id}/download")
+@router.api_route("/exports/{export_id}/download", methods=["GET", "HEAD"])
 async def download_export(export_id: str, request: Request, db: AsyncSession = Depends(get_db)):
     logger.info(f"Download requested for export: {export_id}")
+    started = time.perf_counter()
 
     # Validate UUID format
     try:
@@ -115,43 +720,166 @@ async def download_export(export_id: str, request: Request, db: AsyncSession = D
     if not export:
         raise HTTPException(status_code=404, detail="Export not found")
 
+    export = await resolve_source(db, export)
+    if export.status in ("cancelled", "expired"):
+        raise HTTPException(status_code=410, detail=f"Export is {export.status}")
     if export.status != "completed":
         raise HTTPException(status_code=425, detail="Export is not completed yet")
 
+    if getattr(export, "manifest", None):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Split export: download the parts listed at /exports/{export_id}/manifest"
+        )
+
     file_path = export.file_path
     if not file_path or not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="CSV file not found on disk")
-
-    accept_encoding = request.headers.get("Accept-Encoding", "")
-
-    # Gzip streaming
-    if "gzip" in accept_encoding:
-        def gzip_stream():
-            compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
-            with open(file_path, "rb") as f:
-                while True:
-                    chunk = f.read(8192)
-                    if not chunk:
-                        break
-                    compressed = compressor.compress(chunk)
-                    if compressed:
-                        yield compressed
-                yield compressor.flush()
-
-        return StreamingResponse(
-            gzip_stream(),
-            media_type="text/csv",
+        raise HTTPException(status_code=404, detail="Export file not found on disk")
+
+    # Last download time orders quota eviction (app/storage.py)
+    await result_cache.touch(db, export)
+    await db.commit()
+
+    export_format = export.format or "csv"
+    media_type = MEDIA_TYPES[export_format]
+    base_name = f"export_{export_id}{FORMAT_EXTENSIONS[export_format]}"
+    accepted = parse_accept_encoding(request.headers.get("Accept-Encoding", ""))
+
+    # Serve the artifact compressed at export time when the client accepts it
+    if export.compression and CONTENT_ENCODINGS[export.compression] in accepted:
+        if export.compressed_path and os.path.exists(export.compressed_path):
+            encoding = CONTENT_ENCODINGS[export.compression]
+            filename = f"{base_name}{EXTENSIONS[export.compression]}"
+            return count_download("stored", started, conditional_file_response(
+                request,
+                export.compressed_path,
+                etag=make_etag(str(export_uuid), encoding, os.stat(export.compressed_path)),
+                media_type=media_type,
+                headers={
+                    "Content-Encoding": encoding,
+                    "Content-Disposition": f'attachment; filename="{filename}"',
+                    "Vary": "Accept-Encoding",
+                },
+            ), request)
+
+    # Fallback: gzip on the fly (Starlette iterates sync generators in a threadpool).
+    # A generated stream cannot be resumed, so range requests get the plain file.
+    # Parquet/Arrow are compressed internally and always go out as-is.
+    if "gzip" in accepted and "Range" not in request.headers and export_format not in COLUMNAR_FORMATS:
+        key, _ = await reserve_memory(Footprint(COMPRESSOR_BYTES["gzip"], 0, 0))
+        return count_download("gzip", started, StreamingResponse(
+            release_after(iter_compressed(file_path, "gzip", settings.DOWNLOAD_GZIP_LEVEL), key),
+            media_type=media_type,
             headers={
                 "Content-Encoding": "gzip",
-                "Content-Disposition": f'attachment; filename="export_{export_id}.csv.gz"',
+                "Content-Disposition": f'attachment; filename="{base_name}.gz"',
+                "Vary": "Accept-Encoding",
             }
-        )
+        ), request)
+
+    return count_download("file", started, conditional_file_response(
+        request,
+        file_path,
+        etag=make_etag(str(export_uuid), "identity", os.stat(file_path)),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{base_name}"',
+            "Vary": "Accept-Encoding",
+        },
+    ), request)
+
+
+async def _split_export(db: AsyncSession, export_id: str):
+    """The export (or the job it joined) and its manifest, for the split endpoints."""
+    try:
+        export_uuid = UUID(export_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid export ID format")
+
+    # A job running here has the newest manifest in memory
+    export = progress_registry.get(export_uuid)
+    if not export or not export.is_complete:
+        export = await db.get(Export, export_uuid)
+    if not export:
+        raise HTTPException(status_code=404, detail="Export not found")
+    export = await resolve_source(db, export)
+    if export.status in ("cancelled", "expired"):
+        raise HTTPException(status_code=410, detail=f"Export is {export.status}")
+
+    manifest = load_manifest(export.manifest)
+    if manifest is None:
+        if export.status == "completed":
+            raise HTTPException(status_code=404, detail="Export is not split into parts")
+        raise HTTPException(status_code=425, detail="No parts are finished yet")
+    return export_uuid, export, manifest
+
+
+# manifest of a split export; lists parts as they finish
+@router.get("/exports/{export_id}/manifest")
+async def get_manifest(export_id: str, db: AsyncSession = Depends(get_db)):
+    export_uuid, export, manifest = await _split_export(db, export_id)
+    return dict(manifest, exportId=str(export_uuid), status=export.status)
+
+
+# download one part of a split export, as soon as the manifest lists it
+@router.api_route("/exports/{export_id}/parts/{number}", methods=["GET", "HEAD"])
+async def download_part(export_id: str, number: int, request: Request, db: AsyncSession = Depends(get_db)):
+    started = time.perf_counter()
+    export_uuid, export, manifest = await _split_export(db, export_id)
+
+    part = find_part(manifest, number)
+    if part is None:
+        if manifest["complete"]:
+            raise HTTPException(status_code=404, detail="Part not found")
+        raise HTTPException(status_code=425, detail="Part is not finished yet")
+
+    export_dir = os.path.dirname(export.file_path or "")
+    path = os.path.join(export_dir, part["file"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Part file not found on disk")
+
+    if isinstance(export, Export):
+        await result_cache.touch(db, export)
+        await db.commit()
+
+    media_type = PART_MEDIA_TYPES.get(manifest["compression"]) or MEDIA_TYPES[manifest["format"]]
+    return count_download("part", started, conditional_file_response(
+        request,
+        path,
+        etag=make_etag(str(export_uuid), f"part{number}", os.stat(path)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{part["file"]}"'},
+    ), request)
+
+
+# continue a failed, cancelled or orphaned export from its last checkpoint
+@router.post("/exports/{export_id}/resume", status_code=202)
+async def resume_export(export_id: str, db: AsyncSession = Depends(get_db)):
+    logger.info(f"Resume requested for export: {export_id}")
+
+    try:
+        export_uuid = UUID(export_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid export ID format")
+
+    export = await db.get(Export, export_uuid)
+    if not export:
+        raise HTTPException(status_code=404, detail="Export job not found")
+
+    if not export.options or export.source_export_id:
+        raise HTTPException(status_code=409, detail="Export cannot be resumed")
 
-    return FileResponse(
-        path=file_path,
-        filename=f"export_{export_id}.csv",
-        media_type="text/csv"
+    orphaned = export.status == "processing" and (
+        export.lease_expires_at is None or export.lease_expires_at < datetime.now(timezone.utc)
     )
+    if export.status not in ("failed", "cancelled") and not orphaned:
+        raise HTTPException(status_code=409, detail=f"Export is {export.status}")
+
+    progress_registry.discard(export_uuid)
+    await publish(db, [progress_message(export.id, "pending", export.total_rows, export.processed_rows, export.percentage)])
+    await job_queue.resume_job(db, export)
+
+    return {"exportId": str(export_uuid), "status": "pending"}
 
 
 # stop the export job
@@ -168,12 +896,201 @@ async def cancel_export(export_id: str, db: AsyncSession = Depends(get_db)):
     if not export:
         raise HTTPException(status_code=404, detail="Export job not found")
 
-    await cancel_job(export_id)
+    progress_registry.discard(export_uuid)
 
-    if export.file_path and os.path.exists(export.file_path):
-        os.remove(export.file_path)
+    # Attached and cached ids share another export's job and files: only detach
+    if not export.source_export_id:
+        await cancel_job(export_id)
+
+        shared = await db.execute(
+            select(func.count()).select_from(Export).where(
+                Export.source_export_id == export.id,
+                Export.status.notin_(("cancelled", "expired"))
+            )
+        )
+        if not shared.scalar():
+            for path in stored_files(export):
+                if os.path.exists(path):
+                    os.remove(path)
 
     export.status = "cancelled"
+    # Reaches the worker running the job on any node, and /events subscribers
+    messages = [progress_message(
+        export.id, "cancelled", export.total_rows, export.processed_rows, export.percentage,
+        export.total_rows_estimated
+    )]
+    if not export.source_export_id:
+        messages.insert(0, cancel_message(export.id))
+    await publish(db, messages)
     await db.commit()
 
     return Response(status_code=204)
+
+
+def _subscription_body(subscription: ExportSubscription, running=None):
+    return {
+        "name": subscription.name,
+        "watermarkColumn": subscription.watermark_column,
+        "watermark": subscription.watermark,
+        "options": job_queue.decode_options(subscription.options),
+        "lastExportId": str(subscription.last_export_id) if subscription.last_export_id else None,
+        "snapshotExportId": str(subscription.snapshot_export_id) if subscription.snapshot_export_id else None,
+        "runningExportId": str(running.id) if running else None,
+        "createdAt": subscription.created_at.isoformat() if subscription.created_at else None,
+        "updatedAt": subscription.updated_at.isoformat() if subscription.updated_at else None,
+    }
+
+
+def validate_subscription_name(name: str):
+    if not SUBSCRIPTION_NAME.fullmatch(name):
+        raise HTTPException(
+            status_code=400,
+            detail="Subscription name must be 1-100 letters, digits, '.', '_' or '-'"
+        )
+
+
+# define a named delta export: filters and columns, plus the column its watermark tracks
+@router.post("/subscriptions/{name}", status_code=201)
+async def create_subscription(
+    name: str,
+    filters: dict = Depends(filter_params),
+    columns: str = Query(None),
+    delimiter: str = Query(","),
+    quoteChar: str = Query('"'),
+    engine: str = Query("orm"),
+    compression: str = Query(None),
+    compression_level: int = Query(None),
+    export_format: str = Query("csv", alias="format"),
+    watermark_column: str = Query("id", alias="watermark"),
+    db: AsyncSession = Depends(get_db)
+):
+    validate_subscription_name(name)
+    validate_export_options(delimiter, quoteChar, engine, compression, compression_level, export_format)
+    if watermark_column not in subscriptions.WATERMARK_COLUMNS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Watermark must be one of: {', '.join(subscriptions.WATERMARK_COLUMNS)}"
+        )
+    if await db.get(ExportSubscription, name):
+        raise HTTPException(status_code=409, detail="Subscription already exists")
+
+    subscription = ExportSubscription(
+        name=name,
+        watermark_column=watermark_column,
+        created_at=datetime.now(timezone.utc),
+        options=job_queue.encode_options(
+            filters=filters,
+            columns=columns,
+            delimiter=delimiter,
+            quotechar=quoteChar,
+            export_engine=engine,
+            compression=compression,
+            compression_level=compression_level,
+            export_format=export_format
+        )
+    )
+    db.add(subscription)
+    await db.commit()
+    logger.info(f"Subscription {name} created, tracking {watermark_column}")
+    return _subscription_body(subscription)
+
+
+@router.get("/subscriptions/{name}")
+async def get_subscription(name: str, db: AsyncSession = Depends(get_db)):
+    subscription = await db.get(ExportSubscription, name)
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return _subscription_body(subscription, await subscriptions.find_running_delta(db, name))
+
+
+@router.delete("/subscriptions/{name}", status_code=204)
+async def delete_subscription(name: str, db: AsyncSession = Depends(get_db)):
+    subscription = await db.get(ExportSubscription, name)
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    # Exports (and the snapshot) stay downloadable; a running delta fails on completion
+    await db.delete(subscription)
+    await db.commit()
+    return Response(status_code=204)
+
+
+# export only the rows past the subscription's watermark
+@router.post("/subscriptions/{name}/exports", status_code=202)
+async def initiate_delta_export(
+    name: str,
+    response: Response,
+    compact: bool = Query(False),
+    shards: int = Query(1, ge=1),
+    priority: int = Query(0),
+    count: str = Query(None),
+    ttl: int = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db)
+):
+    if count and count not in COUNT_STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Count must be one of: {', '.join(COUNT_STRATEGIES)}"
+        )
+
+    # Row lock: two delta requests for one subscription must not pick the same range
+    subscription = (await db.execute(
+        select(ExportSubscription).where(ExportSubscription.name == name).with_for_update()
+    )).scalars().first()
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+
+    running = await subscriptions.find_running_delta(db, name)
+    if running:
+        raise HTTPException(status_code=409, detail=f"Delta export {running.id} is still {running.status}")
+
+    options = job_queue.decode_options(subscription.options)
+    if compact and options.get("export_format", "csv") not in subscriptions.COMPACT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Compaction needs one of the formats: {', '.join(subscriptions.COMPACT_FORMATS)}"
+        )
+
+    filters = filters_from_options(options)
+    upto = await subscriptions.high_water(
+        db, subscription.watermark_column, build_filters(filters), subscription.watermark
+    )
+    if upto is None:
+        await db.commit()
+        response.status_code = 200
+        return {"subscription": name, "status": "up_to_date", "watermark": subscription.watermark}
+
+    export_id = str(uuid4())
+    delta = {
+        "subscription": name,
+        "column": subscription.watermark_column,
+        "after": subscription.watermark,
+        "upto": upto,
+        "compact": compact,
+    }
+    options.update(shards=shards, count_strategy=count, delta=delta, ttl=ttl, filters=filters)
+    query, _ = build_query(filters, delta=delta)
+    plan, priority = await guard_cost(db, query, *query_plan.filter_shape(filters, delta=delta), priority)
+    db.add(Export(
+        id=UUID(export_id),
+        status="pending",
+        created_at=datetime.now(timezone.utc),
+        processed_rows=0,
+        total_rows=0,
+        percentage=0,
+        format=options.get("export_format") or "csv",
+        priority=priority,
+        subscription=name,
+        filters=encode_filters(filters),
+        options=job_queue.encode_options(**options),
+        **plan_columns(plan)
+    ))
+    await db.commit()
+    logger.info(f"Delta export {export_id} for {name}: {subscription.watermark_column} in ({delta['after']}, {upto}]")
+
+    return {
+        "exportId": export_id,
+        "status": "pending",
+        "subscription": name,
+        "watermarkFrom": delta["after"],
+        "watermarkTo": upto,
+    }
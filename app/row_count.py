@@ -0,0 +1,76 @@
+"""Row totals used for export progress.
+
+`exact` runs COUNT(*) before the export starts (an extra scan of the
+filtered set). `estimate` asks the planner instead: pg_class.reltuples for
+an unfiltered export, otherwise the row estimate of EXPLAIN, which applies
+the per-filter selectivity from the column statistics. `concurrent` starts
+from the estimate and runs the exact count on its own connection while the
+export is already streaming.
+"""
+import json
+import logging
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from app.database import AsyncSessionLocal, ExportSessionLocal
+
+logger = logging.getLogger(__name__)
+
+COUNT_STRATEGIES = ("exact", "concurrent", "estimate")
+
+RELTUPLES_SQL = text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass")
+
+
+async def count_exact(query) -> int:
+    # A full count can scan the whole table: it runs on the export pool
+    async with ExportSessionLocal() as db:
+        result = await db.execute(select(func.count()).select_from(query.subquery()))
+        return result.scalar()
+
+
+def explain_sql(query):
+    """EXPLAIN of `query` as (sql, args), to run with exec_driver_sql.
+
+    Filter values stay $n arguments: Postgres plans the statement with the
+    values it is given, so EXPLAIN still uses their statistics, and no value
+    is ever read as SQL.
+    """
+    compiled = query.compile(dialect=asyncpg.dialect(), compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    return f"EXPLAIN (FORMAT JSON) {compiled}", tuple(params[name] for name in compiled.positiontup or ())
+
+
+async def explain_plan(db, query):
+    """The JSON plan of `query`, EXPLAINed on the session `db`."""
+    sql, args = explain_sql(query)
+    connection = await db.connection()
+    plan = (await connection.exec_driver_sql(sql, args)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan
+
+
+async def estimate_rows(query, filtered: bool = True):
+    """Planner estimate of the rows `query` returns, or None if there is none yet."""
+    async with AsyncSessionLocal() as db:
+        if not filtered:
+            reltuples = (await db.execute(RELTUPLES_SQL)).scalar()
+            # -1 (or 0) until the table has been vacuumed or analyzed
+            if reltuples and reltuples > 0:
+                return int(reltuples)
+        plan = await explain_plan(db, query)
+    rows = plan[0]["Plan"]["Plan Rows"]
+    return int(rows) if rows else None
+
+
+async def initial_total(query, strategy: str, filtered: bool = True):
+    """Return (total_rows, estimated) to start an export with."""
+    if strategy in ("estimate", "concurrent"):
+        try:
+            estimate = await estimate_rows(query, filtered)
+            if estimate is not None:
+                return estimate, True
+        except Exception as e:
+            logger.warning(f"Row estimate failed, counting instead: {e}")
+    return await count_exact(query), False
@@ -0,0 +1,117 @@
+"""CSV encoder compiled per request for the users export columns.
+
+`compile_encoder(export_columns, delimiter, quotechar)` returns a function
+that takes a batch of row tuples (values in export_columns order, extra
+trailing values are ignored) and returns the whole batch as one UTF-8 byte
+chunk. The output is byte-identical to csv.writer / csv.DictWriter with
+QUOTE_MINIMAL, doublequote and the default "\\r\\n" line terminator.
+
+The row expression is generated once from the column list, so the hot loop
+is a single list comprehension with no dict per row and no per-value type
+dispatch: ints and decimals are formatted by their C __format__, datetimes
+go through a small memo, and only text columns (or columns whose characters
+can collide with the dialect) are checked for quoting.
+"""
+
+LINE_TERMINATOR = "\r\n"
+
+# How each users column is formatted, and whether it can be NULL
+COLUMN_KINDS = {
+    "id": ("int", False),
+    "name": ("text", False),
+    "email": ("text", False),
+    "signup_date": ("datetime", True),
+    "country_code": ("text", False),
+    "subscription_tier": ("text", True),
+    "lifetime_value": ("decimal", True),
+}
+
+# Every character str() can produce for the non-text kinds. If the dialect
+# uses one of them, the column falls back to the quoting check.
+KIND_ALPHABETS = {
+    "int": set("-0123456789"),
+    "decimal": set("-+.0123456789EInfinityaNs"),
+    "datetime": set("-+:. 0123456789"),
+}
+
+# Formatted datetimes kept by the memo before it starts over
+DATETIME_CACHE_SIZE = 65536
+
+
+def _make_quote(delimiter: str, quotechar: str):
+    escaped = quotechar * 2
+
+    def quote(value):
+        if value is None:
+            return ""
+        if value.__class__ is not str:
+            value = str(value)
+        if delimiter in value or quotechar in value or "\r" in value or "\n" in value:
+            return quotechar + value.replace(quotechar, escaped) + quotechar
+        return value
+
+    return quote
+
+
+def _make_datetime():
+    cache = {}
+
+    def format_datetime(value):
+        text = cache.get(value)
+        if text is None:
+            if value is None:
+                return ""
+            if len(cache) >= DATETIME_CACHE_SIZE:
+                cache.clear()
+            text = cache[value] = str(value)
+        return text
+
+    return format_datetime
+
+
+def compile_encoder(export_columns, delimiter: str = ",", quotechar: str = '"'):
+    """Build `encode(rows) -> bytes` for this column list and dialect."""
+    specials = {delimiter, quotechar, "\r", "\n"}
+    namespace = {
+        "_quote": _make_quote(delimiter, quotechar),
+        "_datetime": _make_datetime(),
+        "_D": delimiter,
+        "_T": LINE_TERMINATOR,
+        "_E": quotechar * 2,
+    }
+
+    fields = []
+    for i, column in enumerate(export_columns):
+        kind, nullable = COLUMN_KINDS.get(column, ("text", True))
+        value = f"r[{i}]"
+        if kind == "text" or KIND_ALPHABETS[kind] & specials:
+            fields.append(f"_quote({value})")
+        elif kind == "datetime":
+            fields.append(f"_datetime({value})")
+        elif nullable:
+            fields.append(f"('' if {value} is None else {value})")
+        else:
+            fields.append(value)
+
+    line = "{_D}".join("{" + field + "}" for field in fields)
+    if len(fields) == 1:
+        # csv quotes a row made of a single empty field so it is not a blank line
+        line = "{str(" + fields[0] + ") or _E}"
+    source = (
+        "def encode(rows):\n"
+        f"    return ''.join([f\"{line}{{_T}}\" for r in rows]).encode('utf-8')\n"
+    )
+    exec(compile(source, f"<row_encoder {','.join(export_columns)}>", "exec"), namespace)
+    encode = namespace["encode"]
+    encode.source = source
+    return encode
+
+
+def encode_header(export_columns, delimiter: str = ",", quotechar: str = '"') -> bytes:
+    """Header line exactly as csv.writer would write it."""
+    quote = _make_quote(delimiter, quotechar)
+    line = delimiter.join(quote(column) for column in export_columns)
+    if len(export_columns) == 1 and not line:
+        line = quotechar * 2
+    return (line + LINE_TERMINATOR).encode("utf-8")
+
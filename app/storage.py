@@ -0,0 +1,351 @@
+"""Lifecycle of the files in EXPORT_STORAGE_PATH.
+
+Every export that owns files gets an `expires_at`: when it completes, it is
+set from its `ttl` (or EXPORT_TTL). When a job fails, it is set from
+EXPORT_TTL, which bounds how long a resumable partial file is kept. A
+background sweeper runs every STORAGE_SWEEP_INTERVAL seconds. On each pass it:
+
+- expires rows past `expires_at`, in batches claimed with SKIP LOCKED, and
+  deletes their files;
+- scans the directory once and, while the files add up to more than
+  EXPORT_STORAGE_QUOTA bytes, evicts the least recently downloaded completed
+  exports (by `last_accessed_at`, falling back to `completed_at`).
+
+Expiring an export also expires the cache hits that point at it. The
+current snapshot of a delta subscription is never evicted for quota.
+
+At startup, `reconcile` compares one directory scan with one query over the
+live exports. It deletes files that no row accounts for (left behind by
+crashes, cancels or deleted rows) and fixes rows whose files are gone:
+completed exports become `expired`, and failed ones lose their checkpoint so
+a resume starts over.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, func, or_, and_, case
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Export, ExportSubscription
+from app.manifest import load as load_manifest, stored_files
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rows that own files the sweeper may delete
+EXPIRABLE_STATUSES = ("completed", "failed")
+
+# Statuses whose files are still being written or can be resumed
+KEEP_STATUSES = ("pending", "processing", "failed")
+
+# Files the service writes: export_<id>.*, its parts and manifest, snapshot_<id>.*
+FILE_NAME = re.compile(r"^(?:export|snapshot)_([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})")
+
+# Files younger than this may belong to a row created after we looked
+ORPHAN_GRACE_SECONDS = 300
+
+# One quota pass or reconcile at a time across all nodes
+STORAGE_LOCK = 0x6578706f7274
+
+EXPIRED = metrics.Counter("storage_expired_total", "Exports expired by the storage manager", ["reason"])
+BYTES_FREED = metrics.Counter("storage_bytes_freed_total", "Bytes deleted by the storage manager", ["reason"])
+ORPHANS_REMOVED = metrics.Counter("storage_orphans_removed_total", "Files deleted because no export accounts for them")
+SWEEP_SECONDS = metrics.Histogram("storage_sweep_seconds", "Time of one storage sweep")
+_usage = {"bytes": 0}
+metrics.Gauge("storage_used_bytes", "Bytes in EXPORT_STORAGE_PATH at the last scan", collect=lambda: _usage["bytes"])
+
+
+def storage_dir() -> str:
+    return os.getenv("EXPORT_STORAGE_PATH", "exports")
+
+
+def expires_at(ttl: int = None):
+    """Expiry for an export finishing now; None if it should be kept (TTL 0)."""
+    ttl = ttl or settings.EXPORT_TTL
+    if ttl <= 0:
+        return None
+    return datetime.now(timezone.utc) + timedelta(seconds=ttl)
+
+
+def scan(export_dir: str) -> dict:
+    """File name -> (size, mtime) of every file the service wrote. Blocking, run it in a thread."""
+    files = {}
+    try:
+        with os.scandir(export_dir) as entries:
+            for entry in entries:
+                if not FILE_NAME.match(entry.name) or not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                files[entry.name] = (stat.st_size, stat.st_mtime)
+    except FileNotFoundError:
+        pass
+    _usage["bytes"] = sum(size for size, _ in files.values())
+    return files
+
+
+def remove_files(paths) -> int:
+    """Delete `paths`, skipping missing ones; returns the bytes freed. Blocking."""
+    freed = 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove export file {path}: {e}")
+    return freed
+
+
+async def expire(db, export_ids, error: str = None) -> list:
+    """Mark exports and the cache hits pointing at them `expired`; the caller commits.
+
+    Returns the files of the expired exports that own them. Delete those
+    only after the commit, so no download is handed a file that is about to
+    go. Rows that stopped being completed or failed in the meantime (e.g.
+    resumed) are left alone.
+    """
+    if not export_ids:
+        return []
+    export_ids = list(export_ids)
+    values = {"status": "expired", "cache_key": None, "checkpoint": None}
+    if error:
+        values["error"] = error
+    result = await db.execute(
+        update(Export)
+        .where(
+            or_(Export.id.in_(export_ids), Export.source_export_id.in_(export_ids)),
+            Export.status.in_(EXPIRABLE_STATUSES),
+        )
+        .values(**values)
+        .returning(Export.id, Export.source_export_id, Export.file_path, Export.compressed_path, Export.manifest)
+        .execution_options(synchronize_session=False)
+    )
+    paths = []
+    for row in result.all():
+        # Cache hits share their source's files
+        if row.source_export_id is None:
+            paths.extend(stored_files(row))
+    return paths
+
+
+async def expire_due(batch: int = None) -> int:
+    """Expire exports past their `expires_at`, one SKIP LOCKED batch per transaction."""
+    batch = batch or settings.STORAGE_SWEEP_BATCH
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            due = await db.execute(
+                select(Export.id)
+                .where(Export.status.in_(EXPIRABLE_STATUSES), Export.expires_at < func.now())
+                .order_by(Export.expires_at)
+                .limit(batch)
+                .with_for_update(skip_locked=True)
+            )
+            ids = [row[0] for row in due.all()]
+            paths = await expire(db, ids)
+            await db.commit()
+        if ids:
+            BYTES_FREED.inc(await asyncio.to_thread(remove_files, paths), reason="ttl")
+            EXPIRED.inc(len(ids), reason="ttl")
+            total += len(ids)
+        if len(ids) < batch:
+            return total
+
+
+async def _try_lock(db) -> bool:
+    return (await db.execute(select(func.pg_try_advisory_xact_lock(STORAGE_LOCK)))).scalar()
+
+
+def _pinned():
+    """Current snapshots of delta subscriptions: the next compaction builds on them."""
+    return select(ExportSubscription.snapshot_export_id).where(ExportSubscription.snapshot_export_id.is_not(None))
+
+
+async def enforce_quota(files: dict = None) -> int:
+    """Evict least recently downloaded exports until the directory fits EXPORT_STORAGE_QUOTA."""
+    quota = settings.EXPORT_STORAGE_QUOTA
+    if quota <= 0:
+        return 0
+    export_dir = storage_dir()
+    if files is None:
+        files = await asyncio.to_thread(scan, export_dir)
+    excess = sum(size for size, _ in files.values()) - quota
+    if excess <= 0:
+        return 0
+
+    async with AsyncSessionLocal() as db:
+        if not await _try_lock(db):
+            return 0
+        # Oldest first, read lazily: usually only the first few hundred rows are needed
+        result = await db.stream(
+            select(Export.id, Export.file_path, Export.compressed_path, Export.manifest)
+            .where(
+                Export.status == "completed",
+                Export.source_export_id.is_(None),
+                Export.id.notin_(_pinned()),
+            )
+            .order_by(func.coalesce(Export.last_accessed_at, Export.completed_at))
+            .execution_options(yield_per=settings.STORAGE_SWEEP_BATCH)
+        )
+        victims = []
+        freed = 0
+        async for row in result:
+            size = sum(files.get(os.path.basename(path), (0, 0))[0] for path in stored_files(row))
+            if not size:
+                continue
+            victims.append(row.id)
+            freed += size
+            if freed >= excess:
+                break
+        await result.close()
+
+        paths = []
+        for start in range(0, len(victims), settings.STORAGE_SWEEP_BATCH):
+            paths.extend(await expire(db, victims[start:start + settings.STORAGE_SWEEP_BATCH]))
+        await db.commit()
+
+    if victims:
+        BYTES_FREED.inc(await asyncio.to_thread(remove_files, paths), reason="quota")
+        EXPIRED.inc(len(victims), reason="quota")
+        logger.info(f"Storage over quota by {excess} bytes, evicted {len(victims)} exports")
+    return len(victims)
+
+
+def _required_files(row) -> list:
+    """Files a completed export cannot be downloaded without (a compressed copy is optional)."""
+    required = [row.file_path]
+    manifest = load_manifest(row.manifest)
+    if manifest:
+        required.extend(os.path.join(os.path.dirname(row.file_path), part["file"]) for part in manifest["parts"])
+    return required
+
+
+def _present(export_dir: str, files: dict, path: str) -> bool:
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(export_dir) and os.path.basename(path) in files:
+        return True
+    # Not in the scan: written since, or stored outside the directory
+    return os.path.exists(path)
+
+
+async def reconcile() -> dict:
+    """Delete orphan files and fix rows pointing at missing files (run at startup)."""
+    export_dir = storage_dir()
+    async with AsyncSessionLocal() as db:
+        if not await _try_lock(db):
+            return {"skipped": True}
+        # Rows first, then the scan: a file only appears after its row exists.
+        # The cursor's snapshot dates from when it opens; its rows are read
+        # lazily, with manifests only for completed exports (their parts).
+        looked_at = time.time()
+        result = await db.stream(
+            select(
+                Export.id, Export.status, Export.source_export_id, Export.file_path, Export.compressed_path,
+                case((Export.status == "completed", Export.manifest)).label("manifest"),
+                or_(Export.checkpoint.is_not(None), Export.manifest.is_not(None)).label("resumable"),
+            )
+            .where(or_(
+                Export.status.in_(KEEP_STATUSES),
+                and_(Export.status == "completed", Export.file_path.is_not(None)),
+            ))
+            .execution_options(yield_per=settings.STORAGE_SWEEP_BATCH)
+        )
+        files = await asyncio.to_thread(scan, export_dir)
+
+        ids_on_disk = {}
+        for name in files:
+            ids_on_disk.setdefault(FILE_NAME.match(name).group(1), []).append(name)
+
+        kept = set()
+        dangling = []
+        restart = []
+        async for row in result:
+            export_id = str(row.id)
+            if row.status in KEEP_STATUSES:
+                kept.update(ids_on_disk.get(export_id, ()))
+                if row.status == "failed" and row.resumable and export_id not in ids_on_disk:
+                    restart.append(row.id)
+                continue
+            kept.update(os.path.basename(path) for path in stored_files(row))
+            if not all(_present(export_dir, files, path) for path in _required_files(row)):
+                dangling.append(row.id)
+        await result.close()
+
+        orphans = [
+            os.path.join(export_dir, name) for name, (_, mtime) in files.items()
+            if name not in kept and mtime < looked_at - ORPHAN_GRACE_SECONDS
+        ]
+
+        paths = []
+        for start in range(0, len(dangling), settings.STORAGE_SWEEP_BATCH):
+            paths.extend(await expire(
+                db, dangling[start:start + settings.STORAGE_SWEEP_BATCH], error="Export file is missing from storage"
+            ))
+        if restart:
+            # The partial files are gone, so the checkpoint no longer points anywhere
+            await db.execute(
+                update(Export)
+                .where(Export.id.in_(restart), Export.status == "failed")
+                .values(checkpoint=None, manifest=None, file_path=None)
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+
+    removed = await asyncio.to_thread(remove_files, orphans + paths)
+    ORPHANS_REMOVED.inc(len(orphans))
+    BYTES_FREED.inc(removed, reason="reconcile")
+    EXPIRED.inc(len(dangling), reason="missing")
+    summary = {"orphanFiles": len(orphans), "expired": len(dangling), "restarted": len(restart), "bytesFreed": removed}
+    logger.info(f"Storage reconciled: {summary}")
+    return summary
+
+
+class StorageManager:
+    """Reconciles once at startup, then sweeps every `interval` seconds (0 = never)."""
+
+    def __init__(self, interval: float = 300):
+        self.interval = interval
+        self._task = None
+
+    async def sweep(self):
+        started = time.perf_counter()
+        await expire_due()
+        await enforce_quota()
+        SWEEP_SECONDS.observe(time.perf_counter() - started)
+
+    async def _run(self):
+        try:
+            await reconcile()
+        except Exception as e:
+            logger.warning(f"Storage reconcile failed: {e}")
+        while self.interval > 0:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Storage sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+storage_manager = StorageManager(settings.STORAGE_SWEEP_INTERVAL)
@@ -0,0 +1,190 @@
+"""Delta exports for named subscriptions.
+
+A subscription stores a filter + column set (as export options) and a
+watermark: the highest `id` or `signup_date` already exported. A delta export
+covers `watermark < column <= upto`, where `upto` is the current maximum when
+the delta is requested, so retries and resumes of the same delta always see
+the same range. Both bounds travel with the job as its `delta` option.
+
+The watermark only moves when the delta completes, in the same transaction
+that marks the export completed, and only if it still equals the delta's
+lower bound. A failed delta can be resumed or simply requested again.
+
+Rows are picked up by the watermark column alone: rows that later get an
+older value (a backdated signup_date, or an id from a transaction that
+committed after the maximum was read) are not exported by a later delta.
+
+With `compact`, a delta also rebuilds the subscription's snapshot: the
+previous snapshot file plus the new rows, stored as its own completed export.
+"""
+import asyncio
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from uuid import UUID, uuid4
+
+from sqlalchemy import select, update, func, and_
+
+from app.database import AsyncSessionLocal
+from app.models import Export, ExportSubscription, User
+
+logger = logging.getLogger(__name__)
+
+# Columns a subscription can track; both are range-scannable through an index
+WATERMARK_COLUMNS = ("id", "signup_date")
+
+# Formats whose files can be concatenated (CSV after dropping the header line)
+COMPACT_FORMATS = ("csv", "ndjson")
+
+
+class DeltaConflict(Exception):
+    """The delta cannot be committed: its export stopped or the watermark moved."""
+
+
+def parse_watermark(column: str, raw):
+    if raw is None:
+        return None
+    if column == "id":
+        return int(raw)
+    return datetime.fromisoformat(raw)
+
+
+def format_watermark(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def watermark_bounds(delta: dict):
+    """(column, after, upto) with parsed values, for build_copy_sql."""
+    column = delta["column"]
+    return column, parse_watermark(column, delta["after"]), parse_watermark(column, delta["upto"])
+
+
+def watermark_filters(delta: dict):
+    column, after, upto = watermark_bounds(delta)
+    attr = getattr(User, column)
+    filters = [attr <= upto]
+    if after is not None:
+        filters.insert(0, attr > after)
+    return filters
+
+
+async def high_water(db, column: str, filters, after=None):
+    """Current maximum of `column` among the filtered rows past `after`."""
+    attr = getattr(User, column)
+    conditions = list(filters)
+    if after is not None:
+        conditions.append(attr > parse_watermark(column, after))
+    query = select(func.max(attr))
+    if conditions:
+        query = query.where(and_(*conditions))
+    return format_watermark((await db.execute(query)).scalar())
+
+
+async def find_running_delta(db, name: str):
+    result = await db.execute(
+        select(Export)
+        .where(Export.subscription == name, Export.status.in_(("pending", "processing")))
+        .order_by(Export.created_at)
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+def _append_rows(previous_path, delta_path, out_path, skip_header):
+    """Write the previous snapshot followed by the delta's rows (runs in a thread)."""
+    with open(out_path, "wb") as out:
+        if previous_path:
+            with open(previous_path, "rb") as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+        with open(delta_path, "rb") as f:
+            if previous_path and skip_header:
+                f.readline()
+            shutil.copyfileobj(f, out, 1024 * 1024)
+
+
+async def build_snapshot(delta: dict, delta_path: str, export_format: str, total_rows: int):
+    """Write the next compacted snapshot; returns its (unsaved) Export row."""
+    async with AsyncSessionLocal() as db:
+        subscription = await db.get(ExportSubscription, delta["subscription"])
+        previous = None
+        if subscription and subscription.snapshot_export_id:
+            previous = await db.get(Export, subscription.snapshot_export_id)
+    previous_path = previous.file_path if previous and previous.status == "completed" else None
+    if previous_path and not os.path.exists(previous_path):
+        raise RuntimeError(f"Snapshot file of subscription {delta['subscription']} is missing")
+
+    snapshot_id = uuid4()
+    out_path = os.path.join(os.path.dirname(delta_path), f"snapshot_{snapshot_id}{os.path.splitext(delta_path)[1]}")
+    await asyncio.to_thread(_append_rows, previous_path, delta_path, out_path, export_format == "csv")
+
+    now = datetime.now(timezone.utc)
+    rows = total_rows + ((previous.total_rows or 0) if previous_path else 0)
+    return Export(
+        id=snapshot_id,
+        status="completed",
+        created_at=now,
+        completed_at=now,
+        total_rows=rows,
+        processed_rows=rows,
+        percentage=100,
+        file_path=out_path,
+        file_size=os.path.getsize(out_path),
+        format=export_format,
+        subscription=delta["subscription"],
+    )
+
+
+async def complete_delta(export_id: str, delta: dict, artifact: dict, snapshot: Export = None):
+    """Mark a delta export completed and advance its watermark in one transaction.
+
+    Raises DeltaConflict, writing nothing, if the export is no longer running
+    (e.g. it was cancelled) or the watermark is not the delta's lower bound.
+    A replaced snapshot becomes `expired` and its file is removed.
+    """
+    now = datetime.now(timezone.utc)
+    replaced = None
+    async with AsyncSessionLocal() as db:
+        subscription = (await db.execute(
+            select(ExportSubscription)
+            .where(ExportSubscription.name == delta["subscription"])
+            .with_for_update()
+        )).scalars().first()
+        if subscription is None:
+            raise DeltaConflict(f"Subscription {delta['subscription']} no longer exists")
+        if subscription.watermark != delta["after"]:
+            raise DeltaConflict(
+                f"Watermark of subscription {delta['subscription']} moved past {delta['after']}; request a new delta"
+            )
+
+        result = await db.execute(
+            update(Export)
+            .where(Export.id == UUID(export_id), Export.status.in_(("pending", "processing")))
+            .values(status="completed", completed_at=now, percentage=100, **artifact)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            await db.rollback()
+            raise DeltaConflict("Export is no longer running")
+
+        subscription.watermark = delta["upto"]
+        subscription.last_export_id = UUID(export_id)
+        subscription.updated_at = now
+        if snapshot is not None:
+            if subscription.snapshot_export_id:
+                replaced = await db.get(Export, subscription.snapshot_export_id)
+                if replaced is not None:
+                    replaced.status = "expired"
+            db.add(snapshot)
+            subscription.snapshot_export_id = snapshot.id
+        await db.commit()
+
+    if replaced is not None and replaced.file_path and os.path.exists(replaced.file_path):
+        try:
+            os.remove(replaced.file_path)
+        except OSError as e:
+            logger.warning(f"Could not remove old snapshot {replaced.file_path}: {e}")
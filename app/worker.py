@@ -0,0 +1,207 @@
+"""Standalone export worker: `python -m app.worker`.
+
+Claims jobs from the exports table with SELECT ... FOR UPDATE SKIP LOCKED,
+runs them through process_export and keeps their leases alive with a
+heartbeat. SIGTERM/SIGINT stop claiming new work and drain running jobs;
+whatever is still running after WORKER_DRAIN_TIMEOUT goes back to the queue.
+Claims are also capped by the free memory budget (app/governor.py).
+Cancels arrive over LISTEN/NOTIFY (app/notifications.py); a lost lease seen
+by the heartbeat stops the job too, which bounds cancel latency if the
+listener is down. Workers also run the storage sweeper (app/storage.py).
+Members of a batch (app/batch.py) are claimed together and share one scan,
+which takes a single concurrency slot.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+from uuid import uuid4
+
+from app.config import settings
+from app import job_queue
+from app.export_service import (
+    process_export, active_tasks, cancel_job, sync_cancellations, max_export_shards, ALL_COLUMNS,
+)
+from app.batch import process_batch, shareable
+from app.governor import governor, job_footprint
+from app.progress import progress_registry
+from app.notifications import notification_listener
+from app.storage import storage_manager
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    def __init__(self, concurrency: int = None, poll_interval: float = None, worker_id: str = None):
+        self.concurrency = concurrency or settings.WORKER_CONCURRENCY
+        # Shards per job that keep `concurrency` jobs within the export pool
+        self.max_shards = max_export_shards(self.concurrency)
+        self.poll_interval = poll_interval or settings.WORKER_POLL_INTERVAL
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self.running = {}
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    def stop(self):
+        logger.info(f"Worker {self.worker_id} draining {len(self.running)} running jobs")
+        self._stopping.set()
+        self._wakeup.set()
+
+    @property
+    def busy(self) -> int:
+        """Slots in use: the members of a batch share one task."""
+        return len(set(self.running.values()))
+
+    def _start(self, jobs, coro):
+        """Run `coro` for the claimed `jobs`, as (export_id, created_at)."""
+        task = asyncio.create_task(coro)
+        for export_id, created_at in jobs:
+            logger.info(f"Worker {self.worker_id} claimed export {export_id}")
+            progress_registry.track(export_id, "processing", created_at)
+            task.add_done_callback(lambda t, eid=export_id: self._on_job_done(eid, t))
+            self.running[export_id] = task
+
+    def _start_export(self, export_id, options, created_at):
+        export_id = str(export_id)
+        options = job_queue.decode_options(options)
+        options["shards"] = min(options.get("shards") or 1, self.max_shards)
+        self._start([(export_id, created_at)], process_export(export_id, **options))
+
+    def _on_job_done(self, export_id, task):
+        self.running.pop(export_id, None)
+        self._wakeup.set()
+        if not task.cancelled() and task.exception():
+            logger.error(f"Job {export_id} crashed: {task.exception()}")
+
+    async def _claim(self):
+        free = self.concurrency - self.busy
+        # Leave jobs the memory budget cannot take yet in the queue, where any node sees their position
+        free = min(free, governor.admittable(job_footprint(len(ALL_COLUMNS)).minimum))
+        claimed = await job_queue.claim_jobs(self.worker_id, free)
+        batches = {}
+        for export_id, options, created_at, batch_id in claimed:
+            if batch_id is not None and shareable(job_queue.decode_options(options)):
+                batches.setdefault(batch_id, []).append((export_id, options, created_at, batch_id))
+            else:
+                self._start_export(export_id, options, created_at)
+        for batch_id, members in batches.items():
+            # The rest of the batch rides along on the same scan
+            for member in await job_queue.claim_batch(self.worker_id, batch_id):
+                if shareable(job_queue.decode_options(member[1])):
+                    members.append(member)
+                else:
+                    self._start_export(*member[:3])
+            if len(members) == 1:
+                # Resumed on its own, or the others are done or held elsewhere
+                self._start_export(*members[0][:3])
+                continue
+            jobs = [(str(export_id), created_at) for export_id, _, created_at, _ in members]
+            self._start(jobs, process_batch(batch_id, [
+                (str(export_id), job_queue.decode_options(options)) for export_id, options, _, _ in members
+            ]))
+        return len(claimed)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_INTERVAL)
+            try:
+                held = set(self.running)
+                owned = {str(export_id) for export_id in await job_queue.heartbeat(self.worker_id, held)}
+                # Lost the lease (cancelled elsewhere or reclaimed): stop the job
+                for export_id in held - owned:
+                    if export_id in self.running and export_id in active_tasks:
+                        logger.info(f"Worker {self.worker_id} lost export {export_id}, stopping it")
+                        await cancel_job(export_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {e}")
+
+    async def run(self):
+        logger.info(f"Worker {self.worker_id} started with concurrency {self.concurrency}")
+        if settings.EXPORT_POOL_SIZE < 2 * self.concurrency:
+            logger.warning(
+                f"EXPORT_POOL_SIZE={settings.EXPORT_POOL_SIZE} cannot give {self.concurrency} jobs a cursor "
+                "and a count each; jobs will wait for connections"
+            )
+        progress_registry.start()
+        metrics.loop_lag_monitor.start()
+        # Cancels from any node arrive here; the heartbeat is the fallback
+        notification_listener.start(on_cancel=cancel_job, on_reconnect=sync_cancellations)
+        storage_manager.start()
+        try:
+            requeued = await job_queue.requeue_orphans()
+            if requeued:
+                logger.info(f"Requeued {len(requeued)} orphaned exports for resumption")
+        except Exception as e:
+            logger.warning(f"Orphan requeue failed: {e}")
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        unfinished = []
+        try:
+            while not self._stopping.is_set():
+                self._wakeup.clear()
+                try:
+                    await job_queue.fail_exhausted_jobs()
+                    claimed = await self._claim()
+                except Exception as e:
+                    logger.warning(f"Claim failed: {e}")
+                    claimed = 0
+
+                # Poll again right away while there is work and capacity
+                if claimed and self.busy < self.concurrency:
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            unfinished = await self._drain()
+        finally:
+            heartbeat_task.cancel()
+            # Flush progress before handing jobs back so it cannot overwrite "pending"
+            await progress_registry.stop()
+            await metrics.loop_lag_monitor.stop()
+            await notification_listener.stop()
+            await storage_manager.stop()
+            await job_queue.release_jobs(self.worker_id, unfinished + list(self.running))
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    async def _drain(self):
+        """Wait for running jobs; cancel the ones still going after the timeout."""
+        if not self.running:
+            return []
+        tasks = dict(self.running)
+        _, pending = await asyncio.wait(list(tasks.values()), timeout=settings.WORKER_DRAIN_TIMEOUT)
+        unfinished = [export_id for export_id, task in tasks.items() if task in pending]
+        if pending:
+            logger.warning(f"Drain timeout, returning {len(unfinished)} jobs to the queue")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return unfinished
+
+
+async def main(concurrency: int = None, poll_interval: float = None, metrics_port: int = None):
+    worker = Worker(concurrency=concurrency, poll_interval=poll_interval)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    metrics_port = settings.WORKER_METRICS_PORT if metrics_port is None else metrics_port
+    server = await metrics.serve(metrics_port) if metrics_port else None
+    try:
+        await worker.run()
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run export jobs from the exports table queue")
+    parser.add_argument("--concurrency", type=int, default=None, help="Jobs run at once (WORKER_CONCURRENCY)")
+    parser.add_argument("--poll-interval", type=float, default=None, help="Seconds between idle polls (WORKER_POLL_INTERVAL)")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve GET /metrics on this port (WORKER_METRICS_PORT)")
+    args = parser.parse_args()
+    asyncio.run(main(concurrency=args.concurrency, poll_interval=args.poll_interval, metrics_port=args.metrics_port))
@@ -0,0 +1,12 @@
+"""Benchmarks for the export pipeline.
+
+    python -m benchmarks seed --rows 1m
+    python -m benchmarks run --rows 1m --output results/1m.json
+    python -m benchmarks compare results/baseline.json results/1m.json
+
+`seed` fills the users table of the configured database (DB_* settings)
+with the seeds/02_generate_data.sql generator. `run` executes the fixed
+scenarios in-process against that database and writes JSON results;
+`compare` flags regressions between two result files. See
+benchmarks/scenarios.py for what each scenario does.
+"""
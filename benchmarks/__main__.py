@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _settings_snapshot():
+    from app.config import settings
+
+    names = [
+        "EXPORT_BATCH_ROWS", "STREAM_BATCH_ROWS", "EXPORT_WRITE_BUFFER", "EXPORT_WRITE_QUEUE_DEPTH",
+        "EXPORT_FSYNC", "EXPORT_CHECKPOINT_ROWS", "EXPORT_COUNT_STRATEGY", "MAX_EXPORT_SHARDS",
+        "EXPORT_MEMORY_BUDGET", "EXPORT_POOL_SIZE",
+    ]
+    return {name: getattr(settings, name) for name in names}
+
+
+def _quiet_engine():
+    from app.database import ENGINES
+
+    # Statement logging (DB_ECHO) would dominate the timings
+    for engine in ENGINES:
+        engine.sync_engine.echo = False
+
+
+async def _dispose_engines():
+    from app.database import ENGINES
+
+    for engine in ENGINES:
+        await engine.dispose()
+
+
+async def cmd_seed(args):
+    from benchmarks.seed import parse_rows, seed
+
+    _quiet_engine()
+    try:
+        result = await seed(parse_rows(args.rows), force=args.force)
+    finally:
+        await _dispose_engines()
+    print(json.dumps(result))
+
+
+async def cmd_run(args):
+    from app.progress import progress_registry
+    from benchmarks.scenarios import SCENARIOS, run_scenarios
+    from benchmarks.seed import current_rows, parse_rows, seed
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()] if args.scenarios else list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    _quiet_engine()
+    rows = parse_rows(args.rows)
+    try:
+        if args.seed:
+            await seed(rows)
+        table_rows = await current_rows()
+        if table_rows != rows:
+            sys.exit(f"users holds {table_rows} rows, expected {rows}; run `python -m benchmarks seed --rows {args.rows}` or pass --seed")
+
+        progress_registry.start()
+        started_at = datetime.now(timezone.utc)
+        results = await run_scenarios(
+            names, table_rows, engine=args.engine, jobs=args.jobs, repeat=args.repeat,
+            work_dir=args.work_dir, keep_files=args.keep_files,
+        )
+        await progress_registry.stop()
+    finally:
+        await _dispose_engines()
+
+    report = {
+        "meta": {
+            "started_at": started_at.isoformat(),
+            "commit": _git_commit(),
+            "host": socket.gethostname(),
+            "python": platform.python_version(),
+            "rows": rows,
+            "engine": args.engine,
+            "jobs": args.jobs,
+            "repeat": args.repeat,
+            "settings": _settings_snapshot(),
+        },
+        "scenarios": results,
+    }
+    encoded = json.dumps(report, indent=2, default=str)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(encoded + "\n")
+        for name, metrics in results.items():
+            print(f"{name:<15} {metrics['status']:<10} {metrics['elapsed_s']:>9}s {metrics['rows_per_s'] or 0:>12,.0f} rows/s "
+                  f"ttfb {metrics['ttfb_s']}s  rss {metrics['peak_rss_mb']} MB  lag p99 {metrics['loop_lag_p99_ms']} ms")
+    else:
+        print(encoded)
+
+
+def cmd_compare(args):
+    from benchmarks.compare import compare, format_report, load
+
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline["meta"].get("rows") != current["meta"].get("rows"):
+        print("warning: the runs used different row counts", file=sys.stderr)
+    rows = compare(baseline, current, threshold=args.threshold)
+    print(format_report(rows))
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Export pipeline benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = sub.add_parser("seed", help="Fill the users table with N generated rows (replaces its contents)")
+    seed_parser.add_argument("--rows", default="100k", help="Row count, e.g. 100k, 1m, 10m")
+    seed_parser.add_argument("--force", action="store_true", help="Reseed even if the row count already matches")
+
+    run_parser = sub.add_parser("run", help="Run the scenarios and write JSON results")
+    run_parser.add_argument("--rows", default="100k", help="Expected users row count, e.g. 100k, 1m, 10m")
+    run_parser.add_argument("--seed", action="store_true", help="Seed the users table first if the count differs")
+    run_parser.add_argument("--scenarios", default=None, help="Comma separated subset (default: all)")
+    run_parser.add_argument("--engine", default="orm", choices=("orm", "copy"))
+    run_parser.add_argument("--jobs", type=int, default=4, help="Exports run at once by the `concurrent` scenario")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario; the median is reported")
+    run_parser.add_argument("--output", default=None, help="Write JSON here instead of stdout")
+    run_parser.add_argument("--work-dir", default="benchmark_exports", help="Scratch directory for export files")
+    run_parser.add_argument("--keep-files", action="store_true")
+
+    compare_parser = sub.add_parser("compare", help="Flag regressions between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "seed":
+        asyncio.run(cmd_seed(args))
+    elif args.command == "run":
+        asyncio.run(cmd_run(args))
+    else:
+        cmd_compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Minimal in-process ASGI client for timing the download paths.
+
+Drives the FastAPI app directly, so the numbers cover the route, the
+response class and the DB/file work without a socket or an HTTP client
+dependency in between.
+"""
+import asyncio
+import time
+from urllib.parse import urlencode
+
+
+async def timed_get(app, path: str, params: dict = None, headers: dict = None) -> dict:
+    """GET `path` and return status, time to first body byte, body size and total time."""
+    query = urlencode({k: v for k, v in (params or {}).items() if v is not None})
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+        "extensions": {},
+    }
+
+    request_sent = False
+    disconnected = asyncio.Event()
+    result = {"status": None, "ttfb_s": None, "bytes": 0, "headers": {}}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Nothing else to send; block like an idle client would
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    started = time.perf_counter()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+            result["headers"] = {k.decode("latin-1"): v.decode("latin-1") for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            if body and result["ttfb_s"] is None:
+                result["ttfb_s"] = time.perf_counter() - started
+            result["bytes"] += len(body)
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    result["elapsed_s"] = time.perf_counter() - started
+    return result
@@ -0,0 +1,72 @@
+"""Compare two benchmark result files and flag regressions."""
+import json
+
+# metric -> True if higher is better
+METRICS = {
+    "rows_per_s": True,
+    "bytes_per_s": True,
+    "elapsed_s": False,
+    "ttfb_s": False,
+    "peak_rss_mb": False,
+    "loop_lag_p99_ms": False,
+    "db_round_trips": False,
+}
+
+# Absolute changes below these are noise, whatever the relative change
+NOISE_FLOORS = {
+    "elapsed_s": 0.05,
+    "ttfb_s": 0.05,
+    "loop_lag_p99_ms": 5.0,
+    "db_round_trips": 2,
+}
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10) -> list:
+    """Return one row per (scenario, metric) present in both runs.
+
+    A change counts as a regression when the metric got worse by more than
+    `threshold` (relative), or when a scenario newly exceeds the RSS limit
+    or stops completing.
+    """
+    rows = []
+    for name, after in current.get("scenarios", {}).items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            rows.append({
+                "scenario": name,
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change": round(change, 4),
+                "regression": worse > threshold and abs(new - old) > NOISE_FLOORS.get(metric, 0),
+            })
+        if after.get("rss_over_limit") and not before.get("rss_over_limit"):
+            rows.append({"scenario": name, "metric": "rss_over_limit", "baseline": False, "current": True,
+                         "change": None, "regression": True})
+        if after.get("status") != "completed" and before.get("status") == "completed":
+            rows.append({"scenario": name, "metric": "status", "baseline": before.get("status"),
+                         "current": after.get("status"), "change": None, "regression": True})
+    return rows
+
+
+def format_report(rows) -> str:
+    lines = [f"{'scenario':<15} {'metric':<16} {'baseline':>14} {'current':>14} {'change':>9}"]
+    for row in rows:
+        change = "" if row["change"] is None else f"{row['change'] * 100:+.1f}%"
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(
+            f"{row['scenario']:<15} {row['metric']:<16} {str(row['baseline']):>14} {str(row['current']):>14} {change:>9}{flag}"
+        )
+    return "\n".join(lines)
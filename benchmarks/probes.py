@@ -0,0 +1,111 @@
+"""Measurements taken while a scenario runs."""
+import asyncio
+import glob
+import os
+import time
+
+from sqlalchemy import event
+
+from app.database import ENGINES
+
+# The service has to stay under this resident size (see README)
+RSS_LIMIT_BYTES = 150 * 1024 * 1024
+
+
+def read_rss() -> int:
+    """Current resident set size in bytes (Linux /proc, else the peak from getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        # Part files disappear once they are stitched
+        return 0
+
+
+class Sampler:
+    """Background task sampling RSS, event-loop lag and export file growth.
+
+    Loop lag is how late each `interval` sleep wakes up. `watch` is a glob of
+    export files; the first time any of them has bytes is the job's time to
+    first byte.
+    """
+
+    def __init__(self, interval: float = 0.01, watch: str = None):
+        self.interval = interval
+        self.watch = watch
+        self.peak_rss = 0
+        self.lags = []
+        self.first_byte_at = None
+        self.started = None
+        self._task = None
+
+    async def __aenter__(self):
+        self.started = time.perf_counter()
+        self.peak_rss = read_rss()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._sample()
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, read_rss())
+        if self.watch and self.first_byte_at is None:
+            if any(_size(path) > 0 for path in glob.glob(self.watch)):
+                self.first_byte_at = time.perf_counter()
+
+    async def _run(self):
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - before - self.interval))
+            self._sample()
+
+    def ttfb(self):
+        if self.first_byte_at is None:
+            return None
+        return self.first_byte_at - self.started
+
+    def lag_stats(self) -> dict:
+        if not self.lags:
+            return {"loop_lag_max_ms": 0.0, "loop_lag_p99_ms": 0.0}
+        lags = sorted(self.lags)
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+        return {"loop_lag_max_ms": round(lags[-1] * 1000, 2), "loop_lag_p99_ms": round(p99 * 1000, 2)}
+
+
+class RoundTripCounter:
+    """Counts statements sent through the SQLAlchemy engines (control and export pools).
+
+    Raw asyncpg calls (the COPY engine's copy_from_query) bypass the engine
+    events and are not counted.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in ENGINES:
+            event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for engine in ENGINES:
+            event.remove(engine.sync_engine, "before_cursor_execute", self._on_execute)
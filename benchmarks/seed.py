@@ -0,0 +1,57 @@
+"""Seed the users table with a fixed number of generated rows."""
+import os
+import re
+import time
+
+from sqlalchemy import text
+
+from app.database import engine, Base
+
+SEED_SQL_PATH = os.path.join(os.path.dirname(__file__), "..", "seeds", "02_generate_data.sql")
+
+ROW_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_rows(value: str) -> int:
+    """Accept 100000, 100k or 10m."""
+    value = value.strip().lower().replace("_", "")
+    if value and value[-1] in ROW_SUFFIXES:
+        return int(float(value[:-1]) * ROW_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def generate_sql(rows: int) -> str:
+    """seeds/02_generate_data.sql with the generate_series bound set to `rows`."""
+    with open(SEED_SQL_PATH) as f:
+        sql = f.read()
+    sql, replaced = re.subn(r"generate_series\(1,\s*\d+\)", f"generate_series(1, {int(rows)})", sql)
+    if replaced != 1:
+        raise RuntimeError(f"Could not find the generate_series call in {SEED_SQL_PATH}")
+    return sql
+
+
+async def current_rows() -> int:
+    async with engine.connect() as conn:
+        return (await conn.execute(text("SELECT count(*) FROM users"))).scalar()
+
+
+async def seed(rows: int, force: bool = False) -> dict:
+    """Replace the users table contents with `rows` generated users.
+
+    Skipped when the table already holds exactly `rows` rows, unless `force`.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    existing = await current_rows()
+    if existing == rows and not force:
+        return {"rows": rows, "seeded": False, "seconds": 0.0}
+
+    started = time.perf_counter()
+    async with engine.begin() as conn:
+        await conn.execute(text("TRUNCATE users RESTART IDENTITY"))
+        await conn.execute(text(generate_sql(rows)))
+    # Fresh statistics so row estimates and plans match the new data
+    async with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+        await conn.execute(text("VACUUM ANALYZE users"))
+    return {"rows": rows, "seeded": True, "seconds": round(time.perf_counter() - started, 3)}
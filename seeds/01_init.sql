@@ -13,6 +13,17 @@ CREATE TABLE users (
 CREATE INDEX idx_users_country_code ON users(country_code);
 CREATE INDEX idx_users_subscription_tier ON users(subscription_tier);
 CREATE INDEX idx_users_lifetime_value ON users(lifetime_value);
+-- Range scans past a subscription watermark (id uses the primary key)
+CREATE INDEX idx_users_signup_date ON users(signup_date);
+-- Filter pushdown (see app/filters.py): IN-lists on the equality columns followed by
+-- a lifetime_value range, and signup_date windows within a country
+CREATE INDEX idx_users_country_tier_ltv ON users(country_code, subscription_tier, lifetime_value);
+CREATE INDEX idx_users_country_signup_date ON users(country_code, signup_date);
+-- Live signups arrive in signup_date order, so this tiny BRIN index maps wide windows to
+-- a few block ranges (the random dates of 02_generate_data.sql leave it to idx_users_signup_date)
+CREATE INDEX idx_users_signup_date_brin ON users USING brin(signup_date) WITH (pages_per_range = 32);
+-- email_domain prefixes: LIKE 'acme%' on the domain part of the address
+CREATE INDEX idx_users_email_domain ON users((lower(split_part(email, '@', 2))) text_pattern_ops);
 
 -- Create exports table
 CREATE TABLE exports (
@@ -21,10 +32,76 @@ CREATE TABLE exports (
     total_rows INTEGER DEFAULT 0,
     processed_rows INTEGER DEFAULT 0,
     percentage INTEGER DEFAULT 0,
+    total_rows_estimated BOOLEAN DEFAULT FALSE,
     error TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
     completed_at TIMESTAMP WITH TIME ZONE,
     file_path TEXT,
+    format VARCHAR(10) DEFAULT 'csv',
+    file_size BIGINT,
+    compression VARCHAR(10),
+    compressed_path TEXT,
+    compressed_size BIGINT,
+    compression_ratio DOUBLE PRECISION,
+    cache_key VARCHAR(64),
+    source_export_id UUID,
+    last_accessed_at TIMESTAMP WITH TIME ZONE,
+    expires_at TIMESTAMP WITH TIME ZONE,
+    options TEXT,
+    priority INTEGER DEFAULT 0,
+    worker_id TEXT,
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    attempts INTEGER DEFAULT 0,
+    checkpoint TEXT,
+    metrics TEXT,
+    manifest TEXT,
+    plan_rows BIGINT,
+    plan_cost DOUBLE PRECISION,
+    plan TEXT,
+    subscription VARCHAR(100),
+    batch_id UUID,
     filters TEXT,
     columns TEXT
 );
+
+CREATE INDEX ix_exports_cache_key ON exports(cache_key);
+CREATE INDEX ix_exports_source_export_id ON exports(source_export_id);
+CREATE INDEX ix_exports_subscription ON exports(subscription);
+CREATE INDEX ix_exports_batch_id ON exports(batch_id);
+-- Queue polling only looks at runnable jobs
+CREATE INDEX ix_exports_queue ON exports(priority DESC, created_at) WHERE status IN ('pending', 'processing');
+-- Storage sweeper: exports past their TTL, and quota eviction in least recently used order
+CREATE INDEX ix_exports_expires_at ON exports(expires_at) WHERE status IN ('completed', 'failed');
+CREATE INDEX ix_exports_last_used ON exports((COALESCE(last_accessed_at, completed_at)))
+    WHERE status = 'completed' AND source_export_id IS NULL;
+-- Result cache upkeep: only artifacts that still have a cache key
+CREATE INDEX ix_exports_cached ON exports(completed_at)
+    WHERE cache_key IS NOT NULL AND status = 'completed' AND source_export_id IS NULL;
+
+-- Named delta export subscriptions (see app/subscriptions.py)
+CREATE TABLE export_subscriptions (
+    name VARCHAR(100) PRIMARY KEY,
+    watermark_column VARCHAR NOT NULL DEFAULT 'id',
+    watermark TEXT,
+    options TEXT NOT NULL,
+    last_export_id UUID,
+    snapshot_export_id UUID,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE
+);
+
+-- EXPLAIN estimates and run times of export jobs per filter shape (see app/query_plan.py)
+CREATE TABLE export_plan_stats (
+    shape VARCHAR(100) PRIMARY KEY,
+    jobs INTEGER DEFAULT 0,
+    full_scans INTEGER DEFAULT 0,
+    planned_rows BIGINT DEFAULT 0,
+    total_cost DOUBLE PRECISION DEFAULT 0,
+    filter_values TEXT,
+    finished INTEGER DEFAULT 0,
+    rows BIGINT DEFAULT 0,
+    seconds DOUBLE PRECISION DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE
+);
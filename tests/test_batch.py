@@ -0,0 +1,112 @@
+"""Batch exports: which specs share a scan, and a shared scan against single exports."""
+import gzip
+import os
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from conftest import run, run_export
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+from app import batch  # noqa: E402
+
+
+def test_shareable():
+    assert batch.shareable({})
+    assert batch.shareable({"export_format": "ndjson", "shards": 1})
+    assert not batch.shareable({"export_format": "arrow"})
+    assert not batch.shareable({"export_engine": "copy"})
+    assert not batch.shareable({"shards": 2})
+    assert not batch.shareable({"split": {"rows": 10}})
+    assert not batch.shareable({"sample": {"percent": 5, "seed": 1}})
+
+
+def test_shared_columns_keep_table_order():
+    assert batch.shared_columns([["email", "id"], ["country_code", "id"]]) == ["id", "email", "country_code"]
+
+
+async def _run_batch(specs):
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+
+    batch_id = uuid4()
+    jobs = [(uuid4(), options) for options in specs]
+    async with AsyncSessionLocal() as db:
+        for export_id, _ in jobs:
+            db.add(Export(id=export_id, status="pending", batch_id=batch_id, created_at=datetime.now(timezone.utc)))
+        await db.commit()
+    try:
+        await batch.process_batch(batch_id, jobs)
+        async with AsyncSessionLocal() as db:
+            return [await db.get(Export, export_id) for export_id, _ in jobs]
+    finally:
+        async with AsyncSessionLocal() as db:
+            for export_id, _ in jobs:
+                await db.delete(await db.get(Export, export_id))
+            await db.commit()
+
+
+def _read(export):
+    with open(export.file_path, "rb") as f:
+        data = f.read()
+    os.remove(export.file_path)
+    return data
+
+
+def test_shared_scan_matches_single_exports(database, tmp_path, monkeypatch):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+    specs = [
+        {"filters": {"country_code": ["DE"]}, "columns": "id,email", "compression": "gzip"},
+        {"filters": {"country_code": ["FR", "US"], "min_ltv": "100.00"}, "columns": "id,country_code",
+         "delimiter": ";"},
+        {"filters": {"subscription_tier": ["premium"]}, "columns": "id,lifetime_value", "export_format": "ndjson"},
+    ]
+
+    members = run(_run_batch(specs))
+    singles = [run(run_export(**options)) for options in specs]
+
+    for member, single in zip(members, singles):
+        assert member.status == "completed", member.error
+        assert member.total_rows == single.total_rows and not member.total_rows_estimated
+        plain = _read(member)
+        assert plain == _read(single)
+        if member.compressed_path:
+            # Compressed while the scan wrote the file
+            with open(member.compressed_path, "rb") as f:
+                assert gzip.decompress(f.read()) == plain
+
+
+async def _claim_batch(worker_id):
+    from sqlalchemy import delete
+    from app import job_queue
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+
+    batch_id = uuid4()
+    ids = [uuid4() for _ in range(3)]
+    async with AsyncSessionLocal() as db:
+        for i, export_id in enumerate(ids):
+            db.add(Export(
+                id=export_id, status="cancelled" if i == 2 else "pending", batch_id=batch_id,
+                created_at=datetime.now(timezone.utc), options=job_queue.encode_options(columns="id"),
+            ))
+        await db.commit()
+    try:
+        claimed = await job_queue.claim_batch(worker_id, batch_id)
+        again = await job_queue.claim_batch("another-worker", batch_id)
+        return ids, claimed, again, batch_id
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Export).where(Export.id.in_(ids)))
+            await db.commit()
+
+
+def test_claim_batch_leases_the_runnable_members_once(database):
+    ids, claimed, again, batch_id = run(_claim_batch("worker-a"))
+
+    assert sorted(row.id for row in claimed) == sorted(ids[:2])
+    assert all(row.batch_id == batch_id for row in claimed)
+    assert again == []
@@ -0,0 +1,108 @@
+"""Compressed artifacts: codecs, levels, Accept-Encoding and an export with compression."""
+import gzip
+import os
+
+import pytest
+
+from conftest import run, run_export
+from app.compression import compress_file, iter_compressed, parse_accept_encoding, validate_level
+
+
+def test_validate_level():
+    assert validate_level("gzip") == 6
+    assert validate_level("zstd", 19) == 19
+    with pytest.raises(ValueError):
+        validate_level("gzip", 10)
+
+
+def test_parse_accept_encoding_drops_q0():
+    assert parse_accept_encoding("gzip;q=0.5, zstd, br;q=0") == {"gzip", "zstd"}
+    assert parse_accept_encoding("") == set()
+
+
+def test_gzip_file_round_trip(tmp_path):
+    src = tmp_path / "export.csv"
+    src.write_bytes(b"id,email\n" + b"1,a@example.com\n" * 10000)
+    dst = tmp_path / "export.csv.gz"
+
+    size = compress_file(str(src), str(dst), "gzip")
+
+    assert size == os.path.getsize(dst) < os.path.getsize(src)
+    assert gzip.decompress(dst.read_bytes()) == src.read_bytes()
+    assert gzip.decompress(b"".join(iter_compressed(str(src), "gzip", 1))) == src.read_bytes()
+
+
+def test_zstd_file_round_trip(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    src = tmp_path / "export.csv"
+    src.write_bytes(b"id,email\n" + b"1,a@example.com\n" * 10000)
+    dst = tmp_path / "export.csv.zst"
+
+    compress_file(str(src), str(dst), "zstd", 3)
+
+    with zstandard.ZstdDecompressor().stream_reader(open(dst, "rb")) as reader:
+        assert reader.read() == src.read_bytes()
+
+
+def test_writer_compresses_while_writing(tmp_path):
+    pytest.importorskip("dotenv")
+    from app.file_writer import BufferedFileWriter
+
+    path = str(tmp_path / "export.csv")
+
+    async def write():
+        async with BufferedFileWriter(path, buffer_size=4096, compression="gzip", compression_level=1) as out:
+            for i in range(5000):
+                await out.write(b"%d,user%d@example.com\n" % (i, i))
+                if i == 2500:
+                    await out.flush(durable=True)
+        return out
+
+    out = run(write())
+
+    assert out.compressed_path == path + ".gz"
+    assert out.compressed_size == os.path.getsize(out.compressed_path)
+    with open(path, "rb") as plain, open(out.compressed_path, "rb") as packed:
+        assert gzip.decompress(packed.read()) == plain.read()
+    with pytest.raises(ValueError):
+        BufferedFileWriter(path, append=True, compression="gzip")
+
+
+def test_progress_sums_writer_stats(tmp_path):
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.export_service import ExportProgress
+    from app.file_writer import BufferedFileWriter
+
+    async def write(path):
+        async with BufferedFileWriter(str(path)) as out:
+            await out.write(b"x" * 10000)
+        return out
+
+    progress = ExportProgress("x", 1)
+    progress.writers = [run(write(tmp_path / "a.csv")), run(write(tmp_path / "b.csv"))]
+
+    stats = progress.writer_stats()
+    assert (stats["queueDepth"], stats["bytesWritten"]) == (0, 20000)
+
+
+@pytest.mark.parametrize("options", [
+    {"export_engine": "orm"},
+    {"export_engine": "copy"},
+    {"export_format": "ndjson"},
+    # Stitched shards are compressed after the fact
+    {"export_engine": "orm", "shards": 2},
+])
+def test_export_stores_the_compressed_artifact(database, tmp_path, monkeypatch, options):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+
+    export = run(run_export(country_code="DE", columns="id,email", compression="gzip", compression_level=1, **options))
+
+    assert export.status == "completed", export.error
+    assert export.compression == "gzip"
+    assert export.file_size == os.path.getsize(export.file_path)
+    assert export.compressed_size == os.path.getsize(export.compressed_path)
+    with open(export.file_path, "rb") as plain, open(export.compressed_path, "rb") as packed:
+        assert gzip.decompress(packed.read()) == plain.read()
+    os.remove(export.file_path)
+    os.remove(export.compressed_path)
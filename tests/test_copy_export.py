@@ -0,0 +1,62 @@
+"""engine=copy: the statement handed to asyncpg, and a COPY export end to end."""
+import os
+from decimal import Decimal
+
+import pytest
+
+from conftest import run, run_export, scalar
+
+
+def test_build_copy_sql_is_a_bare_select():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.export_service import build_copy_sql
+
+    sql, args, options = build_copy_sql(["id", "email"], {"country_code": ["DE", "FR"], "min_ltv": "10.00"}, delimiter=";")
+    # copy_from_query adds COPY (...) TO STDOUT around it
+    assert sql == "SELECT id, email FROM users WHERE country_code = ANY($1) AND lifetime_value >= $2::numeric"
+    assert args == [["DE", "FR"], Decimal("10.00")]
+    assert options == {"format": "csv", "header": True, "delimiter": ";", "quote": '"'}
+
+
+def test_build_copy_sql_rejects_clashing_dialect():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.export_service import build_copy_sql
+
+    with pytest.raises(ValueError):
+        build_copy_sql(["id"], delimiter="|", quotechar="|")
+
+
+def test_validate_dialect_refuses_clashing_dialect():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("dotenv")
+    from fastapi import HTTPException
+    from app.routes import validate_dialect
+
+    validate_dialect(";", "'")
+    for delimiter, quotechar in (("|", "|"), (";", ";"), ('"', None)):
+        with pytest.raises(HTTPException) as raised:
+            validate_dialect(delimiter, quotechar)
+        assert raised.value.status_code == 400
+
+
+def test_copy_export_end_to_end(database, tmp_path, monkeypatch):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+
+    from sqlalchemy import select, func
+    from app.models import User
+
+    expected = run(scalar(select(func.count()).select_from(User).where(User.country_code == "DE")))
+    if not expected:
+        pytest.skip("no users to export")
+    export = run(run_export(country_code="DE", columns="id,country_code", delimiter=";", export_engine="copy"))
+
+    assert export.status == "completed", export.error
+    assert export.total_rows == expected
+    with open(export.file_path, "rb") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == b"id;country_code"
+    assert len(lines) == expected + 1
+    assert all(line.endswith(b";DE") for line in lines[1:])
+    os.remove(export.file_path)
@@ -0,0 +1,106 @@
+"""Range, If-Range and 416 handling of export downloads."""
+import os
+from email.utils import formatdate
+
+import pytest
+
+pytest.importorskip("starlette")
+
+from app.downloads import MAX_RANGES, conditional_file_response, make_etag, parse_range  # noqa: E402
+
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = {name.replace("_", "-"): value for name, value in headers.items()}
+
+
+@pytest.mark.parametrize("header,expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=0-", [(0, 999)]),
+    ("bytes=990-2000", [(990, 999)]),
+    ("bytes=-100", [(900, 999)]),
+    ("bytes=-5000", [(0, 999)]),
+    ("bytes=0-0, 10-19", [(0, 0), (10, 19)]),
+    ("BYTES=5-9", [(5, 9)]),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    assert parse_range(header, 1000) == []
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-9", "bytes=", "bytes=abc-", "bytes=9-5", "bytes=5",
+    "bytes=" + ",".join(f"{i}-{i}" for i in range(MAX_RANGES + 1)),
+])
+def test_parse_range_ignored(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.fixture
+def export_file(tmp_path):
+    path = tmp_path / "export_test.csv"
+    path.write_bytes(bytes(range(256)) * 4)
+    stat = os.stat(path)
+    return str(path), make_etag("test", "identity", stat), stat
+
+
+def respond(export_file, **headers):
+    path, etag, _ = export_file
+    return conditional_file_response(FakeRequest(**headers), path, etag, "text/csv", {})
+
+
+def test_full_response(export_file):
+    response = respond(export_file)
+    assert response.status_code == 200
+    assert response.headers["content-length"] == "1024"
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_single_range(export_file):
+    response = respond(export_file, Range="bytes=100-199")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 100-199/1024"
+    assert response.headers["content-length"] == "100"
+
+
+def test_multi_range(export_file):
+    response = respond(export_file, Range="bytes=0-9,20-29")
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges; boundary=")
+
+
+def test_unsatisfiable_range(export_file):
+    response = respond(export_file, Range="bytes=5000-")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_malformed_range_is_ignored(export_file):
+    assert respond(export_file, Range="bytes=9-5").status_code == 200
+
+
+def test_if_none_match(export_file):
+    _, etag, _ = export_file
+    assert respond(export_file, If_None_Match=etag).status_code == 304
+
+
+def test_if_range_etag(export_file):
+    _, etag, _ = export_file
+    assert respond(export_file, Range="bytes=0-9", If_Range=etag).status_code == 206
+    # A changed file: the whole file instead of a range of the wrong bytes
+    assert respond(export_file, Range="bytes=0-9", If_Range='"other"').status_code == 200
+    # Weak validators never match
+    assert respond(export_file, Range="bytes=0-9", If_Range="W/" + etag).status_code == 200
+
+
+def test_if_range_date(export_file):
+    _, _, stat = export_file
+    current = formatdate(stat.st_mtime, usegmt=True)
+    stale = formatdate(stat.st_mtime - 3600, usegmt=True)
+    assert respond(export_file, Range="bytes=0-9", If_Range=current).status_code == 206
+    assert respond(export_file, Range="bytes=0-9", If_Range=stale).status_code == 200
+    assert respond(export_file, Range="bytes=0-9", If_Range="not a date").status_code == 200
@@ -0,0 +1,123 @@
+"""Filter validation and the SQL the filters compile to."""
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+from sqlalchemy import select, and_  # noqa: E402
+from sqlalchemy.dialects.postgresql.asyncpg import dialect as asyncpg_dialect  # noqa: E402
+
+from app.filters import (  # noqa: E402
+    MAX_VALUES, InvalidFilter, copy_filter_clauses, encode_filters, filter_conditions, filters_from_options,
+    normalize_filters, shape_names,
+)
+from app.models import User  # noqa: E402
+
+
+def compiled(spec) -> str:
+    query = select(User.id).where(and_(*filter_conditions(spec)))
+    return str(query.compile(dialect=asyncpg_dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_normalize_lists():
+    spec = normalize_filters(country_code=["US,DE", " FR ", "US"], subscription_tier="pro",
+                             email_domain=["@Acme.com", "acme.com", "example"])
+    assert spec == {
+        "country_code": ["DE", "FR", "US"],
+        "subscription_tier": ["pro"],
+        "email_domain": ["acme.com", "example"],
+    }
+
+
+def test_normalize_ranges():
+    spec = normalize_filters(min_ltv=10, max_ltv="20.5", signup_from="2024-01-01",
+                             signup_to="2024-02-01T00:00:00+02:00", min_id="5", max_id=9)
+    assert spec == {
+        "min_ltv": "10.00",
+        "max_ltv": "20.50",
+        "signup_from": "2024-01-01T00:00:00+00:00",
+        "signup_to": "2024-01-31T22:00:00+00:00",
+        "min_id": 5,
+        "max_id": 9,
+    }
+
+
+def test_normalize_is_canonical():
+    one = normalize_filters(country_code=["US", "DE"], min_ltv=1)
+    other = normalize_filters(min_ltv="1.0", country_code="DE,US")
+    assert encode_filters(one) == encode_filters(other)
+    assert normalize_filters() == {}
+
+
+@pytest.mark.parametrize("params,message", [
+    ({"min_ltv": 5, "max_ltv": 1}, "min_ltv is greater than max_ltv"),
+    ({"signup_from": "2024-02-01", "signup_to": "2024-01-01"}, "signup_from must be before signup_to"),
+    ({"signup_from": "2024-01-01", "signup_to": "2024-01-01"}, "signup_from must be before signup_to"),
+    ({"min_id": 10, "max_id": 1}, "min_id is greater than max_id"),
+    ({"signup_from": "yesterday"}, "signup_from must be an ISO 8601 date or timestamp"),
+    ({"email_domain": "acme%"}, "Invalid email_domain"),
+    ({"email_domain": "a_b"}, "Invalid email_domain"),
+    ({"country_code": [str(i) for i in range(MAX_VALUES + 1)]}, f"at most {MAX_VALUES} values"),
+    ({"city": "Paris"}, "Unknown filters: city"),
+])
+def test_invalid_filters(params, message):
+    with pytest.raises(InvalidFilter, match=message):
+        normalize_filters(**params)
+
+
+def test_legacy_options():
+    assert filters_from_options({"country_code": "US", "min_ltv": 3}) == {"country_code": ["US"], "min_ltv": "3.00"}
+    assert filters_from_options({"filters": {"min_id": 1}, "country_code": "US"}) == {"min_id": 1}
+
+
+def test_conditions_sql():
+    sql = compiled(normalize_filters(
+        country_code="US", subscription_tier=["free", "pro"], min_ltv=10, max_ltv=20,
+        signup_from="2024-01-01", signup_to="2024-02-01", min_id=1, max_id=100,
+    ))
+    # One value is an equality, more are an IN list
+    assert "users.country_code = 'US'" in sql
+    assert "users.subscription_tier IN ('free', 'pro')" in sql
+    assert "users.lifetime_value >= 10.00" in sql
+    assert "users.lifetime_value <= 20.00" in sql
+    # The signup window is half open
+    assert "users.signup_date >= " in sql
+    assert "users.signup_date < " in sql
+    assert "users.id >= 1" in sql
+    assert "users.id <= 100" in sql
+
+
+def test_email_domain_sql_matches_the_index():
+    sql = compiled(normalize_filters(email_domain=["acme", "example.org"]))
+    # Inline constants, as in idx_users_email_domain, so the planner can use the index
+    assert "lower(split_part(users.email, '@', 2)) LIKE 'acme%'" in sql
+    assert "lower(split_part(users.email, '@', 2)) LIKE 'example.org%'" in sql
+    assert " OR " in sql
+
+
+def test_copy_clauses():
+    args = ["earlier"]
+    clauses = copy_filter_clauses(normalize_filters(
+        country_code=["DE", "US"], subscription_tier="pro", max_ltv=5, signup_from="2024-01-01",
+        min_id=3, email_domain=["acme", "corp"],
+    ), args)
+    assert clauses == [
+        "country_code = ANY($2)",
+        "subscription_tier = $3",
+        "lifetime_value <= $4::numeric",
+        "signup_date >= $5",
+        "id >= $6",
+        "(lower(split_part(email, '@', 2)) LIKE $7 OR lower(split_part(email, '@', 2)) LIKE $8)",
+    ]
+    assert args == [
+        "earlier", ["DE", "US"], "pro", Decimal("5.00"), datetime(2024, 1, 1, tzinfo=timezone.utc), 3,
+        "acme%", "corp%",
+    ]
+
+
+def test_shape_names():
+    spec = normalize_filters(country_code="US", signup_from="2024-01-01", signup_to="2024-02-01", max_id=9)
+    assert shape_names(spec) == ["country_code", "id", "signup_date"]
@@ -0,0 +1,77 @@
+"""NDJSON, Parquet and Arrow IPC exports."""
+import json
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from conftest import run, run_export
+
+
+def test_encode_ndjson():
+    from app.formats import encode_ndjson
+
+    rows = [(1, Decimal("10.50"), datetime(2024, 1, 2, tzinfo=timezone.utc)), (2, None, None)]
+    lines = encode_ndjson(rows, ["id", "lifetime_value", "signup_date"]).decode().splitlines()
+
+    assert json.loads(lines[0]) == {"id": 1, "lifetime_value": "10.50", "signup_date": "2024-01-02T00:00:00+00:00"}
+    assert json.loads(lines[1]) == {"id": 2, "lifetime_value": None, "signup_date": None}
+
+
+def test_arrow_refuses_gzip():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("dotenv")
+    from fastapi import HTTPException
+    from app.routes import validate_export_options
+
+    validate_export_options(",", '"', "orm", "gzip", None, "parquet")
+    validate_export_options(",", '"', "orm", None, None, "arrow")
+    with pytest.raises(HTTPException) as raised:
+        validate_export_options(",", '"', "orm", "gzip", None, "arrow")
+    assert raised.value.status_code == 400
+
+
+def test_rows_to_batch_types_the_columns():
+    pa = pytest.importorskip("pyarrow")
+    from app.formats import arrow_schema, rows_to_batch
+
+    schema = arrow_schema(["id", "country_code", "lifetime_value"])
+    batch = rows_to_batch([(1, "DE", Decimal("1.25")), (2, "DE", None)], schema)
+
+    assert batch.schema == schema
+    assert batch.column(1).type == pa.dictionary(pa.int32(), pa.string())
+    assert batch.column(2).to_pylist() == [Decimal("1.25"), None]
+    assert rows_to_batch([], schema).num_rows == 0
+
+
+def _read(export):
+    if export.format == "ndjson":
+        with open(export.file_path, "rb") as f:
+            return [json.loads(line)["id"] for line in f]
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if export.format == "parquet":
+        table = pq.read_table(export.file_path)
+    else:
+        with pa.ipc.open_stream(export.file_path) as reader:
+            table = reader.read_all()
+    assert table.schema.field("signup_date").type == pa.timestamp("us", tz="UTC")
+    return table.column("id").to_pylist()
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "parquet", "arrow"])
+def test_export_formats_hold_every_row(database, tmp_path, monkeypatch, fmt):
+    if fmt != "ndjson":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+
+    export = run(run_export(country_code="DE", columns="id,signup_date,lifetime_value", export_format=fmt))
+
+    assert export.status == "completed", export.error
+    assert export.format == fmt
+    ids = _read(export)
+    assert len(ids) == len(set(ids)) == export.total_rows
+    os.remove(export.file_path)
@@ -0,0 +1,70 @@
+"""MemoryGovernor: full grants, shrunk grants, the FIFO wait queue and footprints."""
+import asyncio
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("dotenv")
+
+from app.governor import MIN_BATCH_ROWS, Footprint, MemoryGovernor, job_footprint  # noqa: E402
+
+
+def test_grants_in_full_then_shrinks():
+    async def scenario():
+        governor = MemoryGovernor(1000)
+        first = await governor.acquire("a", 600)
+        # Only 400 left: enough for the minimum, so the job gets what is free
+        second = await governor.acquire("b", 600, minimum=300)
+        return first, second, governor.free
+
+    assert run(scenario()) == (600, 400, 0)
+
+
+def test_waiters_are_served_in_order():
+    async def scenario():
+        governor = MemoryGovernor(1000)
+        await governor.acquire("a", 800)
+        big = asyncio.ensure_future(governor.acquire("big", 900))
+        small = asyncio.ensure_future(governor.acquire("small", 100))
+        await asyncio.sleep(0)
+        # The small job would fit, but must not overtake the big one
+        queued = (governor.position("big"), governor.position("small"), governor.admittable(100), small.done())
+        governor.release("a")
+        return queued, await big, await small
+
+    queued, granted_big, granted_small = run(scenario())
+
+    assert queued == (1, 2, 0, False)
+    assert (granted_big, granted_small) == (900, 100)
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    async def scenario():
+        governor = MemoryGovernor(100)
+        await governor.acquire("a", 100)
+        with pytest.raises(asyncio.TimeoutError):
+            await governor.acquire("b", 50, timeout=0.01)
+        return governor.waiters, governor.holders
+
+    assert run(scenario()) == ([], {"a": 100})
+
+
+def test_oversized_request_is_capped_to_the_budget():
+    async def scenario():
+        governor = MemoryGovernor(100)
+        return await governor.acquire("a", 10 ** 9)
+
+    assert run(scenario()) == 100
+
+
+def test_footprints():
+    footprint = Footprint(fixed=1000, per_row=10, batch_rows=5000)
+    assert footprint.want == 51000
+    assert footprint.minimum == 1000 + 10 * MIN_BATCH_ROWS
+    assert footprint.batch_rows_for(21000) == 2000
+    assert footprint.batch_rows_for(0) == MIN_BATCH_ROWS
+
+    # COPY renders rows in Postgres: no per-row cost on our side
+    assert job_footprint(3, export_engine="copy").per_row == 0
+    assert job_footprint(3, shards=2).per_row == 2 * job_footprint(3).per_row
@@ -0,0 +1,183 @@
+"""The exports-table job queue: leases, heartbeats, hand-backs and the worker loop."""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+from conftest import run
+
+
+async def _enqueue(**fields):
+    from app.database import AsyncSessionLocal
+    from app.job_queue import encode_options
+    from app.models import Export
+
+    export_id = uuid4()
+    # Every option, as POST /exports/csv stores them
+    fields.setdefault("options", encode_options(
+        country_code="DE", columns="id,country_code", delimiter=",", quotechar='"',
+        export_engine="orm", shards=1, export_format="csv",
+    ))
+    # Outrank anything else waiting in the table
+    fields.setdefault("priority", 1000)
+    async with AsyncSessionLocal() as db:
+        db.add(Export(id=export_id, status="pending", created_at=datetime.now(timezone.utc), **fields))
+        await db.commit()
+    return export_id
+
+
+async def _get(export_id):
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+
+    async with AsyncSessionLocal() as db:
+        return await db.get(Export, export_id)
+
+
+async def _set(export_id, **fields):
+    from sqlalchemy import update
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Export).where(Export.id == export_id).values(**fields))
+        await db.commit()
+
+
+async def _drop(export_id):
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+
+    async with AsyncSessionLocal() as db:
+        await db.delete(await db.get(Export, export_id))
+        await db.commit()
+
+
+@pytest.fixture
+def job(database):
+    export_id = run(_enqueue())
+    yield export_id
+    run(_drop(export_id))
+
+
+def test_encode_options_keeps_only_job_options():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.job_queue import decode_options, encode_options
+
+    raw = encode_options(country_code="DE", shards=2, unknown="x")
+    assert "unknown" not in raw
+    assert decode_options(raw)["shards"] == 2
+    assert decode_options(raw)["country_code"] == "DE"
+
+
+def test_claim_leases_the_job_once(job):
+    from app import job_queue
+
+    claimed = run(job_queue.claim_jobs("worker-a", 1))
+    again = run(job_queue.claim_jobs("worker-b", 10))
+    row = run(_get(job))
+
+    assert [row.id for row in claimed] == [job]
+    assert job not in [row.id for row in again]
+    assert (row.status, row.worker_id, row.attempts) == ("processing", "worker-a", 1)
+    assert row.lease_expires_at > datetime.now(timezone.utc)
+
+
+def test_heartbeat_reports_only_owned_jobs(job):
+    from app import job_queue
+
+    run(job_queue.claim_jobs("worker-a", 1))
+
+    assert run(job_queue.heartbeat("worker-a", {job})) == {job}
+    assert run(job_queue.heartbeat("worker-b", {job})) == set()
+    # A cancel from the API takes the job away from its worker
+    run(_set(job, status="cancelled"))
+    assert run(job_queue.heartbeat("worker-a", {job})) == set()
+
+
+def test_expired_lease_is_reclaimed(job):
+    from app import job_queue
+
+    run(job_queue.claim_jobs("worker-a", 1))
+    run(_set(job, lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+
+    claimed = run(job_queue.claim_jobs("worker-b", 1))
+    row = run(_get(job))
+
+    assert [row.id for row in claimed] == [job]
+    assert (row.worker_id, row.attempts) == ("worker-b", 2)
+
+
+def test_exhausted_job_fails(job):
+    from app import job_queue
+    from app.config import settings
+
+    run(_set(job, status="processing", attempts=settings.WORKER_MAX_ATTEMPTS,
+             lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+
+    claimed = run(job_queue.claim_jobs("worker-a", 10))
+    assert job not in [row.id for row in claimed]
+    run(job_queue.fail_exhausted_jobs())
+    assert run(_get(job)).status == "failed"
+
+
+def test_requeue_orphans_fails_exhausted_jobs(job):
+    from app import job_queue
+    from app.config import settings
+
+    exhausted = run(_enqueue())
+    try:
+        # Both left behind without a lease, one of them out of attempts
+        run(_set(job, status="processing", attempts=1, lease_expires_at=None))
+        run(_set(exhausted, status="processing", attempts=settings.WORKER_MAX_ATTEMPTS, lease_expires_at=None))
+
+        requeued = run(job_queue.requeue_orphans())
+
+        assert job in requeued and exhausted not in requeued
+        assert run(_get(job)).status == "pending"
+        assert run(_get(exhausted)).status == "failed"
+    finally:
+        run(_drop(exhausted))
+
+
+def test_release_does_not_count_an_attempt(job):
+    from app import job_queue
+
+    run(job_queue.claim_jobs("worker-a", 1))
+    run(job_queue.release_jobs("worker-a", [job]))
+    row = run(_get(job))
+
+    assert (row.status, row.worker_id, row.attempts) == ("pending", None, 0)
+
+
+async def _work_until_done(export_id, timeout=30):
+    from app.worker import Worker
+
+    worker = Worker(concurrency=1, poll_interval=0.1)
+    task = asyncio.create_task(worker.run())
+    try:
+        for _ in range(int(timeout / 0.1)):
+            row = await _get(export_id)
+            if row.status not in ("pending", "processing"):
+                return row
+            await asyncio.sleep(0.1)
+        return row
+    finally:
+        worker.stop()
+        await task
+
+
+def test_worker_runs_a_queued_export(job, tmp_path, monkeypatch):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+
+    row = run(_work_until_done(job))
+
+    assert row.status == "completed", row.error
+    with open(row.file_path, "rb") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == b"id,country_code"
+    assert len(lines) == row.total_rows + 1
+    os.remove(row.file_path)
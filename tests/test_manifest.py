@@ -0,0 +1,114 @@
+"""Split exports: numbered parts, the manifest that lists them, and resuming after a part."""
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from conftest import run, run_export
+
+
+def _parts(export):
+    """(manifest, [lines of each part]) of a finished split export."""
+    manifest = json.loads(export.manifest)
+    export_dir = os.path.dirname(export.file_path)
+    parts = []
+    for part in manifest["parts"]:
+        with open(os.path.join(export_dir, part["file"]), "rb") as f:
+            data = f.read()
+        assert part["size"] == len(data)
+        assert part["sha256"] == hashlib.sha256(data).hexdigest()
+        if manifest["compression"] == "gzip":
+            data = gzip.decompress(data)
+        parts.append(data.splitlines())
+    return manifest, parts
+
+
+def test_manifest_load_rejects_garbage():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app import manifest
+
+    assert manifest.load(None) is None
+    assert manifest.load("{") is None
+    assert manifest.load('{"parts": 1}') is None
+    assert manifest.load(manifest.dumps(manifest.new_manifest("x", "csv", {"rows": 5})))["parts"] == []
+
+
+@pytest.mark.parametrize("split,compression", [({"rows": 500}, None), ({"bytes": 4000}, "gzip")])
+def test_split_export_writes_listed_parts(database, tmp_path, monkeypatch, split, compression):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+
+    export = run(run_export(country_code="FR", columns="id,email", split=split, compression=compression))
+    manifest, parts = _parts(export)
+
+    assert export.status == "completed", export.error
+    assert manifest["complete"] and manifest["totalRows"] == export.total_rows
+    assert len(parts) > 1
+    # Every part is a complete file with its own header, in id order
+    assert all(lines[0] == b"id,email" for lines in parts)
+    ids = [int(line.split(b",")[0]) for lines in parts for line in lines[1:]]
+    assert ids == sorted(ids) and len(ids) == export.total_rows
+    for part, lines in zip(manifest["parts"], parts):
+        assert part["rows"] == len(lines) - 1
+        if "rows" in split:
+            assert part["rows"] <= split["rows"]
+        assert (part["minId"], part["maxId"]) == (int(lines[1].split(b",")[0]), int(lines[-1].split(b",")[0]))
+    assert os.path.exists(export.file_path)
+
+
+async def _fail_then_resume(options, fail_at):
+    from app import export_service, manifest as manifests
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+
+    export_id = uuid4()
+    async with AsyncSessionLocal() as db:
+        db.add(Export(id=export_id, status="pending", created_at=datetime.now(timezone.utc)))
+        await db.commit()
+
+    original = manifests.finalize_part
+    calls = []
+
+    def failing_finalize(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == fail_at:
+            raise OSError("disk full")
+        return original(*args, **kwargs)
+
+    try:
+        manifests.finalize_part = failing_finalize
+        try:
+            await export_service.process_export(str(export_id), **options)
+        finally:
+            manifests.finalize_part = original
+        async with AsyncSessionLocal() as db:
+            failed = await db.get(Export, export_id)
+        await export_service.process_export(str(export_id), **options)
+        async with AsyncSessionLocal() as db:
+            return failed, await db.get(Export, export_id)
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.delete(await db.get(Export, export_id))
+            await db.commit()
+
+
+def test_split_export_resumes_after_its_last_listed_part(database, tmp_path, monkeypatch):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+    options = dict(country_code="FR", columns="id,email", split={"rows": 500})
+
+    failed, resumed = run(_fail_then_resume(options, fail_at=3))
+    reference = run(run_export(**options))
+
+    assert failed.status == "failed"
+    assert [part["part"] for part in json.loads(failed.manifest)["parts"]] == [1, 2]
+    assert resumed.status == "completed", resumed.error
+    resumed_manifest, resumed_parts = _parts(resumed)
+    reference_manifest, reference_parts = _parts(reference)
+    assert resumed_parts == reference_parts
+    assert [part["sha256"] for part in resumed_manifest["parts"]] == [
+        part["sha256"] for part in reference_manifest["parts"]
+    ]
@@ -0,0 +1,107 @@
+"""Export events over LISTEN/NOTIFY: fan-out, flushed progress and cross-node cancels."""
+import asyncio
+import json
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+from app.notifications import NotificationListener, cancel_message, progress_message  # noqa: E402
+
+
+def test_slow_subscriber_keeps_the_latest_message():
+    async def scenario():
+        listener = NotificationListener()
+        queue = listener.subscribe("job")
+        for i in range(150):
+            listener._on_notify(None, 0, listener.channel, json.dumps(progress_message("job", "processing", 100, i)))
+        listener._on_notify(None, 0, listener.channel, "not json")
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        listener.unsubscribe("job", queue)
+        return messages, listener.subscribers
+
+    messages, subscribers = run(scenario())
+
+    assert len(messages) == 100
+    assert messages[-1]["progress"]["processedRows"] == 149
+    assert not subscribers
+
+
+async def _listen(scenario):
+    listener = NotificationListener(reconnect_interval=0.5)
+    cancelled = []
+
+    async def on_cancel(export_id):
+        cancelled.append(export_id)
+
+    listener.start(on_cancel=on_cancel)
+    try:
+        for _ in range(50):
+            if listener.connected:
+                break
+            await asyncio.sleep(0.1)
+        return await scenario(listener), cancelled
+    finally:
+        await listener.stop()
+
+
+async def _next(queue, kind):
+    while True:
+        message = await asyncio.wait_for(queue.get(), timeout=5)
+        if message["type"] == kind:
+            return message
+
+
+def test_flushed_progress_is_published(database):
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+    from app.progress import ProgressRegistry
+
+    export_id = uuid4()
+
+    async def scenario(listener):
+        queue = listener.subscribe(export_id)
+        async with AsyncSessionLocal() as db:
+            db.add(Export(id=export_id, status="processing", created_at=datetime.now(timezone.utc)))
+            await db.commit()
+        try:
+            registry = ProgressRegistry()
+            registry.update(str(export_id), total_rows=10, processed_rows=4, percentage=40)
+            await registry.flush()
+            return await _next(queue, "progress")
+        finally:
+            async with AsyncSessionLocal() as db:
+                await db.delete(await db.get(Export, export_id))
+                await db.commit()
+
+    message, _ = run(_listen(scenario))
+
+    assert message["exportId"] == str(export_id)
+    assert message["status"] == "processing"
+    assert message["progress"]["processedRows"] == 4
+    assert message["progress"]["totalRows"] == 10
+
+
+def test_cancel_reaches_the_listening_process(database):
+    from app.database import AsyncSessionLocal
+    from app.notifications import publish
+
+    export_id = str(uuid4())
+
+    async def scenario(listener):
+        queue = listener.subscribe(export_id)
+        async with AsyncSessionLocal() as db:
+            await publish(db, [cancel_message(export_id)])
+            await db.commit()
+        return await _next(queue, "cancel")
+
+    message, cancelled = run(_listen(scenario))
+
+    assert message == {"type": "cancel", "exportId": export_id}
+    assert cancelled == [export_id]
@@ -0,0 +1,79 @@
+"""Export previews and sampled exports."""
+import os
+
+import pytest
+
+from conftest import run, run_export, scalar
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+from app import preview  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.export_service import sample_sql  # noqa: E402
+
+
+def test_sample_percent(monkeypatch):
+    monkeypatch.setattr(settings, "PREVIEW_SAMPLE_ROWS", 1000)
+    assert preview.sample_percent(-1) == 100.0
+    assert preview.sample_percent(100000) == 1.0
+    assert preview.sample_percent(10 ** 12) == preview.MIN_SAMPLE_PERCENT
+
+
+def test_sample_sql_only_inlines_numbers():
+    assert sample_sql({"percent": "2.5", "seed": "7"}) == (
+        "users.ctid = ANY(ARRAY(SELECT ctid FROM users TABLESAMPLE SYSTEM (2.5) REPEATABLE (7)))"
+    )
+    with pytest.raises(ValueError):
+        sample_sql({"percent": "1); DROP TABLE users; --", "seed": 1})
+
+
+async def _preview(limit, **options):
+    from app.database import AsyncSessionLocal
+    from app.export_service import build_filters, resolve_columns
+
+    async with AsyncSessionLocal() as db:
+        return await preview.preview(db, resolve_columns("id,country_code"), build_filters({"country_code": ["DE"]}), limit=limit, **options)
+
+
+def test_preview_is_the_start_of_the_export(database, tmp_path, monkeypatch):
+    from sqlalchemy import select, func
+    from app.models import User
+
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+    # A sample as big as the table makes the estimate exact
+    monkeypatch.setattr(settings, "PREVIEW_SAMPLE_ROWS", 10 ** 9)
+
+    result = run(_preview(5))
+    export = run(run_export(country_code="DE", columns="id,country_code"))
+    with open(export.file_path, "rb") as f:
+        head = f.read().splitlines()[:6]
+    os.remove(export.file_path)
+
+    assert result["rows"] == 5
+    assert result["csv"].encode().splitlines() == head
+    assert result["estimate"]["exact"]
+    assert result["estimate"]["estimatedRows"] == run(scalar(
+        select(func.count()).select_from(User).where(User.country_code == "DE")
+    ))
+    assert 0 < result["estimate"]["projectedGzipBytes"] < result["estimate"]["projectedBytes"]
+
+
+def _ids(export):
+    with open(export.file_path, "rb") as f:
+        ids = [int(line) for line in f.read().splitlines()[1:]]
+    os.remove(export.file_path)
+    return ids
+
+
+def test_sampled_export_is_repeatable_across_engines(database, tmp_path, monkeypatch):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+    sample = {"percent": 20, "seed": 3}
+
+    orm = _ids(run(run_export(columns="id", sample=sample)))
+    copy = _ids(run(run_export(columns="id", sample=sample, export_engine="copy")))
+    everything = run(run_export(columns="id"))
+
+    assert orm == copy
+    assert 0 < len(orm) < everything.total_rows
+    os.remove(everything.file_path)
@@ -0,0 +1,57 @@
+"""ProgressRegistry.flush against Postgres: partial updates keep the other columns."""
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from conftest import run
+
+
+async def _flush_partial():
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+    from app.progress import ProgressRegistry
+
+    export_id = uuid4()
+    created = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as db:
+        db.add(Export(id=export_id, status="processing", created_at=created, total_rows=100, processed_rows=0,
+                      percentage=0, file_size=123))
+        await db.commit()
+
+    registry = ProgressRegistry()
+    try:
+        # Only integer columns are dirty: every other VALUES column is NULL
+        registry.update(str(export_id), processed_rows=40, percentage=40)
+        await registry.flush()
+        async with AsyncSessionLocal() as db:
+            first = await db.get(Export, export_id)
+
+        # Then the terminal status with timestamp and bigint columns
+        completed = datetime.now(timezone.utc)
+        registry.update(str(export_id), status="completed", processed_rows=100, percentage=100,
+                        completed_at=completed, compressed_size=45)
+        await registry.flush()
+        async with AsyncSessionLocal() as db:
+            second = await db.get(Export, export_id)
+        return first, second, completed, registry.get(str(export_id))
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.delete(await db.get(Export, export_id))
+            await db.commit()
+
+
+def test_partial_flush_reaches_the_row(database):
+    first, second, completed, entry = run(_flush_partial())
+
+    assert (first.status, first.processed_rows, first.percentage) == ("processing", 40, 40)
+    # Fields that were not dirty are kept
+    assert first.total_rows == 100
+    assert first.file_size == 123
+    assert first.completed_at is None
+
+    assert second.status == "completed"
+    assert second.processed_rows == 100
+    assert second.completed_at == completed
+    assert second.compressed_size == 45
+    assert second.file_size == 123
+    # A flushed terminal entry leaves the registry
+    assert entry is None
@@ -0,0 +1,112 @@
+"""Export planning: EXPLAIN summaries, lanes, the cost guard, index suggestions and ETAs."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+from app import query_plan  # noqa: E402
+from app.config import settings  # noqa: E402
+
+SHAPE = "test-shape"
+
+
+def test_filter_shape():
+    assert query_plan.filter_shape() == ("none", {})
+    assert query_plan.filter_shape({"country_code": ["DE"], "min_ltv": "5.00"}) == ("country_code+min_ltv", {"country_code": "DE", "min_ltv": "5.00"})
+    assert query_plan.filter_shape(delta={"column": "signup_date"})[0] == "signup_date"
+
+
+def test_lane_for(monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_COST_LOW_PRIORITY", 1000)
+    assert query_plan.lane_for(999) == "normal"
+    assert query_plan.lane_for(1001) == "low"
+
+
+def test_suggest_index():
+    index, _ = query_plan.suggest_index("country_code", 0.05, {"country_code": {"DE": 9, "FR": 1}}, 10)
+    assert index == "CREATE INDEX idx_users_country_code_de_id ON users (id) WHERE country_code = 'DE'"
+
+    index, _ = query_plan.suggest_index("country_code+min_ltv", 0.01, {}, 0)
+    assert index == "CREATE INDEX idx_users_country_code_lifetime_value ON users (country_code, lifetime_value)"
+
+    # Too unselective for any index
+    assert query_plan.suggest_index("subscription_tier", 0.5, {}, 0)[0] is None
+
+
+def test_eta():
+    started = datetime.now(timezone.utc) - timedelta(seconds=10)
+    assert query_plan.eta("processing", 300, 100, started) == {"seconds": 20, "basis": "progress"}
+    assert query_plan.eta("pending", 300, 0, None, rate=30) == {"seconds": 10, "basis": "history"}
+    assert query_plan.eta("completed", 300, 300, started, rate=30) is None
+
+
+async def _plan_and_rate(country_code):
+    from sqlalchemy import select
+    from app.database import AsyncSessionLocal
+    from app.models import User
+
+    async with AsyncSessionLocal() as db:
+        summary = await query_plan.plan_export(
+            db, select(User).where(User.country_code == country_code).order_by(User.id), SHAPE,
+            {"country_code": country_code}
+        )
+        await db.commit()
+    await query_plan.record_run(SHAPE, 1000, 4.0)
+    async with AsyncSessionLocal() as db:
+        return summary, await query_plan.history_rate(db, SHAPE), await query_plan.history_rate(db, "no-such-shape")
+
+
+async def _drop_shape():
+    from sqlalchemy import delete
+    from app.database import AsyncSessionLocal
+    from app.models import ExportPlanStats
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(ExportPlanStats).where(ExportPlanStats.shape == SHAPE))
+        await db.commit()
+
+
+@pytest.fixture
+def shape(database):
+    run(_drop_shape())
+    yield SHAPE
+    run(_drop_shape())
+
+
+def test_plan_export_records_the_shape(shape):
+    summary, rate, overall = run(_plan_and_rate("DE"))
+
+    assert summary["rows"] > 0 and summary["cost"] > 0
+    assert summary["shape"] == SHAPE and summary["lane"] in ("normal", "low")
+    assert rate == 250.0
+    # Shapes without history fall back to the total over all shapes (a float, not a Decimal)
+    assert isinstance(overall, float)
+
+
+def test_cost_guard_refuses_expensive_plans(shape, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_COST_REJECT", 1)
+
+    with pytest.raises(query_plan.CostLimitExceeded):
+        run(_plan_and_rate("DE"))
+
+
+def test_explain_keeps_filter_values_as_arguments(database):
+    from app.database import AsyncSessionLocal
+    from app.export_service import build_query
+    from app.row_count import explain_plan, explain_sql
+
+    # Rendered inline and run through text(), " :name" used to be read as a bind parameter
+    query, _ = build_query({"country_code": ["DE :name", "FR"], "min_ltv": "1.00"})
+    sql, args = explain_sql(query)
+    assert ":name" not in sql
+    assert sorted(map(str, args)) == ["1.00", "DE :name", "FR"]
+
+    async def plan():
+        async with AsyncSessionLocal() as db:
+            return await explain_plan(db, query)
+
+    assert run(plan())[0]["Plan"]["Plan Rows"] >= 1
@@ -0,0 +1,50 @@
+"""Row count strategies: exact, planner estimate, and exact count alongside the export."""
+import os
+
+import pytest
+
+from conftest import run, run_export, scalar
+
+
+def _count(country_code):
+    from sqlalchemy import select, func
+    from app.models import User
+
+    return run(scalar(select(func.count()).select_from(User).where(User.country_code == country_code)))
+
+
+def test_estimated_progress_stops_short_of_100():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.export_service import ExportProgress
+
+    assert ExportProgress("x", 100, estimated=True).percentage(150) == 99
+    assert ExportProgress("x", 100).percentage(150) == 100
+
+
+def test_initial_total(database):
+    from sqlalchemy import select
+    from app import row_count
+    from app.models import User
+
+    expected = _count("DE")
+    query = select(User).where(User.country_code == "DE")
+
+    assert run(row_count.initial_total(query, "exact")) == (expected, False)
+    estimate, estimated = run(row_count.initial_total(query, "estimate"))
+    assert estimated and estimate > 0
+    # Unfiltered: pg_class.reltuples (the test database is analyzed)
+    assert run(row_count.estimate_rows(select(User), filtered=False)) > 0
+
+
+@pytest.mark.parametrize("strategy", ["exact", "concurrent", "estimate"])
+def test_export_ends_with_the_exact_total(database, tmp_path, monkeypatch, strategy):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+
+    export = run(run_export(country_code="DE", columns="id", count_strategy=strategy))
+
+    assert export.status == "completed", export.error
+    assert export.total_rows == export.processed_rows == _count("DE")
+    assert export.total_rows_estimated is False
+    assert export.percentage == 100
+    os.remove(export.file_path)
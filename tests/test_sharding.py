@@ -0,0 +1,63 @@
+"""shards=N: splitting the id range and stitching the part files back together."""
+import os
+import pytest
+
+from conftest import run, run_export
+
+
+def test_split_id_range_covers_the_range_contiguously():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.export_service import split_id_range
+
+    ranges = split_id_range(1, 10, 3)
+    assert ranges == [(1, 4), (5, 7), (8, 10)]
+    assert all(hi + 1 == lo for (_, hi), (lo, _) in zip(ranges, ranges[1:]))
+
+
+def test_split_id_range_never_makes_empty_shards():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.export_service import split_id_range
+
+    assert split_id_range(5, 6, 4) == [(5, 5), (6, 6)]
+    assert split_id_range(7, 7, 3) == [(7, 7)]
+
+
+def test_shards_fit_the_export_pool(monkeypatch):
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.config import settings
+    from app.export_service import max_export_shards
+
+    monkeypatch.setattr(settings, "EXPORT_POOL_SIZE", 8)
+    monkeypatch.setattr(settings, "MAX_EXPORT_SHARDS", 4)
+    # Two jobs of 3 shards plus a count each: 8 connections
+    assert max_export_shards(2) == 3
+    assert max_export_shards(1) == 4
+    assert max_export_shards(4) == 1
+    assert max_export_shards(16) == 1
+
+
+def _lines(export):
+    with open(export.file_path, "rb") as f:
+        lines = f.read().splitlines()
+    os.remove(export.file_path)
+    return lines
+
+
+@pytest.mark.parametrize("engine", ["orm", "copy"])
+def test_sharded_export_matches_a_single_pass(database, tmp_path, monkeypatch, engine):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+    options = dict(country_code="DE", columns="id,country_code", export_engine=engine)
+
+    single = run(run_export(**options))
+    sharded = run(run_export(shards=3, **options))
+
+    assert single.status == sharded.status == "completed", sharded.error
+    assert sharded.total_rows == single.total_rows
+    single_lines, sharded_lines = _lines(single), _lines(sharded)
+    # One header, then the same rows; leftover part files are removed
+    assert sharded_lines[0] == single_lines[0] == b"id,country_code"
+    assert sorted(sharded_lines[1:]) == sorted(single_lines[1:])
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,170 @@
+"""Storage lifecycle: TTL sweeps, the disk quota, startup reconciliation and cache key retirement."""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+from conftest import run
+
+
+def _ago(**delta):
+    return datetime.now(timezone.utc) - timedelta(**delta)
+
+
+@pytest.fixture
+def storage(database, tmp_path, monkeypatch):
+    """Creates exports rows (and their files in a fresh EXPORT_STORAGE_PATH), dropped afterwards."""
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+    created = []
+
+    def make(status="completed", size=100, **fields):
+        from app.database import AsyncSessionLocal
+        from app.models import Export
+
+        export_id = fields.pop("id", None) or uuid4()
+        if size is not None and "file_path" not in fields:
+            fields["file_path"] = str(tmp_path / f"export_{export_id}.csv")
+            with open(fields["file_path"], "wb") as f:
+                f.write(b"x" * size)
+            fields.setdefault("file_size", size)
+        fields.setdefault("created_at", _ago(hours=1))
+        if status == "completed":
+            fields.setdefault("completed_at", _ago(minutes=30))
+
+        async def insert():
+            async with AsyncSessionLocal() as db:
+                db.add(Export(id=export_id, status=status, **fields))
+                await db.commit()
+
+        run(insert())
+        created.append(export_id)
+        return export_id
+
+    yield make
+
+    async def drop():
+        from sqlalchemy import delete
+        from app.database import AsyncSessionLocal
+        from app.models import Export
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Export).where(Export.id.in_(created)))
+            await db.commit()
+
+    run(drop())
+
+
+def _get(export_id):
+    from app.database import AsyncSessionLocal
+    from app.models import Export
+
+    async def get():
+        async with AsyncSessionLocal() as db:
+            return await db.get(Export, export_id)
+
+    return run(get())
+
+
+def test_expire_due_removes_files_and_cache_hits(storage):
+    from app import storage as lifecycle
+
+    due = storage(expires_at=_ago(seconds=1))
+    hit = storage(size=None, source_export_id=due, file_path=_get(due).file_path)
+    live = storage(expires_at=_ago(seconds=-3600))
+
+    assert run(lifecycle.expire_due()) >= 1
+
+    assert (_get(due).status, _get(hit).status, _get(live).status) == ("expired", "expired", "completed")
+    assert not os.path.exists(_get(due).file_path)
+    assert os.path.exists(_get(live).file_path)
+
+
+def test_quota_evicts_least_recently_downloaded(storage, monkeypatch):
+    from app import storage as lifecycle
+    from app.config import settings
+
+    old = storage(size=600, last_accessed_at=_ago(days=2))
+    recent = storage(size=600, last_accessed_at=_ago(minutes=1))
+    monkeypatch.setattr(settings, "EXPORT_STORAGE_QUOTA", 1000)
+
+    assert run(lifecycle.enforce_quota()) == 1
+
+    assert _get(old).status == "expired"
+    assert not os.path.exists(_get(old).file_path)
+    assert _get(recent).status == "completed"
+
+
+def test_reconcile_fixes_rows_and_removes_orphans(storage, tmp_path):
+    from app import storage as lifecycle
+
+    missing = storage()
+    os.remove(_get(missing).file_path)
+    failed = storage(status="failed", size=None, checkpoint='{"id_ranges": [null], "shards": []}')
+    intact = storage()
+    orphan = tmp_path / f"export_{uuid4()}.csv.part0"
+    orphan.write_bytes(b"left behind")
+    stale = time.time() - 2 * lifecycle.ORPHAN_GRACE_SECONDS
+    os.utime(orphan, (stale, stale))
+    fresh = tmp_path / f"export_{uuid4()}.csv"
+    fresh.write_bytes(b"row not committed yet")
+
+    summary = run(lifecycle.reconcile())
+
+    assert summary["orphanFiles"] == 1 and summary["expired"] >= 1
+    assert _get(missing).status == "expired"
+    assert _get(failed).checkpoint is None
+    assert _get(intact).status == "completed"
+    assert not orphan.exists()
+    assert fresh.exists()
+
+
+def test_cache_evict_only_retires_keys(storage, monkeypatch):
+    from app import result_cache
+    from app.config import settings
+
+    stale = storage(cache_key="stale-key", completed_at=_ago(hours=2))
+    fresh = storage(cache_key="fresh-key", completed_at=_ago(minutes=1))
+    monkeypatch.setattr(settings, "EXPORT_CACHE_TTL", 3600)
+
+    run(result_cache.evict())
+
+    assert (_get(stale).cache_key, _get(stale).status) == (None, "completed")
+    assert os.path.exists(_get(stale).file_path)
+    assert _get(fresh).cache_key == "fresh-key"
+
+
+def _split(storage, tmp_path, parts_on_disk):
+    """A completed split export listing two parts, of which `parts_on_disk` exist (made stale)."""
+    from app import manifest as manifests
+    from app import storage as lifecycle
+
+    export_id = uuid4()
+    manifest = manifests.new_manifest(str(export_id), "csv", {"rows": 10})
+    stale = time.time() - 2 * lifecycle.ORPHAN_GRACE_SECONDS
+    paths = [manifests.manifest_path(str(tmp_path), str(export_id))]
+    for number in (1, 2):
+        path = manifests.part_path(str(tmp_path), str(export_id), number, "csv")
+        manifest["parts"].append({"part": number, "file": os.path.basename(path)})
+        if number <= parts_on_disk:
+            paths.append(path)
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(b"x")
+        os.utime(path, (stale, stale))
+    storage(id=export_id, size=None, file_path=paths[0], manifest=manifests.dumps(manifest))
+    return export_id, paths
+
+
+def test_reconcile_keeps_listed_parts_and_expires_split_exports_missing_one(storage, tmp_path):
+    from app import storage as lifecycle
+
+    whole, whole_paths = _split(storage, tmp_path, parts_on_disk=2)
+    broken, _ = _split(storage, tmp_path, parts_on_disk=1)
+
+    run(lifecycle.reconcile())
+
+    assert _get(whole).status == "completed"
+    assert all(os.path.exists(path) for path in whole_paths)
+    assert _get(broken).status == "expired"
@@ -0,0 +1,50 @@
+"""GET /exports/csv/stream: stream_export straight from the cursor."""
+import gzip
+
+import pytest
+
+from conftest import run, scalar
+
+
+async def _collect(disconnected=False, **options):
+    from app.export_service import stream_export
+
+    async def is_disconnected():
+        return disconnected
+
+    return b"".join([chunk async for chunk in stream_export(is_disconnected, **options)])
+
+
+def _expected_rows(country_code):
+    from sqlalchemy import select, func
+    from app.models import User
+
+    return run(scalar(select(func.count()).select_from(User).where(User.country_code == country_code)))
+
+
+def test_stream_export_writes_every_row(database):
+    expected = _expected_rows("DE")
+    if not expected:
+        pytest.skip("no users to export")
+
+    body = run(_collect(filters={"country_code": ["DE"]}, columns="id,country_code", delimiter=";", batch_rows=1000))
+
+    lines = body.splitlines()
+    assert lines[0] == b"id;country_code"
+    assert len(lines) == expected + 1
+    assert all(line.endswith(b";DE") for line in lines[1:])
+
+
+def test_stream_export_gzip_matches_plain(database):
+    options = dict(filters={"country_code": ["DE"]}, columns="id,email", batch_rows=1000)
+
+    plain = run(_collect(**options))
+    packed = run(_collect(compression="gzip", compression_level=1, **options))
+
+    assert gzip.decompress(packed) == plain
+
+
+def test_stream_export_stops_when_the_client_leaves(database):
+    body = run(_collect(disconnected=True, columns="id"))
+
+    assert body == b"id\r\n"
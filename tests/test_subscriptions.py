@@ -0,0 +1,124 @@
+"""Delta exports: watermark ranges, the watermark move on completion and compaction."""
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import run, run_export
+
+NAME = "test-delta-subscription"
+
+
+def test_watermark_values_round_trip():
+    pytest.importorskip("sqlalchemy")
+    pytest.importorskip("dotenv")
+    from app.subscriptions import format_watermark, parse_watermark
+
+    moment = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    assert parse_watermark("signup_date", format_watermark(moment)) == moment
+    assert parse_watermark("id", format_watermark(42)) == 42
+    assert parse_watermark("id", None) is None
+
+
+async def _create_subscription():
+    from app.database import AsyncSessionLocal
+    from app.job_queue import encode_options
+    from app.models import ExportSubscription
+
+    async with AsyncSessionLocal() as db:
+        db.add(ExportSubscription(
+            name=NAME,
+            watermark_column="id",
+            options=encode_options(country_code="DE", columns="id", export_format="csv"),
+            created_at=datetime.now(timezone.utc),
+        ))
+        await db.commit()
+
+
+async def _drop_subscription():
+    from sqlalchemy import delete
+    from app.database import AsyncSessionLocal
+    from app.models import Export, ExportSubscription
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Export).where(Export.subscription == NAME))
+        await db.execute(delete(ExportSubscription).where(ExportSubscription.name == NAME))
+        await db.commit()
+
+
+async def _state():
+    from app.database import AsyncSessionLocal
+    from app.models import Export, ExportSubscription
+
+    async with AsyncSessionLocal() as db:
+        subscription = await db.get(ExportSubscription, NAME)
+        snapshot = None
+        if subscription.snapshot_export_id:
+            snapshot = await db.get(Export, subscription.snapshot_export_id)
+        return subscription, snapshot
+
+
+async def _de_ids():
+    from sqlalchemy import select
+    from app.database import AsyncSessionLocal
+    from app.models import User
+
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(User.id).where(User.country_code == "DE").order_by(User.id))).scalars().all()
+
+
+@pytest.fixture
+def subscription(database, tmp_path, monkeypatch):
+    monkeypatch.setenv("EXPORT_STORAGE_PATH", str(tmp_path))
+    run(_drop_subscription())
+    run(_create_subscription())
+    yield NAME
+    run(_drop_subscription())
+
+
+def _ids(path):
+    with open(path, "rb") as f:
+        return [int(line) for line in f.read().splitlines()[1:]]
+
+
+@pytest.mark.parametrize("engine", ["orm", "copy"])
+def test_deltas_move_the_watermark_and_compact(subscription, engine):
+    ids = run(_de_ids())
+    middle = str(ids[len(ids) // 2])
+    options = dict(country_code="DE", columns="id", export_engine=engine)
+
+    first = run(run_export(
+        delta={"subscription": NAME, "column": "id", "after": None, "upto": middle, "compact": True},
+        **options
+    ))
+    after_first, first_snapshot = run(_state())
+    second = run(run_export(
+        delta={"subscription": NAME, "column": "id", "after": middle, "upto": str(ids[-1]), "compact": True},
+        **options
+    ))
+    after_second, snapshot = run(_state())
+
+    assert first.status == second.status == "completed", (first.error, second.error)
+    assert after_first.watermark == middle
+    assert _ids(first.file_path) == [i for i in ids if i <= int(middle)]
+    assert sorted(_ids(second.file_path)) == [i for i in ids if i > int(middle)]
+    assert after_second.watermark == str(ids[-1])
+    assert after_second.last_export_id == second.id
+    # The new snapshot is the previous one plus the second delta; the previous one is retired
+    assert sorted(_ids(snapshot.file_path)) == ids
+    assert snapshot.total_rows == len(ids)
+    assert snapshot.id != first_snapshot.id
+    assert not os.path.exists(first_snapshot.file_path)
+    for path in (first.file_path, second.file_path, snapshot.file_path):
+        os.remove(path)
+
+
+def test_delta_with_a_stale_watermark_fails(subscription):
+    stale = {"subscription": NAME, "column": "id", "after": "1", "upto": "100"}
+
+    export = run(run_export(country_code="DE", columns="id", delta=stale))
+    state, _ = run(_state())
+
+    assert export.status == "failed"
+    assert "Watermark" in export.error
+    assert state.watermark is None